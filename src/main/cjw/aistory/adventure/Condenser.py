@@ -1,4 +1,9 @@
+from typing import Dict
+
 from cjw.aistory.adventure.Teller import Teller
+from cjw.aistory.utilities.Deadline import Deadline
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+from cjw.aistory.utilities.Tracer import Tracer
 
 
 class Condenser:
@@ -16,7 +21,8 @@ class Condenser:
             userRoleName=prompt.userRoleName,
         )
 
-    async def condense(self, story: str) -> str:
+    @Tracer.traced()
+    async def condense(self, story: str, deadline: Deadline = None, tags: Dict[str, str] = None) -> str:
         lengthRequirement = "" if self.folds <= 0 else self.DEFAULT_LENGTH_REQUIREMENT.format(
             numWords=len(story.split()) // self.folds
         )
@@ -24,6 +30,8 @@ class Condenser:
         prompt = self.teller.createPrompt()
         prompt.system("\n".join([self.instruction, lengthRequirement]))
         prompt.user(story)
-        condensed = await self.teller.generate(prompt)
+        condensed = await self.teller.generate(
+            prompt, priority=RequestScheduler.Priority.CONDENSE, deadline=deadline, tags=tags
+        )
 
         return condensed if condensed else None
@@ -1,6 +1,11 @@
+from typing import Dict
+
 from cjw.aistory.adventure.Condenser import Condenser
 from cjw.aistory.adventure.Teller import Teller
 from cjw.aistory.utilities.ChatPrompt import ChatPrompt
+from cjw.aistory.utilities.Deadline import Deadline
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+from cjw.aistory.utilities.Tracer import Tracer
 
 
 class DevelopmentCondenser(Condenser):
@@ -27,7 +32,8 @@ class DevelopmentCondenser(Condenser):
             userRoleName=prompt.userRoleName,
         )
 
-    async def condense(self, story: str | ChatPrompt) -> str:
+    @Tracer.traced()
+    async def condense(self, story: str | ChatPrompt, deadline: Deadline = None, tags: Dict[str, str] = None) -> str:
 
         prompt = self.teller.createPrompt()
 
@@ -37,7 +43,9 @@ class DevelopmentCondenser(Condenser):
             prompt.insert(story)
 
         prompt.system(self.instruction)
-        summary = await self.teller.generate(prompt)
+        summary = await self.teller.generate(
+            prompt, priority=RequestScheduler.Priority.CONDENSE, deadline=deadline, tags=tags
+        )
 
         if summary:
             result = f"Summary of story thus far:\n\n{summary}"
@@ -48,7 +56,9 @@ class DevelopmentCondenser(Condenser):
             prompt.delete(-1)
 
         prompt.system(self.requirementInstruction, replace=False)
-        condensed = await self.teller.generate(prompt)
+        condensed = await self.teller.generate(
+            prompt, priority=RequestScheduler.Priority.CONDENSE, deadline=deadline, tags=tags
+        )
 
         result += f"Requirements for storyline development:\n\n{condensed}" if condensed else ""
 
@@ -1,16 +1,22 @@
+from typing import Dict
+
 from cjw.aistory.adventure.Teller import Teller
 from cjw.aistory.utilities.ChatPrompt import ChatPrompt
+from cjw.aistory.utilities.Deadline import Deadline
 from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+from cjw.aistory.utilities.Tracer import Tracer
 
 
 class GptTeller(Teller):
 
     @classmethod
-    def of(cls, key: str) -> "GptTeller":
-        return GptTeller(GptPortal.of(key))
+    def of(cls, key: str, model: str = None) -> "GptTeller":
+        return GptTeller(GptPortal.of(key), model)
 
-    def __init__(self, gpt: GptPortal):
+    def __init__(self, gpt: GptPortal, model: str = None):
         self.portal = gpt
+        self.model = model or GptPortal.defaultModelOf("chatCompletion")
 
     def getName(self) -> str:
         return "gpt"
@@ -18,10 +24,20 @@ class GptTeller(Teller):
     def isCompatible(self, name: str) -> bool:
         return name in [self.getName()]
 
-    async def generate(self, prompt: ChatPrompt, redo: bool = True) -> str:
+    @Tracer.traced(attributes=lambda self, *args, **kwargs: {"teller": self.getName()})
+    async def generate(
+            self,
+            prompt: ChatPrompt,
+            redo: bool = True,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            deadline: Deadline = None,
+            tags: Dict[str, str] = None,
+    ) -> str:
 
         try:
-            completed = await self.portal.chatCompletion(prompt.messages)
+            completed = await self.portal.chatCompletion(
+                prompt.messages, model=self.model, priority=priority, deadline=deadline, tags=tags
+            )
         except GptPortal.TooManyTokensError as e:
             raise Teller.TooManyTokensError(e)
 
@@ -32,9 +48,9 @@ class GptTeller(Teller):
 
     def getNumTokens(self, prompt: str | ChatPrompt) -> int:
         if isinstance(prompt, str):
-            return self.portal.estimateTokens(prompt)
+            return self.portal.estimateTokens(prompt, model=self.model)
         else:
-            return sum(self.portal.estimateTokens(m["content"]) for m in prompt.messages)
+            return sum(self.portal.estimateTokensMany([m["content"] for m in prompt.messages], model=self.model))
 
     def createPrompt(self) -> ChatPrompt:
         return ChatPrompt(bot="assistant")
@@ -1,3 +1,5 @@
+from typing import Dict
+
 from cjw.aistory.adventure.Teller import Teller
 
 
@@ -8,7 +10,7 @@ class Paraphraser:
         self.firstDraft = firstDraft
         self.setting = setting
 
-    async def rephrase(self, instruction: str = None):
+    async def rephrase(self, instruction: str = None, tags: Dict[str, str] = None):
         prompt = self.teller.createPrompt()
         setting = f"""
         Story setting:
@@ -38,6 +40,6 @@ class Paraphraser:
             instruction = "Please paraphrase."
 
         prompt.user(instruction)
-        rephrased = await self.teller.generate(prompt)
+        rephrased = await self.teller.generate(prompt, tags=tags)
 
         return rephrased if rephrased else None
@@ -192,5 +192,5 @@ class PolishProgressStory(Story):
         userMessage = self.archivedPrompt.getContent(-2)
         botMessage = self.archivedPrompt.getContent(-1)
         worker = Paraphraser(self.teller, userMessage, botMessage)
-        return await worker.rephrase(instruction=instruction)
+        return await worker.rephrase(instruction=instruction, tags=self._tags("paraphrase"))
 
@@ -1,14 +1,18 @@
 import json
+import logging
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Dict, List
 
 from cjw.aistory.adventure.Condenser import Condenser
 from cjw.aistory.adventure.Paraphraser import Paraphraser
 from cjw.aistory.adventure.Teller import Teller
 from cjw.aistory.utilities.ChatPrompt import ChatPrompt
+from cjw.aistory.utilities.Deadline import Deadline
+from cjw.aistory.utilities.Tracer import Tracer
 
 
 class Story(ABC):
+    logger = logging.getLogger(__qualname__)
 
     class IncompatibleStoryTypeError(Exception):
         def __init__(self, right: str, wrong: str):
@@ -20,6 +24,7 @@ class Story(ABC):
 
     DEFAULT_MAX_PROMPT_TOKENS = 6500
     DEFAULT_PRESERVED_FROM_CONDENSE = 3
+    DEFAULT_CONDENSE_SECONDS = 30.0  # Expected time of condensing, which waits for a whole completion
 
     def __init__(
             self,
@@ -30,13 +35,17 @@ class Story(ABC):
             condenseFolds: int = 3,
             preservedFromCondense=DEFAULT_PRESERVED_FROM_CONDENSE,
             condenseReview: bool = False,
+            condenseSeconds: float = DEFAULT_CONDENSE_SECONDS,
+            storyId: str = None,
     ):
         self.teller = teller
+        self.storyId = storyId
         self.condenser = Condenser(teller, condenseFolds)
         self.maxPromptTokens = maxPromptTokens
 
         self.preservedFromCondense = preservedFromCondense
         self.condenseReview = condenseReview
+        self.condenseSeconds = condenseSeconds
 
         self.workingPrompt = self.teller.createPrompt()
         self.archivedPrompt = self.teller.createPrompt()
@@ -55,10 +64,14 @@ class Story(ABC):
         self.uncondensedMessages = 0
         self.currentPromptTokens = self.teller.getNumTokens(self.workingPrompt)
 
+    def _tags(self, purpose: str) -> Dict[str, str]:
+        return {"story": self.storyId, "purpose": purpose}
+
     @abstractmethod
     def _createInstruction(self, customized: str = None) -> str:
         pass
 
+    @Tracer.traced(attributes=lambda self, *args, **kwargs: {"story": self.storyId})
     async def add(self, content: str, replace: bool = True) -> "Story":
         if replace and self.archivedPrompt.getRole(-1) == self.archivedPrompt.userRoleName:
             # Replacing the last user message, so adjust the accounting as if the last item was removed
@@ -134,7 +147,8 @@ class Story(ABC):
         self.archivedPrompt.delete(begin, end)
         return self
 
-    async def generate(self, redo: bool = True, generated: str = None) -> str:
+    @Tracer.traced(attributes=lambda self, *args, **kwargs: {"story": self.storyId})
+    async def generate(self, redo: bool = True, generated: str = None, deadline: Deadline = None) -> str:
 
         if redo and self.archivedPrompt.getRole(-1) == self.archivedPrompt.botRoleName:
             # Remove the last generated message
@@ -142,10 +156,17 @@ class Story(ABC):
 
         if not generated:
             try:
-                response = await self.teller.generate(self.workingPrompt, redo=redo)
+                response = await self.teller.generate(
+                    self.workingPrompt, redo=redo, deadline=deadline, tags=self._tags("generate")
+                )
             except Teller.TooManyTokensError:
-                await self.condense()
-                response = await self.teller.generate(self.workingPrompt, redo=redo)
+                if deadline and not deadline.allows(self.condenseSeconds):
+                    # No time to condense and generate again
+                    raise
+                await self.condense(deadline=deadline)
+                response = await self.teller.generate(
+                    self.workingPrompt, redo=redo, deadline=deadline, tags=self._tags("generate")
+                )
         else:
             response = generated
             self.workingPrompt.bot(response, redo)
@@ -155,7 +176,12 @@ class Story(ABC):
         self.currentPromptTokens += self.teller.getNumTokens(response)
 
         if self.currentPromptTokens > self.maxPromptTokens:
-            await self.condense()
+            if deadline and not deadline.allows(self.condenseSeconds):
+                # The response is kept.  Condensing is deferred to the next message added, which finds the story
+                # still over the limit.
+                self.logger.info(f"Deferred condensing story {self.storyId}, {deadline.remaining():.1f}s left")
+            else:
+                await self.condense(deadline=deadline)
 
         return response
 
@@ -186,6 +212,7 @@ class Story(ABC):
             "instruction": self.instruction,
             "setting": self.setting,
             "preservedFromCondense": self.preservedFromCondense,
+            "storyId": self.storyId,
         }
 
         condensed = self.getCondensed()
@@ -212,6 +239,7 @@ class Story(ABC):
         self.instruction = properties.get("instruction", None)
         self.setting = properties.get("setting", None)
         self.maxPromptTokens = properties.get("maxPromptTokens", self.DEFAULT_MAX_PROMPT_TOKENS)
+        self.storyId = properties.get("storyId", self.storyId)
 
         self.archivedPrompt = self.teller.createPrompt()
         self.workingPrompt = self.teller.createPrompt()
@@ -247,12 +275,13 @@ class Story(ABC):
                     self.archivedPrompt.system(m["content"], replace=False)
                     self.workingPrompt.system(m["content"], replace=False)
 
-    async def condense(self):
+    @Tracer.traced(attributes=lambda self, *args, **kwargs: {"story": self.storyId})
+    async def condense(self, deadline: Deadline = None):
         prompt = self.archivedPrompt if self.condensingFromArchive else self.workingPrompt
         story = self._getStoryToCondense(prompt)
 
         try:
-            condensed = await self.condenser.condense(story)
+            condensed = await self.condenser.condense(story, deadline=deadline, tags=self._tags("condense"))
         except Teller.TooManyTokensError as e:
             if not self.condensingFromArchive:
                 # Too many tokens even condensing from condensed.
@@ -264,7 +293,7 @@ class Story(ABC):
             # From now on condense from the working version
             self.condensingFromArchive = False
             story = self._getStoryToCondense(self.workingPrompt)
-            condensed = await self.condenser.condense(story)
+            condensed = await self.condenser.condense(story, deadline=deadline, tags=self._tags("condense"))
 
         preservedIndex = self._getFirstUncondensedIndex(prompt)
 
@@ -299,7 +328,7 @@ class Story(ABC):
     async def rework(self, instruction: str) -> str:
         message = self.archivedPrompt.getContent(-1)
         worker = Paraphraser(self.teller, message, setting=self.setting)
-        return await worker.rephrase(instruction=instruction)
+        return await worker.rephrase(instruction=instruction, tags=self._tags("paraphrase"))
 
     def show(self, working: bool = True):
         if working:
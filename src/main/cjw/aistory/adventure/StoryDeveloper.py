@@ -135,4 +135,4 @@ class StoryDeveloper(Story):
             return story
 
     async def summarize(self) -> str:
-        return await self.condenser.condense(self.archivedPrompt)
+        return await self.condenser.condense(self.archivedPrompt, tags=self._tags("condense"))
@@ -1,6 +1,9 @@
 from abc import ABC, abstractmethod
+from typing import Dict
 
 from cjw.aistory.utilities.ChatPrompt import ChatPrompt
+from cjw.aistory.utilities.Deadline import Deadline
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
 
 
 class Teller(ABC):
@@ -19,7 +22,14 @@ class Teller(ABC):
         pass
 
     @abstractmethod
-    async def generate(self, prompt: ChatPrompt, redo: bool = True) -> str:
+    async def generate(
+            self,
+            prompt: ChatPrompt,
+            redo: bool = True,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            deadline: Deadline = None,
+            tags: Dict[str, str] = None,
+    ) -> str:
         pass
 
     @abstractmethod
@@ -1,8 +1,7 @@
-from fastapi import APIRouter
-
-
 class Adventure:
     def __init__(self):
+        from fastapi import APIRouter
+
         self.router = APIRouter()
         self.router.add_api_route("/adventure/persona", self.setPersona, methods=["GET"])
 
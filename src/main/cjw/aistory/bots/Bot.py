@@ -2,8 +2,6 @@ import os
 from abc import ABC, abstractmethod
 from typing import List
 
-import jsonpickle
-
 from cjw.aistory.bots.Persona import Persona
 from cjw.aistory.bots.Utterance import Utterance
 
@@ -67,7 +65,10 @@ class Bot(ABC):
         Abstract method for making the bot respond to the latest conversation.
 
         Args:
-            **kwargs: Additional keyword arguments
+            **kwargs: Additional keyword arguments, including
+                priority (RequestScheduler.Priority): Priority of the request to the model (default: INTERACTIVE)
+                deadline (Deadline): Deadline of the request to the model (default: None for no limit)
+                tags (Dict[str, str]): Who makes the request, for the usage ledger (optional)
 
         Returns:
             List[Utterance]: List of utterances as the bot's response
@@ -186,6 +187,8 @@ class Bot(ABC):
         if not os.path.exists(directory):
             os.makedirs(directory)
 
+        import jsonpickle
+
         pickled = jsonpickle.encode(self, indent=indent)
         with open(file, "w") as fd:
             fd.write(pickled)
@@ -204,4 +207,6 @@ class Bot(ABC):
         with open(file, "r") as fd:
             data = fd.read()
 
+        import jsonpickle
+
         return jsonpickle.decode(data)
@@ -5,6 +5,8 @@ from typing import List, TypeVar
 from cjw.aistory.bots.Bot import Bot
 from cjw.aistory.bots.Utterance import Utterance
 from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+from cjw.aistory.utilities.Tracer import Tracer
 
 
 class GptBot(Bot):
@@ -105,6 +107,7 @@ class GptBot(Bot):
     def __utteranceCreator(cls, creator: str):
         return Utterance.Creator.USER if creator == "user" else Utterance.Creator.AI
 
+    @Tracer.traced(attributes=lambda self, **kwargs: {"model": self.getModelName()})
     async def respond(self, **kwargs) -> List[Utterance]:
         if not self.__portal:
             self.withKey()
@@ -114,6 +117,9 @@ class GptBot(Bot):
         delimiter = kwargs.get("delimiter", "\n")
         narrating = kwargs.get("narrating", True)
         updateConversation = kwargs.get("updateConversation", True)
+        priority = kwargs.get("priority", RequestScheduler.Priority.INTERACTIVE)
+        deadline = kwargs.get("deadline")
+        tags = kwargs.get("tags")
 
         # For displaying in the logger for troubleshooting
         newConversation = messages if self._lastResponseEnd < 0 else messages[self._lastResponseEnd + 1:]
@@ -121,7 +127,9 @@ class GptBot(Bot):
         for c in newConversation:
             self.logger.info(f"role={c['role']}, content={c['content']}")
 
-        responses = await self.__portal.chatCompletion(messages, temperature=0.9)
+        responses = await self.__portal.chatCompletion(
+            messages, temperature=0.9, priority=priority, deadline=deadline, tags=tags
+        )
 
         self.logger.info(f"Received responses from OpenAI:")
         for r in responses:
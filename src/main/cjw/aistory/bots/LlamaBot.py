@@ -5,6 +5,7 @@ from typing import List, TypeVar
 from cjw.aistory.bots.Bot import Bot
 from cjw.aistory.bots.Utterance import Utterance
 from cjw.aistory.utilities.LlamaPortal import LlamaPortal
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
 
 
 class LlamaBot(Bot):
@@ -44,7 +45,11 @@ class LlamaBot(Bot):
 
     def withKey(self, key: str = None) -> "LlamaBot":
         accessKey = key if key else os.environ.get("HUGGINGFACEHUB_API_TOKEN")
-        self.__portal = LlamaPortal.of(accessKey)
+        if self.__portal:
+            self.__portal.close()
+
+        # Bots of the same model share it through the model registry, which loads it on first use
+        self.__portal = LlamaPortal.of(self.__model, key=accessKey)
         return self
 
     def __createPrompt(self) -> List[dict]:
@@ -65,6 +70,9 @@ class LlamaBot(Bot):
         delimiter = kwargs.get("delimiter", "\n")
         narrating = kwargs.get("narrating", True)
         updateConversation = kwargs.get("updateConversation", True)
+        priority = kwargs.get("priority", RequestScheduler.Priority.INTERACTIVE)
+        deadline = kwargs.get("deadline")
+        tags = kwargs.get("tags")
 
         # For displaying in the logger for troubleshooting
         newConversation = messages if self._lastResponseEnd < 0 else messages[self._lastResponseEnd + 1:]
@@ -72,7 +80,9 @@ class LlamaBot(Bot):
         for c in newConversation:
             self.logger.info(f"role={c['role']}, content={c['content']}")
 
-        responses = await self.__portal.chatCompletion(messages, temperature=0.9)
+        responses = await self.__portal.chatCompletion(
+            messages, temperature=0.9, priority=priority, deadline=deadline, tags=tags
+        )
 
         self.logger.info(f"Received responses from OpenAI:")
         for r in responses:
@@ -101,9 +111,9 @@ class LlamaBot(Bot):
         return super().load(file)
 
     def __getstate__(self):
-        """Clear GptPortal so we do not reveal OpenAI API key when serialized with pickle or jsonpickle"""
+        """Clear LlamaPortal so we do not reveal the Hugging Face token when serialized with pickle or jsonpickle"""
         state = self.__dict__.copy()
-        state["_GptBot__portal"] = None
+        state["_LlamaBot__portal"] = None
         return state
 
     @classmethod
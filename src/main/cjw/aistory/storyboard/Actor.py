@@ -5,6 +5,8 @@ from cjw.aistory.bots.Bot import Bot
 from cjw.aistory.bots.GptBot import GptBot
 from cjw.aistory.bots.Utterance import Utterance
 from cjw.aistory.storyboard.StoryFork import StoryFork
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+from cjw.aistory.utilities.Tracer import Tracer
 
 
 class Actor:
@@ -111,6 +113,7 @@ class Actor:
                 (not self.tagExtractor and any([t in act.utterance.content for t in self.conversationEnd]))
         )
 
+    @Tracer.traced(attributes=lambda self, *args, **kwargs: {"actor": self.name})
     async def continueStory(
             self,
             lastAct: StoryFork,
@@ -131,6 +134,9 @@ class Actor:
         alternativeDelimiter = kwargs.get("alternativeDelimiter", self.alternativeDelimiter)
         branchingAlternatives = kwargs.get("branchingAlternatives", self.branchingAlternatives)
         narratingInResponse = kwargs.get("narratingInResponse", self.narratingInResponse)
+        priority = kwargs.get("priority", RequestScheduler.Priority.INTERACTIVE)
+        deadline = kwargs.get("deadline")
+        tags = {**(kwargs.get("tags") or {}), "actor": self.name, "purpose": "respond"}
 
         if self.isConversationEnd(lastAct):
             return
@@ -158,7 +164,10 @@ class Actor:
         responses = await self.bot.respond(
             delimiter=alternativeDelimiter,
             narrating=narratingInResponse,
-            updateConversation=False
+            updateConversation=False,
+            priority=priority,
+            deadline=deadline,
+            tags=tags,
         )
 
         branches = []
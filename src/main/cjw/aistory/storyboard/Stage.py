@@ -3,11 +3,11 @@ import os
 import random
 from typing import List, Dict
 
-import jsonpickle
-
 from cjw.aistory.bots.Utterance import Utterance
 from cjw.aistory.storyboard.Actor import Actor
 from cjw.aistory.storyboard.StoryFork import StoryFork
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+from cjw.aistory.utilities.Tracer import Tracer
 
 
 class Stage:
@@ -53,23 +53,31 @@ class Stage:
         self.actorNames = kwargs.get("actorNames", [str(k) for k in self.actors.keys()])
         self.actorIndices = {n: i for i, n in enumerate(self.actorNames)}
 
+    @Tracer.traced()
     async def act(self, **kwargs) -> "Stage":
         """
         Acts in the stage, continuing the story for each actor.
 
         Args:
-            **kwargs: Additional keyword arguments.
+            **kwargs: Additional keyword arguments.  The requests to the models are of BATCH priority unless
+                priority is given.  Acting stops before the next actor once the deadline, if given, expires.
 
         Returns:
             Stage: The updated stage.
         """
         actors = kwargs.get("actors", self.actorNames)
+        kwargs.setdefault("priority", RequestScheduler.Priority.BATCH)
+        deadline = kwargs.get("deadline")
 
         for s in self.story.getStoryLeads():
             for a in [actor for actor in s.nextActors if actor in actors]:
+                if deadline and deadline.expired():
+                    self.logger.info(f"Deadline expired.  Stopped acting before {a}.")
+                    return self
                 await self.actors[a].continueStory(s, **kwargs)
         return self
 
+    @Tracer.traced()
     async def randomThread(self, maxDepth: int, start: StoryFork = None, **kwargs) -> List[StoryFork]:
         """
         Generates a story line by randomly selecting a branch and following it along
@@ -77,17 +85,24 @@ class Stage:
         Args:
             maxDepth (int): The maximum depth of the random thread.
             start (StoryFork): The starting story fork. If None, uses the stage's initial story fork.
-            **kwargs: Additional keyword arguments.
+            **kwargs: Additional keyword arguments.  The requests to the models are of BATCH priority unless
+                priority is given.  The thread ends early once the deadline, if given, expires.
 
         Returns:
             List[StoryFork]: The random thread of conversation.
         """
+        kwargs.setdefault("priority", RequestScheduler.Priority.BATCH)
+        deadline = kwargs.get("deadline")
         if not start:
             start = self.story
 
         lead: StoryFork = random.choice(start.getStoryLeads())
         storyLine = lead.getPreviousStory()
         for i in range(maxDepth):
+            if deadline and deadline.expired():
+                self.logger.info(f"Deadline expired.  Ending the random thread at depth {i}.")
+                break
+
             actor: str = random.choice(lead.nextActors)
             self.logger.debug(f"{actor} to respond to '{lead}'")
 
@@ -133,6 +148,8 @@ class Stage:
         Returns:
             str: The serialized story board.
         """
+        import jsonpickle
+
         return jsonpickle.encode(self.story, indent=indent)
 
     def replaceStoryBoard(self, data: dict) -> "Stage":
@@ -145,6 +162,8 @@ class Stage:
         Returns:
             Stage: The updated stage.
         """
+        import jsonpickle
+
         self.story = jsonpickle.decode(data)
         return self
 
@@ -160,6 +179,8 @@ class Stage:
         if not os.path.exists(directory):
             os.makedirs(directory)
 
+        import jsonpickle
+
         pickled = jsonpickle.encode(self, indent=indent)
         with open(file, "w") as fd:
             fd.write(pickled)
@@ -178,4 +199,6 @@ class Stage:
         with open(file, "r") as fd:
             data = fd.read()
 
+        import jsonpickle
+
         return jsonpickle.decode(data)
@@ -0,0 +1,171 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+from typing import AsyncIterator, Dict, List
+
+from cjw.aistory.utilities.ResponseCache import ResponseCache
+
+
+class Cassette:
+    """
+    Records API requests and responses to a file, and replays them later without the network, like VCR.
+
+    Recordings are kept as gzipped JSON lines with the latency of each response (and of each chunk of a streamed one),
+    so they can be replayed at the recorded pace, scaled, or at once.  Requests are matched by the same canonical hash
+    as ResponseCache.  Repeated identical requests, e.g. sampled with temperature above 0, get their recorded responses
+    in order, starting over once they are used up.  Only successful responses are recorded.
+
+    Attributes:
+        played (int): Number of responses replayed
+        recorded (int): Number of responses recorded
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    class MissingRecordingError(Exception):  # The request was not recorded in the cassette
+        def __init__(self, message):
+            super().__init__(message)
+
+    RECORD = "record"
+    REPLAY = "replay"
+
+    def __init__(self, file: str, mode: str = REPLAY, latencyScale: float = 0.0):
+        """
+        Initializes a cassette.
+
+        Args:
+            file (str): Path of the recordings, usually ending with .jsonl.gz
+            mode (str): "record" to append new recordings to the file, or "replay" to answer from it
+            latencyScale (float): Factor of the recorded latencies when replaying (default: 0 to answer at once,
+                1 for the recorded pace)
+        """
+        if mode not in [self.RECORD, self.REPLAY]:
+            raise ValueError(f"Unknown cassette mode {mode}")
+
+        self.file = file
+        self.mode = mode
+        self.latencyScale = latencyScale
+
+        self.__recordings: Dict[str, List[dict]] = dict()
+        self.__plays: Dict[str, int] = dict()
+
+        if mode == self.REPLAY:
+            self.__load()
+        else:
+            directory = os.path.dirname(file)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+        self.played = 0
+        self.recorded = 0
+
+    def __load(self):
+        with gzip.open(self.file, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    recording = json.loads(line)
+                    self.__recordings.setdefault(recording["key"], []).append(recording)
+
+        self.logger.info(f"Loaded {sum(len(r) for r in self.__recordings.values())} recordings from {self.file}")
+
+    def __append(self, recording: dict):
+        # Each append is a gzip member of its own, so a crash loses nothing recorded before it
+        with gzip.open(self.file, "at", encoding="utf-8") as f:
+            f.write(json.dumps(recording, separators=(",", ":"), ensure_ascii=False) + "\n")
+        self.recorded += 1
+
+    def recording(self) -> bool:
+        """
+        Returns:
+            bool: True if the cassette records, False if it replays
+        """
+        return self.mode == self.RECORD
+
+    def __next(self, function: str, request: dict) -> dict:
+        key = ResponseCache.keyOf(function, request)
+        recordings = self.__recordings.get(key)
+        if not recordings:
+            raise self.MissingRecordingError(f"No recording of {function} for {json.dumps(request)[:200]}")
+
+        plays = self.__plays.get(key, 0)
+        self.__plays[key] = plays + 1
+        self.played += 1
+        return recordings[plays % len(recordings)]
+
+    def record(self, function: str, request: dict, response: dict, latency: float):
+        """
+        Records the response of a request.
+
+        Args:
+            function (str): API function of the request
+            request (dict): API request payload
+            response (dict): API response
+            latency (float): Seconds the response took
+        """
+        self.__append({
+            "key": ResponseCache.keyOf(function, request),
+            "function": function,
+            "request": request,
+            "response": response,
+            "latency": latency,
+        })
+
+    def recordStream(self, function: str, request: dict, chunks: List[dict], delays: List[float]):
+        """
+        Records the chunks of a streamed response.
+
+        Args:
+            function (str): API function of the request
+            request (dict): API request payload, with stream set
+            chunks (List[dict]): The chunks of the response
+            delays (List[float]): Seconds before each chunk since the previous one (or the request)
+        """
+        self.__append({
+            "key": ResponseCache.keyOf(function, request),
+            "function": function,
+            "request": request,
+            "chunks": chunks,
+            "delays": delays,
+        })
+
+    async def play(self, function: str, request: dict) -> dict:
+        """
+        Replays the response of a request.
+
+        Args:
+            function (str): API function of the request
+            request (dict): API request payload
+
+        Returns:
+            dict: The recorded response
+        """
+        recording = self.__next(function, request)
+        if self.latencyScale:
+            await asyncio.sleep(recording["latency"] * self.latencyScale)
+        return recording["response"]
+
+    async def playStream(self, function: str, request: dict) -> AsyncIterator[dict]:
+        """
+        Replays the chunks of a streamed response.
+
+        Args:
+            function (str): API function of the request
+            request (dict): API request payload, with stream set
+
+        Returns:
+            AsyncIterator[dict]: The recorded chunks
+        """
+        recording = self.__next(function, request)
+        for chunk, delay in zip(recording["chunks"], recording["delays"]):
+            if self.latencyScale:
+                await asyncio.sleep(delay * self.latencyScale)
+            yield chunk
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: Numbers of distinct requests recorded in the file, and of responses played and recorded
+        """
+        return {"requests": len(self.__recordings), "played": self.played, "recorded": self.recorded}
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import time
+from typing import Dict
+
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+
+
+class ConcurrencyGovernor:
+    """
+    Learns how many API calls may be in flight at the same time, the way TCP congestion control does (AIMD).
+
+    The window grows additively, by one slot per window of successful calls, and is cut multiplicatively when a call
+    is rate limited or times out.  Calls beyond the window wait in a RequestScheduler, served by priority.  Congestion
+    reported by calls that started before the last cut does not cut the window again, so a burst of 429s halves it
+    only once.
+
+    Attributes:
+        window (float): Current number of calls allowed in flight
+        inFlight (int): Number of calls in flight
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    DEFAULT_INITIAL_WINDOW = 8
+    DEFAULT_MIN_WINDOW = 1
+    DEFAULT_MAX_WINDOW = 256
+    DEFAULT_INCREASE = 1  # Slots added per window of successful calls
+    DEFAULT_DECREASE = 0.5  # Factor of the window on congestion
+
+    __shared: "ConcurrencyGovernor" = None
+
+    class Slot:
+        """
+        Permission for one call to be in flight.  Use it as an async context manager around the call, and report
+        congestion (rate limiting or timeouts) with congested(), other failures with failed(), or a call given up on
+        by its caller with abandoned().  Leaving with a timeout counts as congestion too, and leaving with any other
+        error neither grows nor cuts the window.
+        """
+
+        def __init__(self, governor: "ConcurrencyGovernor", priority: RequestScheduler.Priority):
+            self.governor = governor
+            self.priority = priority
+            self.epoch = None
+            self.outcome: bool | None = None
+            self.reported = False
+
+        def congested(self):
+            """
+            Reports that the call was rate limited or timed out.
+            """
+            self.outcome = False
+            self.reported = True
+
+        def failed(self):
+            """
+            Reports that the call failed for reasons other than congestion.
+            """
+            if not self.reported:
+                self.outcome = None
+                self.reported = True
+
+        def abandoned(self):
+            """
+            Reports that the caller gave up on the call, as when its own deadline ran out.  The timeout says nothing
+            of the server, so it neither grows nor cuts the window.
+            """
+            if not self.reported:
+                self.outcome = None
+                self.reported = True
+
+        async def __aenter__(self) -> "ConcurrencyGovernor.Slot":
+            self.epoch = await self.governor.acquire(self.priority)
+            return self
+
+        async def __aexit__(self, excType, excValue, traceback):
+            if not self.reported:
+                if excType is None:
+                    self.outcome = True
+                elif issubclass(excType, asyncio.TimeoutError):
+                    self.outcome = False
+            self.governor.release(self.epoch, self.outcome)
+
+    @classmethod
+    def shared(cls) -> "ConcurrencyGovernor":
+        """
+        Returns:
+            ConcurrencyGovernor: The governor shared by all portals of the process
+        """
+        if cls.__shared is None:
+            cls.__shared = ConcurrencyGovernor()
+        return cls.__shared
+
+    def __init__(
+            self,
+            initialWindow: float = DEFAULT_INITIAL_WINDOW,
+            minWindow: float = DEFAULT_MIN_WINDOW,
+            maxWindow: float = DEFAULT_MAX_WINDOW,
+            increase: float = DEFAULT_INCREASE,
+            decrease: float = DEFAULT_DECREASE,
+            scheduler: RequestScheduler = None,
+    ):
+        """
+        Initializes a governor.  Use shared() to get the one of the process.
+
+        Args:
+            initialWindow (float): Number of calls allowed in flight at first
+            minWindow (float): Lower bound of the window
+            maxWindow (float): Upper bound of the window
+            increase (float): Slots added per window of successful calls
+            decrease (float): Factor of the window on congestion
+            scheduler (RequestScheduler): Queue of the calls waiting for slots (default: a new RequestScheduler)
+        """
+        self.minWindow = minWindow
+        self.maxWindow = maxWindow
+        self.increase = increase
+        self.decrease = decrease
+
+        self.window = float(min(max(initialWindow, minWindow), maxWindow))
+        self.inFlight = 0
+        self.scheduler = scheduler or RequestScheduler()
+        self.__epoch = 0
+
+        self.acquired = 0
+        self.waited = 0.0  # Total seconds waited for slots
+        self.lastWait = 0.0
+        self.increases = 0
+        self.decreases = 0
+
+    def slot(
+            self, priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE
+    ) -> "ConcurrencyGovernor.Slot":
+        """
+        Args:
+            priority (RequestScheduler.Priority): Priority of the call while waiting for the slot
+
+        Returns:
+            ConcurrencyGovernor.Slot: A slot to enter before making a call
+        """
+        return self.Slot(self, priority)
+
+    def __limit(self) -> int:
+        return max(1, int(self.window))
+
+    async def acquire(self, priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE) -> int:
+        """
+        Waits until a call fits in the window.  Prefer slot(), which releases it for sure.
+
+        Args:
+            priority (RequestScheduler.Priority): Priority of the call while waiting
+
+        Returns:
+            int: Epoch of the window when the call started, to be given back to release()
+        """
+        start = time.monotonic()
+
+        if self.inFlight < self.__limit() and not len(self.scheduler):
+            self.inFlight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.scheduler.push(future, priority)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just as the caller gave up.  Pass it on.
+                    self.inFlight -= 1
+                    self.__wake()
+                else:
+                    self.scheduler.remove(future)
+                raise
+
+        self.lastWait = time.monotonic() - start
+        self.waited += self.lastWait
+        self.acquired += 1
+        return self.__epoch
+
+    def release(self, epoch: int, success: bool | None):
+        """
+        Ends a call and adjusts the window with its outcome.
+
+        Args:
+            epoch (int): Epoch returned by acquire()
+            success (bool | None): True if the call succeeded, False if it met congestion, None if neither
+        """
+        self.inFlight -= 1
+
+        if success is True:
+            self.window = min(self.maxWindow, self.window + self.increase / self.window)
+            self.increases += 1
+        elif success is False and epoch == self.__epoch:
+            self.window = max(self.minWindow, self.window * self.decrease)
+            self.__epoch += 1
+            self.decreases += 1
+            self.logger.info(f"Congestion.  Cutting the concurrency window to {self.window:.1f}")
+
+        self.__wake()
+
+    def __wake(self):
+        while len(self.scheduler) and self.inFlight < self.__limit():
+            future = self.scheduler.pop()
+            if not future.done():
+                self.inFlight += 1
+                future.set_result(None)
+
+    def queueDepth(self) -> int:
+        """
+        Returns:
+            int: Number of calls waiting for slots
+        """
+        return len(self.scheduler)
+
+    def stats(self) -> Dict[str, float | Dict[str, int]]:
+        """
+        Returns:
+            Dict[str, float | Dict[str, int]]: Window size, calls in flight and waiting (also per priority), and the
+                mean and latest wait times in seconds
+        """
+        return {
+            "window": self.window,
+            "inFlight": self.inFlight,
+            "queueDepth": self.queueDepth(),
+            "queues": self.scheduler.depths(),
+            "meanWait": self.waited / self.acquired if self.acquired else 0.0,
+            "lastWait": self.lastWait,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
@@ -0,0 +1,80 @@
+import logging
+import time
+
+
+class Deadline:
+    """
+    The time by which a call chain shall finish, passed down from the API layer to the HTTP calls.
+
+    A deadline may also be cancelled.  Cancelling is cooperative: it does not interrupt what is running, but every
+    step checking the deadline afterwards (retries, continuations, the next actor of a stage) finds it expired.
+    Cancel the asyncio task as well to stop at once.
+
+    Attributes:
+        expiresAt (float | None): time.monotonic() of the deadline, or None for no time limit
+        cancelled (bool): Whether the deadline has been cancelled
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        """
+        Args:
+            seconds (float): Seconds from now
+
+        Returns:
+            Deadline: A deadline that many seconds from now
+        """
+        return Deadline(time.monotonic() + seconds)
+
+    def __init__(self, expiresAt: float = None):
+        """
+        Initializes a deadline.  Use after() for a deadline relative to now.
+
+        Args:
+            expiresAt (float): time.monotonic() of the deadline (default: None for no time limit, only cancelling)
+        """
+        self.expiresAt = expiresAt
+        self.cancelled = False
+        self.reason: str | None = None
+
+    def remaining(self) -> float | None:
+        """
+        Returns:
+            float | None: Seconds left (0 if cancelled), or None if there is no time limit
+        """
+        if self.cancelled:
+            return 0.0
+        if self.expiresAt is None:
+            return None
+        return max(0.0, self.expiresAt - time.monotonic())
+
+    def expired(self) -> bool:
+        """
+        Returns:
+            bool: True if the deadline has passed or been cancelled
+        """
+        return self.remaining() == 0
+
+    def allows(self, seconds: float) -> bool:
+        """
+        Args:
+            seconds (float): Seconds a step is expected to take
+
+        Returns:
+            bool: True if the step may finish before the deadline
+        """
+        remaining = self.remaining()
+        return remaining is None or remaining >= seconds
+
+    def cancel(self, reason: str = None):
+        """
+        Cancels the call chain.
+
+        Args:
+            reason (str): Why it is cancelled, for logging (optional)
+        """
+        self.cancelled = True
+        self.reason = reason
+        self.logger.info(f"Cancelled{': ' + reason if reason else ''}")
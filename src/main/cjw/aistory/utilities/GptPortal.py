@@ -1,11 +1,26 @@
+import asyncio
+import contextlib
 import copy
+import json
 import logging
 import time
-from typing import List, Dict, Callable
+from typing import List, Dict, Callable, Mapping, AsyncIterator, TYPE_CHECKING
 
-import aiohttp
-import openai
-from transformers import GPT2TokenizerFast
+from cjw.aistory.utilities.Cassette import Cassette
+from cjw.aistory.utilities.ConcurrencyGovernor import ConcurrencyGovernor
+from cjw.aistory.utilities.Deadline import Deadline
+from cjw.aistory.utilities.HedgePolicy import HedgePolicy
+from cjw.aistory.utilities.RateLimiter import RateLimiter
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+from cjw.aistory.utilities.ResponseCache import ResponseCache
+from cjw.aistory.utilities.RetryPolicy import RetryPolicy
+from cjw.aistory.utilities.SingleFlight import SingleFlight
+from cjw.aistory.utilities.TokenCounter import TokenCounter
+from cjw.aistory.utilities.Tracer import Tracer
+from cjw.aistory.utilities.UsageLedger import UsageLedger
+
+if TYPE_CHECKING:
+    import aiohttp
 
 
 class GptPortal:
@@ -17,6 +32,12 @@ class GptPortal:
     class ServiceNotAvailableError(Exception):  # Custom exception for service availability errors
         pass
 
+    class DeadlineExceededError(ServiceNotAvailableError):  # The call did not finish within its deadline
+        pass
+
+    class QuotaExceededError(ServiceNotAvailableError):  # The quota of the key is used up
+        pass
+
     class TooManyTokensError(Exception):    # Custom exception for exceeding token limit errors
         def __init__(self, message):
             super().__init__(message)
@@ -26,35 +47,115 @@ class GptPortal:
             super().__init__(message)
 
     __instances: Dict[str, "GptPortal"] = dict()  # Dictionary to store instances of GptPortal
-    __tokenizer = None  # Tokenizer instance
 
     __DEFAULT_MODELS = {  # Dictionary of default models
         "completion": "text-davinci-003",
         "chatCompletion": "gpt-4",
     }
 
-    __RETRY_INTERVAL = 1  # Retry interval in seconds
-    __SLOW_RETRY_INTERVAL = 5  # Slow retry interval in seconds
+    DEFAULT_BASE_URL = "https://api.openai.com/v1"
+    DEFAULT_MAX_CONNECTIONS = 100  # Upper bound of open connections in the pool
+    DEFAULT_MAX_CONNECTIONS_PER_HOST = 32  # Upper bound of open connections to the same host
+    DEFAULT_DNS_CACHE_TTL = 300  # Seconds to cache DNS lookups
+    DEFAULT_KEEP_ALIVE_TIMEOUT = 30  # Seconds to keep an idle connection open for reuse
+    DEFAULT_MAX_CONCURRENT_CONTINUATIONS = 4  # Continuations of truncated choices sent at the same time
+    ADAPTIVE_MAX_TOKENS_FACTOR = 2  # Growth of max_tokens when retrying a truncated choice in the adaptive mode
+    DEFAULT_MAX_BATCH_ITEMS = 20  # Prompts packed into one batched completion request
+    DEFAULT_MAX_BATCH_TOKENS = 8000  # Estimated tokens (prompts and completions) of one batched completion request
+    DEFAULT_MAX_CONCURRENT_BATCHES = 4  # Batched completion requests sent at the same time
+
+    CONTEXT_WINDOWS = {  # Model name prefix: tokens of the context window, shared by the prompt and the completion
+        "gpt-4-1106": 128000,
+        "gpt-4-32k": 32768,
+        "gpt-4": 8192,
+        "gpt-3.5-turbo-1106": 16385,
+        "gpt-3.5-turbo-16k": 16385,
+        "gpt-3.5-turbo-instruct": 4096,
+        "gpt-3.5-turbo": 4096,
+        "text-davinci-003": 4097,
+        "text-davinci-002": 4097,
+        "code-davinci-002": 8001,
+    }
+
+    __CONTINUE_PROMPT = "[continue, but with limits]"  # Asks GPT to continue a response cut short by length
+    __TOKENS_PER_MESSAGE = 4  # Tokens each chat message costs beyond its content
+    __DEFAULT_COMPLETION_TOKENS = 256  # Completion tokens assumed for rate limiting if max_tokens is not given
 
     @classmethod
-    def of(cls, key: str, organization: str = None) -> "GptPortal":
+    def of(cls, key: str, organization: str = None, **kwargs) -> "GptPortal":
         """
         Returns an instance of GptPortal based on the provided key and organization.
-        If an instance with the same key already exists, returns the existing instance.
+        If an instance with the same key already exists, returns the existing instance,
+        so all callers using the same key share its HTTP connection pool.  Unlike a portal constructed directly,
+        it is governed by ConcurrencyGovernor.shared() unless given another governor, or governor=None for none.
 
         Args:
             key (str): API key
             organization (str): Organization (optional)
+            **kwargs: Additional keyword arguments for creating a new instance (see __init__)
 
         Returns:
             GptPortal: Instance of GptPortal
         """
         if key not in cls.__instances:
-            cls.__instances[key] = GptPortal(key, organization)
+            kwargs.setdefault("governor", ConcurrencyGovernor.shared())
+            cls.__instances[key] = GptPortal(key, organization, **kwargs)
 
         return cls.__instances[key]
 
-    def __init__(self, key: str, organization=None, access="openai"):
+    @classmethod
+    def defaultModelOf(cls, function: str) -> str:
+        """
+        Args:
+            function (str): The portal function (completion or chatCompletion)
+
+        Returns:
+            str: The model used by the function if none is given
+        """
+        return cls.__DEFAULT_MODELS[function]
+
+    @classmethod
+    def contextWindowOf(cls, model: str) -> int | None:
+        """
+        Args:
+            model (str): Name of the model
+
+        Returns:
+            int | None: Tokens of the context window of the model, or None if unknown
+        """
+        # The longest matching prefix wins, e.g. gpt-4-32k over gpt-4
+        prefixes = [prefix for prefix in cls.CONTEXT_WINDOWS if model and model.startswith(prefix)]
+        return cls.CONTEXT_WINDOWS[max(prefixes, key=len)] if prefixes else None
+
+    @classmethod
+    async def closeAll(cls):
+        """
+        Closes the connection pools of all the instances handed out by of().
+        """
+        for portal in cls.__instances.values():
+            await portal.aclose()
+
+    def __init__(
+            self,
+            key: str,
+            organization=None,
+            access="openai",
+            baseUrl: str = DEFAULT_BASE_URL,
+            pooled: bool = True,
+            maxConnections: int = DEFAULT_MAX_CONNECTIONS,
+            maxConnectionsPerHost: int = DEFAULT_MAX_CONNECTIONS_PER_HOST,
+            dnsCacheTtl: int = DEFAULT_DNS_CACHE_TTL,
+            keepAliveTimeout: float = DEFAULT_KEEP_ALIVE_TIMEOUT,
+            rateLimited: bool = False,
+            cache: ResponseCache = None,
+            coalescing: bool = True,
+            coalesceNonDeterministic: bool = False,
+            governor: ConcurrencyGovernor = None,
+            hedgePolicy: HedgePolicy = None,
+            tokenBudgeting: str = None,
+            cassette: Cassette = None,
+            ledger: UsageLedger = None,
+    ):
         """
         Initializes an instance of GptPortal.
 
@@ -62,137 +163,927 @@ class GptPortal:
             key (str): API key
             organization (str): Organization (optional)
             access (str): Access mode (openai or http)
+            baseUrl (str): Base URL of the API for the http access mode
+            pooled (bool): Whether the http access mode reuses connections from a long-lived pool (default: True)
+            maxConnections (int): Maximum number of connections in the pool
+            maxConnectionsPerHost (int): Maximum number of connections to the same host in the pool
+            dnsCacheTtl (int): Seconds to cache resolved host names
+            keepAliveTimeout (float): Seconds to keep an idle connection alive for reuse
+            rateLimited (bool): Whether to wait for capacity of the client-side RateLimiter of the key and model
+                before sending requests (default: False)
+            cache (ResponseCache): Cache of responses to identical requests (default: None for no caching)
+            coalescing (bool): Whether concurrent identical requests share a single request in flight (default: True)
+            coalesceNonDeterministic (bool): Whether to coalesce requests with temperature above 0 as well,
+                giving all callers the same sample (default: False)
+            governor (ConcurrencyGovernor): Governor adapting the number of calls in flight, usually
+                ConcurrencyGovernor.shared() (default: None for no limit)
+            hedgePolicy (HedgePolicy): Policy of sending a duplicate of a slow request (default: None for no hedging)
+            tokenBudgeting (str): What to do before sending a request that won't fit in the context window of its
+                model by local estimate: "raise" TooManyTokensError, or "clamp" max_tokens to the room left and raise
+                only if the prompt alone is too long (default: None to leave it to the server)
+            cassette (Cassette): Cassette recording the responses from the network, or replaying them instead
+                (default: None)
+            ledger (UsageLedger): Ledger of the tokens and cost of the calls (default: UsageLedger.shared())
         """
         self.key = key
         self.organization = organization
         self.access = access
+        self.baseUrl = baseUrl.rstrip("/")
+
+        self.pooled = pooled
+        self.maxConnections = maxConnections
+        self.maxConnectionsPerHost = maxConnectionsPerHost
+        self.dnsCacheTtl = dnsCacheTtl
+        self.keepAliveTimeout = keepAliveTimeout
+
+        self.rateLimited = rateLimited
+        self.cache = cache
+        self.singleFlight = SingleFlight() if coalescing else None
+        self.coalesceNonDeterministic = coalesceNonDeterministic
+        self.governor = governor
+        self.hedgePolicy = hedgePolicy
+        self.tokenBudgeting = tokenBudgeting
+        self.cassette = cassette
+        self.ledger = ledger or UsageLedger.shared()
+
+        self.__session: "aiohttp.ClientSession | None" = None
+        self.__sessionLoop: asyncio.AbstractEventLoop | None = None
+
+    async def __aenter__(self) -> "GptPortal":
+        return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        Closes the HTTP connection pool.  A new pool will be created if the instance is used again.
+        """
+        session, self.__session, self.__sessionLoop = self.__session, None, None
+        if session and not session.closed:
+            await session.close()
 
-    async def __usingOpenAI(self, function: Callable, request: dict, retries: int = 1) -> dict:
+    def __createSession(self) -> "aiohttp.ClientSession":
+        """
+        Creates an HTTP session backed by a bounded, keep-alive connection pool.
+
+        Returns:
+            aiohttp.ClientSession: The session
+        """
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=self.maxConnections,
+            limit_per_host=self.maxConnectionsPerHost,
+            ttl_dns_cache=self.dnsCacheTtl,
+            use_dns_cache=True,
+            keepalive_timeout=self.keepAliveTimeout,
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    def __getSession(self) -> "aiohttp.ClientSession":
+        """
+        Returns the pooled HTTP session, creating it when there is none for the running event loop.
+
+        Returns:
+            aiohttp.ClientSession: The pooled session
+        """
+        loop = asyncio.get_running_loop()
+
+        if self.__session is None or self.__session.closed or self.__sessionLoop is not loop:
+            # A session is bound to the event loop creating it, so it cannot be carried over to another loop.
+            self.__session = self.__createSession()
+            self.__sessionLoop = loop
+
+        return self.__session
+
+    def __slot(
+            self,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+    ) -> ConcurrencyGovernor.Slot | contextlib.nullcontext:
+        """
+        Args:
+            priority (RequestScheduler.Priority): Priority of the attempt while waiting for the governor
+
+        Returns:
+            ConcurrencyGovernor.Slot | contextlib.nullcontext: Slot of the governor for one attempt, or a context
+                giving None if not governed
+        """
+        return self.governor.slot(priority) if self.governor else contextlib.nullcontext()
+
+    @staticmethod
+    def __abandonAtDeadline(slot: ConcurrencyGovernor.Slot | None, schedule: RetryPolicy.Schedule):
+        """
+        Keeps a timeout of the caller's own deadline from being reported to the governor as congestion.  Timeouts
+        of the server, with time left before the deadline, still are.
+
+        Args:
+            slot (ConcurrencyGovernor.Slot | None): Slot of the attempt, or None if not governed
+            schedule (RetryPolicy.Schedule): Schedule of the call, holding its deadline
+        """
+        if slot and schedule.remaining() == 0:
+            slot.abandoned()
+
+    async def __usingOpenAI(
+            self,
+            function: Callable,
+            request: dict,
+            retryPolicy: RetryPolicy = None,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            reservation: RateLimiter.Reservation = None,
+    ) -> dict:
         """
         Makes an API request using the OpenAI library.
 
         Args:
             function (Callable): OpenAI function to call
             request (dict): API request payload
-            retries (int): Number of retries (default: 1)
+            retryPolicy (RetryPolicy): Policy of retrying failed attempts (default: a single retry)
+            priority (RequestScheduler.Priority): Priority of the request
+            reservation (RateLimiter.Reservation): Rate limiter reservation charged for each attempt (optional)
 
         Returns:
             dict: API response
         """
-        openai.api_key = self.key
-        response = None
-        tries = 0
+        import openai
+
+        # Credentials go with each call rather than the module globals, so portals of different keys don't race
+        credentials = {"api_key": self.key, "organization": self.organization}
+        schedule = (retryPolicy or RetryPolicy()).start()
+
+        while True:
+            headers = None
+            rateLimited = False
 
-        while not response:
             try:
-                return await function(**request)
-
-            except (
-                    openai.error.Timeout,
-                    openai.error.ServiceUnavailableError,
-                    openai.error.APIError,
-                    openai.error.APIConnectionError,
-            ) as e:
-                self.logger.warning(f"Server connection error: {e}. Retry {tries + 1}")
-
-            except openai.error.AuthenticationError as e:
-                message = f"Authentication failed: Unauthorized. {e}"
+                async with self.__slot(priority) as slot:
+                    if reservation:
+                        reservation.attempt()
+                    try:
+                        return await asyncio.wait_for(function(**request, **credentials), timeout=schedule.remaining())
+                    except asyncio.TimeoutError:
+                        self.__abandonAtDeadline(slot, schedule)
+                        raise
+                    except (openai.error.Timeout, openai.error.RateLimitError) as e:
+                        if slot and "quota" not in str(e).lower():
+                            slot.congested()
+                        raise
+                    except Exception:
+                        if slot:
+                            slot.failed()
+                        raise
+
+            except asyncio.TimeoutError:
+                message = f"OpenAI access did not finish within the deadline after {schedule.retries + 1} tries"
+                self.logger.warning(message)
+                raise self.DeadlineExceededError(message)
+
+            except openai.error.OpenAIError as e:
+                rateLimited = self.__checkOpenAIFailure(e, schedule)
+                headers = e.headers
+
+            if not await schedule.backoff(headers, rateLimited=rateLimited):
+                raise self.ServiceNotAvailableError(
+                    f"OpenAI accesses failed after {schedule.retries} tries. Please try later"
+                )
+
+            self.logger.warning(f"OpenAI access failure (try {schedule.retries}).")
+
+    async def __streamingOpenAI(
+            self,
+            function: Callable,
+            request: dict,
+            retryPolicy: RetryPolicy = None,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            reservation: RateLimiter.Reservation = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Makes a streaming API request using the OpenAI library.  The slot of the governor is held until the stream
+        ends.  Failures are retried only until the stream starts.
+
+        Args:
+            function (Callable): OpenAI function to call
+            request (dict): API request payload, with stream set
+            retryPolicy (RetryPolicy): Policy of retrying failed attempts (default: a single retry)
+            priority (RequestScheduler.Priority): Priority of the request
+            reservation (RateLimiter.Reservation): Rate limiter reservation charged for each attempt (optional)
+
+        Returns:
+            AsyncIterator[dict]: The chunks of the response
+        """
+        import openai
+
+        credentials = {"api_key": self.key, "organization": self.organization}
+        schedule = (retryPolicy or RetryPolicy()).start()
+
+        while True:
+            headers = None
+            rateLimited = False
+            streaming = False
+
+            try:
+                async with self.__slot(priority) as slot:
+                    if reservation:
+                        reservation.attempt()
+                    try:
+                        chunks = await asyncio.wait_for(
+                            function(**request, **credentials), timeout=schedule.remaining()
+                        )
+                        streaming = True
+                        async for chunk in chunks:
+                            yield chunk
+                        return
+                    except asyncio.TimeoutError:
+                        self.__abandonAtDeadline(slot, schedule)
+                        raise
+                    except (openai.error.Timeout, openai.error.RateLimitError) as e:
+                        if slot and "quota" not in str(e).lower():
+                            slot.congested()
+                        raise
+                    except Exception:
+                        if slot:
+                            slot.failed()
+                        raise
+
+            except asyncio.TimeoutError:
+                message = f"OpenAI access did not start within the deadline after {schedule.retries + 1} tries"
+                self.logger.warning(message)
+                raise self.DeadlineExceededError(message)
+
+            except openai.error.OpenAIError as e:
+                if streaming:
+                    raise self.ServiceNotAvailableError(f"OpenAI stream broken: {e}")
+                rateLimited = self.__checkOpenAIFailure(e, schedule)
+                headers = e.headers
+
+            if not await schedule.backoff(headers, rateLimited=rateLimited):
+                raise self.ServiceNotAvailableError(
+                    f"OpenAI accesses failed after {schedule.retries} tries. Please try later"
+                )
+
+            self.logger.warning(f"OpenAI access failure (try {schedule.retries}).")
+
+    def __checkOpenAIFailure(self, error: Exception, schedule: RetryPolicy.Schedule) -> bool:
+        """
+        Checks a failed call of the OpenAI library, and raises the corresponding error if retrying won't help.
+
+        Args:
+            error (Exception): Error raised by the call
+            schedule (RetryPolicy.Schedule): Retry schedule of the request
+
+        Returns:
+            bool: True if the request was rejected for exceeding the rate limit
+        """
+        import openai
+
+        if isinstance(error, (
+                openai.error.Timeout,
+                openai.error.ServiceUnavailableError,
+                openai.error.APIError,
+                openai.error.APIConnectionError,
+        )):
+            self.logger.warning(f"Server connection error: {error}. Retry {schedule.retries + 1}")
+            return False
+
+        if isinstance(error, openai.error.AuthenticationError):
+            message = f"Authentication failed: Unauthorized. {error}"
+            self.logger.error(message)
+            raise self.AuthenticationError(f"{message} (incorrect or missing API keys).")
+
+        if isinstance(error, openai.error.InvalidRequestError):
+            message = f"Too many tokens: {error}"
+            self.logger.info(message)
+            raise self.TooManyTokensError(message)
+
+        if isinstance(error, openai.error.RateLimitError):
+            if "quota" in str(error).lower():
+                message = f"OpenAI quota exceeded: {error}"
                 self.logger.error(message)
-                raise self.AuthenticationError(f"{message} (incorrect or missing API keys).")
+                raise self.QuotaExceededError(message)
+            self.logger.warning(f"OpenAI rate exceeds limit. Slowing down retries. {error}")
+            return True
 
-            except openai.error.InvalidRequestError as e:
-                message = f"Too many tokens: {e}"
-                self.logger.info(message)
-                raise self.TooManyTokensError(message)
+        raise error
 
-            except openai.error.RateLimitError as e:
-                self.logger.warning(f"OpenAI rate exceeds limit. Slowing down retries. {e}")
-                time.sleep(self.__SLOW_RETRY_INTERVAL - self.__RETRY_INTERVAL)
+    async def __post(self, url: str, headers: dict, request: dict) -> (int, Mapping[str, str], dict):
+        """
+        Posts a request through the HTTP connection pool.
 
-            tries += 1
-            if tries > retries:
-                raise self.ServiceNotAvailableError(f"OpenAI accesses failed after {tries} tries. Please try later")
+        Args:
+            url (str): URL to post to
+            headers (dict): Request headers
+            request (dict): Request payload
 
-            self.logger.warning(f"OpenAI access failure (try {tries}).")
-            time.sleep(self.__RETRY_INTERVAL)
+        Returns:
+            (int, Mapping[str, str], dict): Status, headers and JSON body of the response
+        """
+        session = self.__getSession() if self.pooled else self.__createSession()
+        try:
+            self.logger.info(f"Sending OpenAI API POST {request}")
+            async with session.post(url, headers=headers, json=request) as response:
+                return response.status, response.headers, await response.json(content_type=None)
+        finally:
+            if not self.pooled:
+                await session.close()
 
-    async def __usingHttp(self, function: str, request: dict, retries: int = 1) -> dict:
+    @classmethod
+    def __errorMessage(cls, results: dict) -> str:
         """
-        Makes an API request using HTTP.
+        Gets the error message from the body of a failed response.
 
         Args:
-            function (str): API function to call
-            request (dict): API request payload
-            retries (int): Number of retries (default: 1)
+            results (dict): Body of the response
 
         Returns:
-            dict: API response
+            str: The error message
+        """
+        if not isinstance(results, dict):
+            return str(results)
+        error = results.get("error")
+        if isinstance(error, dict):
+            return error.get("message") or error.get("code") or str(error)
+        return results.get("message", str(results))
+
+    def __checkFailure(self, status: int, results: dict, schedule: RetryPolicy.Schedule) -> bool:
+        """
+        Checks a failed HTTP response, and raises the corresponding error if retrying won't help.
+
+        Args:
+            status (int): HTTP status of the response
+            results (dict): Body of the response
+            schedule (RetryPolicy.Schedule): Retry schedule of the request
+
+        Returns:
+            bool: True if the request was rejected for exceeding the rate limit
+        """
+        if status == 400:  # Incorrect request
+            message = self.__errorMessage(results)
+            self.logger.warning(f"Too many tokens: {message}")
+            raise self.TooManyTokensError(message)
+
+        elif status == 401:  # Unauthorized
+            self.logger.error("Authentication failed: Unauthorized")
+            raise self.AuthenticationError(
+                f"OpenAI authentication failed (incorrect or missing API keys)."
+            )
+
+        elif status == 403:  # Forbidden
+            self.logger.error("Authentication failed: Forbidden")
+            raise self.AuthenticationError(f"OpenAI operation not allowed.")
+
+        elif status == 429:
+            message = self.__errorMessage(results)
+            if "quota" in message.lower():
+                # Quota exceeded.  Retrying won't help.
+                self.logger.error(f"OpenAI quota exceeded: {message}")
+                raise self.QuotaExceededError(message)
+
+            self.logger.warning(f"OpenAI rate exceeds limit. Slowing down retries. {message}")
+            return True
+
+        else:
+            self.logger.warning(
+                f"Unexpected error: {status} - {self.__errorMessage(results)}. Retry {schedule.retries + 1}"
+            )
+            return False
+
+    def __httpHeaders(self) -> dict:
+        """
+        Returns:
+            dict: Headers of HTTP requests to the API
         """
-        url = f"https://api.openai.com/v1/{function}"
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.key}",
         }
+        if self.organization:
+            headers["OpenAI-Organization"] = self.organization
+        return headers
+
+    async def __usingHttp(
+            self,
+            function: str,
+            request: dict,
+            retryPolicy: RetryPolicy = None,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            reservation: RateLimiter.Reservation = None,
+    ) -> dict:
+        """
+        Makes an API request using HTTP.
 
-        response = None
-        tries = 0
+        Args:
+            function (str): API function to call
+            request (dict): API request payload
+            retryPolicy (RetryPolicy): Policy of retrying failed attempts (default: a single retry)
+            priority (RequestScheduler.Priority): Priority of the request
+            reservation (RateLimiter.Reservation): Rate limiter reservation charged for each attempt (optional)
+
+        Returns:
+            dict: API response
+        """
+        import aiohttp
+
+        url = f"{self.baseUrl}/{function}"
+        headers = self.__httpHeaders()
+        schedule = (retryPolicy or RetryPolicy()).start()
+
+        while True:
+            responseHeaders = None
+            rateLimited = False
 
-        while not response:
             try:
-                async with aiohttp.ClientSession() as session:
+                async with self.__slot(priority) as slot:
+                    if reservation:
+                        reservation.attempt()
+                    try:
+                        status, responseHeaders, results = await asyncio.wait_for(
+                            self.__post(url, headers, request), timeout=schedule.remaining()
+                        )
+                    except asyncio.TimeoutError:
+                        self.__abandonAtDeadline(slot, schedule)
+                        raise
+
+                    if status == 200:  # Successful response
+                        self.logger.info(f"Got response {results}")
+                        return results
+
+                    if slot:
+                        slot.failed()
+                    rateLimited = self.__checkFailure(status, results, schedule)
+                    if slot and rateLimited:
+                        slot.congested()
+
+            except asyncio.TimeoutError:
+                message = f"GPT-3 access did not finish within the deadline after {schedule.retries + 1} tries"
+                self.logger.warning(message)
+                raise self.DeadlineExceededError(message)
+
+            except (aiohttp.ClientError, aiohttp.ServerConnectionError, ValueError) as e:
+                self.logger.warning(f"Server connection error: {e}. Retry {schedule.retries + 1}")
+
+            if not await schedule.backoff(responseHeaders, rateLimited=rateLimited):
+                raise self.ServiceNotAvailableError(
+                    f"GPT-3 access failed after {schedule.retries} tries. Please try later"
+                )
+
+            self.logger.warning(f"GPT-3 access failure (try {schedule.retries}).")
+
+    async def __streamingHttp(
+            self,
+            function: str,
+            request: dict,
+            retryPolicy: RetryPolicy = None,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            reservation: RateLimiter.Reservation = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Makes a streaming API request using HTTP, and parses the server-sent events of the response.
+        Failures are retried only until the stream starts.
+
+        Args:
+            function (str): API function to call
+            request (dict): API request payload, with stream set
+            retryPolicy (RetryPolicy): Policy of retrying failed attempts (default: a single retry)
+            priority (RequestScheduler.Priority): Priority of the request
+            reservation (RateLimiter.Reservation): Rate limiter reservation charged for each attempt (optional)
+
+        Returns:
+            AsyncIterator[dict]: The chunks of the response
+        """
+        import aiohttp
+
+        url = f"{self.baseUrl}/{function}"
+        headers = self.__httpHeaders()
+        schedule = (retryPolicy or RetryPolicy()).start()
+
+        while True:
+            responseHeaders = None
+            rateLimited = False
+            streaming = False
+
+            session = self.__getSession() if self.pooled else self.__createSession()
+            try:
+                async with self.__slot(priority) as slot:
+                    if reservation:
+                        reservation.attempt()
                     self.logger.info(f"Sending OpenAI API POST {request}")
-                    async with session.post(url, headers=headers, json=request) as response:
-                        results = await response.json()
+                    try:
+                        response = await asyncio.wait_for(
+                            session.post(url, headers=headers, json=request), timeout=schedule.remaining()
+                        )
+                    except asyncio.TimeoutError:
+                        self.__abandonAtDeadline(slot, schedule)
+                        raise
+                    try:
+                        if response.status == 200:
+                            streaming = True
+                            async for line in response.content:
+                                line = line.strip()
+                                if not line.startswith(b"data:"):
+                                    continue
+                                data = line[len(b"data:"):].strip()
+                                if data == b"[DONE]":
+                                    break
+                                yield json.loads(data)
+                            return
+
+                        if slot:
+                            slot.failed()
+                        responseHeaders = response.headers
+                        rateLimited = self.__checkFailure(
+                            response.status, await response.json(content_type=None), schedule
+                        )
+                        if slot and rateLimited:
+                            slot.congested()
+                    finally:
+                        response.release()
+
+            except asyncio.TimeoutError:
+                message = f"GPT-3 access did not start within the deadline after {schedule.retries + 1} tries"
+                self.logger.warning(message)
+                raise self.DeadlineExceededError(message)
+
+            except (aiohttp.ClientError, aiohttp.ServerConnectionError, ValueError) as e:
+                if streaming:
+                    raise self.ServiceNotAvailableError(f"GPT-3 stream broken: {e}")
+                self.logger.warning(f"Server connection error: {e}. Retry {schedule.retries + 1}")
+
+            finally:
+                if not self.pooled:
+                    await session.close()
+
+            if not await schedule.backoff(responseHeaders, rateLimited=rateLimited):
+                raise self.ServiceNotAvailableError(
+                    f"GPT-3 access failed after {schedule.retries} tries. Please try later"
+                )
+
+            self.logger.warning(f"GPT-3 access failure (try {schedule.retries}).")
+
+    async def __stream(
+            self,
+            function: str,
+            request: dict,
+            access: str,
+            retryPolicy: RetryPolicy,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+    ) -> AsyncIterator[dict]:
+        """
+        Sends a streaming API request, within the client-side rate limits if enabled.
 
-                        if response.status == 200:  # Successful response
-                            self.logger.info(f"Got response {results}")
-                            return results
+        Args:
+            function (str): API function to call (completions or chat/completions)
+            request (dict): API request payload, with stream set
+            access (str): Access mode (openai or http)
+            retryPolicy (RetryPolicy): Policy of retrying failed attempts
+            priority (RequestScheduler.Priority): Priority of the request
 
-                        elif response.status == 400:  # Incorrect request
-                            self.logger.warning(f"Too many tokens: {results['message']}")
-                            raise self.TooManyTokensError(results["message"])
+        Returns:
+            AsyncIterator[dict]: The chunks of the response
+        """
+        if access not in ["http", "openai"]:
+            message = f"Unknown access {access}"
+            self.logger.error(message)
+            raise self.InvalidRequest(message)
 
-                        elif response.status == 401:  # Unauthorized
-                            self.logger.error("Authentication failed: Unauthorized")
-                            raise self.AuthenticationError(
-                                f"OpenAI authentication failed (incorrect or missing API keys)."
-                            )
+        if self.tokenBudgeting:
+            request = self.__budgetTokens(request)
 
-                        elif response.status == 403:  # Forbidden
-                            self.logger.error("Authentication failed: Forbidden")
-                            raise self.AuthenticationError(f"OpenAI operation not allowed.")
+        if self.cassette and not self.cassette.recording():
+            async for chunk in self.cassette.playStream(function, request):
+                yield chunk
+            return
 
-                        elif response.status == 429:
-                            if "rate limit" in response.reason:
-                                self.logger.warning(f"OpenAI rate exceeds limit. Slowing down retries.")
-                                time.sleep(self.__SLOW_RETRY_INTERVAL - self.__RETRY_INTERVAL)
-                            else:
-                                # Quota exceeded or the server is not available.
-                                reason = response.reason.lower()
-                                raise self.ServiceNotAvailableError(reason)
+        reservation = await self.__reserve(request)
+        usage = None
+        recorded = []
+        delays = []
 
-                        else:
-                            self.logger.warning(
-                                f"Unexpected error: {response.status} - {response.reason}. Retry {tries + 1}"
-                            )
+        if access == "http":
+            chunks = self.__streamingHttp(
+                function, request, retryPolicy=retryPolicy, priority=priority, reservation=reservation
+            )
+        else:
+            chunks = self.__streamingOpenAI(
+                self.__openaiFunction(function), request,
+                retryPolicy=retryPolicy, priority=priority, reservation=reservation,
+            )
+
+        try:
+            last = time.monotonic()
+            async with contextlib.aclosing(chunks):
+                async for chunk in chunks:
+                    usage = chunk.get("usage") or usage
+                    if self.cassette:
+                        now = time.monotonic()
+                        recorded.append(chunk)
+                        delays.append(now - last)
+                        last = now
+                    yield chunk
+
+            if self.cassette:
+                self.cassette.recordStream(function, request, recorded, delays)
+
+        finally:
+            # Also when the stream broke or its consumer stopped early: a request never sent gives its capacity
+            # back, and one sent is reconciled with the usage seen, if any
+            if reservation:
+                reservation.cancel()
+                reservation.reconcile((usage or {}).get("total_tokens"))
+
+    @Tracer.traced("GptPortal.request", lambda self, function, request, *args: {"model": request.get("model")})
+    async def __request(
+            self,
+            function: str,
+            request: dict,
+            access: str,
+            retryPolicy: RetryPolicy,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            tags: Dict[str, str] = None,
+    ) -> dict:
+        """
+        Sends an API request with the given access mode, unless the response is already in the cache.
+        The usage of the responses not from the cache is recorded in the ledger.
 
-            except (aiohttp.ClientError, aiohttp.ServerConnectionError) as e:
-                self.logger.warning(f"Server connection error: {e}. Retry {tries + 1}")
+        Args:
+            function (str): API function to call (completions or chat/completions)
+            request (dict): API request payload
+            access (str): Access mode (openai or http)
+            retryPolicy (RetryPolicy): Policy of retrying failed attempts
+            priority (RequestScheduler.Priority): Priority of the request
+            tags (Dict[str, str]): Who makes the request, for the usage ledger
+
+        Returns:
+            dict: API response
+        """
+        if self.tokenBudgeting:
+            request = self.__budgetTokens(request)
+
+        if self.cache:
+            cached = self.cache.get(function, request)
+            if cached is not None:
+                self.logger.info(f"Got cached response {cached}")
+                Tracer.current().set(cached=True)
+                return cached
+
+        async def send() -> dict:
+            sent = await self.__hedged(function, request, access, retryPolicy, priority)
+            if sent.get("usage"):
+                # Only the caller actually sending a coalesced request pays for it
+                self.ledger.record(request.get("model"), sent["usage"], tags)
+            return sent
+
+        if self.__coalescible(request):
+            response = await self.singleFlight.do(ResponseCache.keyOf(function, request), send)
+        else:
+            response = await send()
 
-            tries += 1
-            if tries > retries:
-                raise self.ServiceNotAvailableError(f"GPT-3 access failed after {tries - 1} tries. Please try later")
+        if self.cache:
+            self.cache.put(function, request, response)
 
-            self.logger.warning(f"GPT-3 access failure (try {tries}).")
-            time.sleep(1)
+        return response
 
-    async def completion(self, prompt: str, retries: int = 1, **kwargs) -> List[str] | str:
+    async def __hedged(
+            self,
+            function: str,
+            request: dict,
+            access: str,
+            retryPolicy: RetryPolicy,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+    ) -> dict:
+        """
+        Sends an API request, and a duplicate of it if it is slow and the hedge policy allows.
+        The first response is used and the other request is cancelled.
+
+        Args:
+            function (str): API function to call (completions or chat/completions)
+            request (dict): API request payload
+            access (str): Access mode (openai or http)
+            retryPolicy (RetryPolicy): Policy of retrying failed attempts
+            priority (RequestScheduler.Priority): Priority of the request
+
+        Returns:
+            dict: API response
+        """
+        if not self.hedgePolicy:
+            return await self.__send(function, request, access, retryPolicy, priority)
+
+        model = request.get("model")
+        delay = self.hedgePolicy.delay(model)
+        start = time.monotonic()
+        primary = asyncio.ensure_future(self.__send(function, request, access, retryPolicy, priority))
+        pending = {primary}
+
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self.hedgePolicy.allow():
+                    self.logger.info(f"No response after {delay:.2f}s.  Sending a hedge request")
+                    pending.add(asyncio.ensure_future(self.__send(function, request, access, retryPolicy, priority)))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception():
+                        error = error or task.exception()
+                        continue
+
+                    elapsed = time.monotonic() - start
+                    if task is primary:
+                        self.hedgePolicy.record(model, elapsed)
+                    else:
+                        self.hedgePolicy.record(model, elapsed - delay)
+                        self.hedgePolicy.won(model, elapsed)
+                    return task.result()
+
+            raise error
+
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def __coalescible(self, request: dict) -> bool:
+        """
+        Checks whether a request may share the response of an identical request in flight.
+
+        Args:
+            request (dict): API request payload
+
+        Returns:
+            bool: True if the request may be coalesced
+        """
+        return (
+                self.singleFlight is not None and
+                not request.get("stream") and
+                (self.coalesceNonDeterministic or ResponseCache.isDeterministic(request))
+        )
+
+    @classmethod
+    def __openaiFunction(cls, function: str) -> Callable:
+        import openai
+
+        return openai.ChatCompletion.acreate if function == "chat/completions" else openai.Completion.acreate
+
+    @Tracer.traced("GptPortal.send", lambda self, function, request, access, *args: {"access": access})
+    async def __send(
+            self,
+            function: str,
+            request: dict,
+            access: str,
+            retryPolicy: RetryPolicy,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+    ) -> dict:
+        """
+        Sends an API request over the network, within the client-side rate limits if enabled.
+
+        Args:
+            function (str): API function to call (completions or chat/completions)
+            request (dict): API request payload
+            access (str): Access mode (openai or http)
+            retryPolicy (RetryPolicy): Policy of retrying failed attempts
+            priority (RequestScheduler.Priority): Priority of the request
+
+        Returns:
+            dict: API response
+        """
+        if self.cassette and not self.cassette.recording():
+            Tracer.current().set(replayed=True)
+            return await self.cassette.play(function, request)
+
+        if access not in ["http", "openai"]:
+            message = f"Unknown access {access}"
+            self.logger.error(message)
+            raise self.InvalidRequest(message)
+
+        reservation = await self.__reserve(request)
+        start = time.monotonic()
+        try:
+            if access == "http":
+                response = await self.__usingHttp(
+                    function, request, retryPolicy=retryPolicy, priority=priority, reservation=reservation
+                )
+            else:
+                response = await self.__usingOpenAI(
+                    self.__openaiFunction(function), request,
+                    retryPolicy=retryPolicy, priority=priority, reservation=reservation,
+                )
+        except BaseException:
+            # Failed or cancelled, e.g. the losing hedge, the request gives its capacity back only if it was never
+            # sent.  Once sent, it counts against the limits of the server, with its estimated tokens.
+            if reservation:
+                reservation.cancel()
+            raise
+
+        if self.cassette:
+            self.cassette.record(function, request, response, time.monotonic() - start)
+        if reservation:
+            reservation.reconcile((response.get("usage") or {}).get("total_tokens"))
+        Tracer.current().set(**{k: v for k, v in (response.get("usage") or {}).items() if k.endswith("_tokens")})
+        return response
+
+    async def __reserve(self, request: dict) -> RateLimiter.Reservation | None:
+        """
+        Waits for the client-side rate limiter, if enabled, to have capacity for a request.
+
+        Args:
+            request (dict): API request payload
+
+        Returns:
+            RateLimiter.Reservation | None: The reservation to reconcile after the response, or None if not limited
+        """
+        if not self.rateLimited:
+            return None
+
+        limiter = RateLimiter.of(self.key, request.get("model"))
+        return await limiter.acquire(self.__estimateRequestTokens(request))
+
+    def __budgetTokens(self, request: dict) -> dict:
+        """
+        Checks that a request fits in the context window of its model by local estimate, without a round trip.
+
+        Args:
+            request (dict): API request payload
+
+        Returns:
+            dict: The request, or a copy with max_tokens clamped to the room left in the context window
+        """
+        window = self.contextWindowOf(request.get("model"))
+        if not window:
+            return request
+
+        # Each prompt of a batched completion has a context window of its own
+        prompt = max(self.__estimatePromptTokens(request), default=0)
+        maxTokens = request.get("max_tokens")
+        if prompt + (maxTokens or 0) <= window:
+            return request
+
+        room = window - prompt
+        if self.tokenBudgeting == "clamp" and room > 0:
+            self.logger.info(f"Clamping max_tokens from {maxTokens} to {room} to fit {request.get('model')}")
+            return {**request, "max_tokens": room}
+
+        message = (
+            f"Too many tokens: about {prompt} in the prompt and {maxTokens or 0} to complete, "
+            f"over the {window} of {request.get('model')}"
+        )
+        self.logger.info(message)
+        raise self.TooManyTokensError(message)
+
+    @classmethod
+    def __estimatePromptTokens(cls, request: dict) -> List[int]:
+        """
+        Estimates the prompt tokens of a request.
+
+        Args:
+            request (dict): API request payload
+
+        Returns:
+            List[int]: Estimated number of tokens of each prompt (a single one for chat messages)
+        """
+        model = request.get("model")
+        if "messages" in request:
+            contents = [m.get("content") for m in request["messages"]]
+            return [sum(cls.estimateTokensMany(contents, model)) + cls.__TOKENS_PER_MESSAGE * len(contents)]
+
+        prompts = request.get("prompt", "")
+        return cls.estimateTokensMany([prompts] if isinstance(prompts, str) else prompts, model)
+
+    @classmethod
+    def __estimateRequestTokens(cls, request: dict) -> int:
+        """
+        Estimates the tokens a request may use: its prompt plus the maximum completion of all its choices.
+
+        Args:
+            request (dict): API request payload
+
+        Returns:
+            int: Estimated number of tokens
+        """
+        prompt = sum(cls.__estimatePromptTokens(request))
+        choices = request.get("n", 1) * (1 if isinstance(request.get("prompt", ""), str) else len(request["prompt"]))
+        completion = request.get("max_tokens") or cls.__DEFAULT_COMPLETION_TOKENS
+        return prompt + completion * choices
+
+    async def completion(
+            self,
+            prompt: str,
+            retries: int = 1,
+            retryPolicy: RetryPolicy = None,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            deadline: Deadline = None,
+            tags: Dict[str, str] = None,
+            **kwargs
+    ) -> List[str] | str:
         """
         Performs text completion using GPT-3.
 
         Args:
             prompt (str): Input prompt
-            retries (int): Number of retries (default: 1)
+            retries (int): Number of retries (default: 1).  Ignored if retryPolicy is given.
+            retryPolicy (RetryPolicy): Policy of backing off and retrying failed attempts (optional)
+            priority (RequestScheduler.Priority): Priority while waiting for the governor (default: INTERACTIVE)
+            deadline (Deadline): Deadline of the call chain, bounding the retries too (default: None for no limit)
+            tags (Dict[str, str]): Who makes the call, e.g. story, actor and purpose, for the usage ledger (optional)
             **kwargs: Additional keyword arguments
 
         Returns:
@@ -204,50 +1095,156 @@ class GptPortal:
         multiple = "n" in kwargs
 
         access = kwargs.pop("access", self.access)
+        retryPolicy = (retryPolicy or RetryPolicy(maxRetries=retries)).withDeadline(deadline)
 
         request = {
             "prompt": prompt,
             **kwargs,
         }
 
-        if access == "http":
-            response = await self.__usingHttp("completions", request, retries=retries)
-        elif access == "openai":
-            response = await self.__usingOpenAI(openai.Completion.acreate, request, retries=retries)
-        else:
-            message = f"Unknown access {access}"
-            self.logger.error(message)
-            raise self.InvalidRequest(message)
+        response = await self.__request("completions", request, access, retryPolicy, priority, tags)
 
         results = [r["text"].strip() for r in response["choices"]]
         return results if multiple else results[0]
 
+    async def completionBatch(
+            self,
+            prompts: List[str],
+            retries: int = 1,
+            retryPolicy: RetryPolicy = None,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            deadline: Deadline = None,
+            tags: Dict[str, str] = None,
+            maxBatchItems: int = DEFAULT_MAX_BATCH_ITEMS,
+            maxBatchTokens: int = DEFAULT_MAX_BATCH_TOKENS,
+            maxConcurrentBatches: int = DEFAULT_MAX_CONCURRENT_BATCHES,
+            **kwargs
+    ) -> List[List[str] | str | None]:
+        """
+        Performs text completion of many prompts, packing them into as few requests as the limits allow.
+
+        A batch rejected as invalid (e.g. one prompt too long) is split in halves and retried, so only the offending
+        prompts fail.
+
+        Args:
+            prompts (List[str]): Input prompts
+            retries (int): Number of retries (default: 1).  Ignored if retryPolicy is given.
+            retryPolicy (RetryPolicy): Policy of backing off and retrying failed attempts (optional)
+            priority (RequestScheduler.Priority): Priority while waiting for the governor (default: INTERACTIVE)
+            deadline (Deadline): Deadline of the call chain, bounding the retries too (default: None for no limit)
+            tags (Dict[str, str]): Who makes the call, e.g. story, actor and purpose, for the usage ledger (optional)
+            maxBatchItems (int): Maximum number of prompts in a request
+            maxBatchTokens (int): Maximum estimated tokens, prompts and completions, of a request
+            maxConcurrentBatches (int): Maximum number of requests sent at the same time
+            **kwargs: Additional keyword arguments
+
+        Returns:
+            List[List[str] | str | None]: Completion results of each prompt (a list if n is given), or None for
+                the prompts rejected or not completed before the deadline
+        """
+        if kwargs.get("model", "default") == "default":
+            kwargs["model"] = self.__DEFAULT_MODELS["completion"]
+
+        multiple = "n" in kwargs
+        n = kwargs.get("n", 1)
+
+        access = kwargs.pop("access", self.access)
+        retryPolicy = (retryPolicy or RetryPolicy(maxRetries=retries)).withDeadline(deadline)
+
+        # Pack the prompts in order, each batch within both limits
+        completionTokens = (kwargs.get("max_tokens") or self.__DEFAULT_COMPLETION_TOKENS) * n
+        batches = []
+        batch, batchTokens = [], 0
+        for i, tokens in enumerate(self.estimateTokensMany(prompts, kwargs["model"])):
+            tokens += completionTokens
+            if batch and (len(batch) >= maxBatchItems or batchTokens + tokens > maxBatchTokens):
+                batches.append(batch)
+                batch, batchTokens = [], 0
+            batch.append(i)
+            batchTokens += tokens
+        if batch:
+            batches.append(batch)
+
+        results: List[List[str] | None] = [None] * len(prompts)
+        semaphore = asyncio.Semaphore(maxConcurrentBatches)
+
+        async def invokeBatch(indices: List[int]):
+            request = {
+                "prompt": [prompts[i] for i in indices],
+                **kwargs,
+            }
+
+            try:
+                async with semaphore:
+                    response = await self.__request("completions", request, access, retryPolicy, priority, tags)
+            except self.DeadlineExceededError as e:
+                self.logger.warning(f"Batch of {len(indices)} prompts not completed: {e}")
+                return
+            except self.TooManyTokensError as e:
+                if len(indices) == 1:
+                    self.logger.warning(f"Prompt {indices[0]} of the batch is rejected: {e}")
+                    return
+                self.logger.info(f"Splitting a rejected batch of {len(indices)} prompts")
+                middle = len(indices) // 2
+                await asyncio.gather(invokeBatch(indices[:middle]), invokeBatch(indices[middle:]))
+                return
+
+            # Choices of the i-th prompt of the request are indexed from i * n
+            for choice in sorted(response["choices"], key=lambda c: c["index"]):
+                i = indices[choice["index"] // n]
+                if results[i] is None:
+                    results[i] = []
+                results[i].append(choice["text"].strip())
+
+        self.logger.debug(f"Completing {len(prompts)} prompts in {len(batches)} batches")
+        await asyncio.gather(*[invokeBatch(b) for b in batches])
+
+        return results if multiple else [r[0] if r else None for r in results]
+
     async def chatCompletion(
             self,
             messages: List[dict],
             retries: int = 1,
             maxCompletion: int = 5,
+            retryPolicy: RetryPolicy = None,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            deadline: Deadline = None,
+            tags: Dict[str, str] = None,
+            maxConcurrentContinuations: int = DEFAULT_MAX_CONCURRENT_CONTINUATIONS,
+            adaptiveMaxTokens: bool = False,
             **kwargs
     ) -> List[dict] | dict:
         """
         Performs chat-based text completion using GPT-3.5 or -4.
         If GPT returns an incomplete response, repeat invoking until it is complete.
+        Incomplete choices are continued concurrently.
 
         Args:
             messages (List[dict]): List of messages in chat conversation
-            retries (int): Number of retries (default: 1)
+            retries (int): Number of retries (default: 1).  Ignored if retryPolicy is given.
             maxCompletion (int): If GPT responds incompletely due to length, try at most this to complete (default: 5)
+            retryPolicy (RetryPolicy): Policy of backing off and retrying failed attempts (optional)
+            priority (RequestScheduler.Priority): Priority while waiting for the governor (default: INTERACTIVE)
+            deadline (Deadline): Deadline of the call chain, bounding the retries too (default: None for no limit)
+            tags (Dict[str, str]): Who makes the call, e.g. story, actor and purpose, for the usage ledger (optional)
+            maxConcurrentContinuations (int): Maximum number of continuation requests in flight at the same time
+            adaptiveMaxTokens (bool): Whether to first retry an incomplete choice once with a larger max_tokens,
+                before continuing it over multiple rounds (default: False)
             **kwargs: Additional keyword arguments
 
         Returns:
-            List[dict]: List of completion results as messages
+            List[dict]: List of completion results as messages.  Besides role, content and finish_reason,
+                each has the number of pieces it took, the seconds spent on completing it, and whether it is partial,
+                i.e. cut short by length because the deadline left no time to continue it.
         """
         if kwargs.get("model", "default") == "default":
             kwargs["model"] = self.__DEFAULT_MODELS["chatCompletion"]
 
         multiple = "n" in kwargs
+        retryPolicy = (retryPolicy or RetryPolicy(maxRetries=retries)).withDeadline(deadline)
+        continuing = asyncio.Semaphore(maxConcurrentContinuations)
 
-        async def invokeChatComplete(_messages, forceSingle=False):
+        async def invokeChatComplete(_messages, forceSingle=False, **overrides):
             completionArgs = copy.copy(kwargs)
             access = completionArgs.pop("access", self.access)
 
@@ -257,60 +1254,230 @@ class GptPortal:
             request = {
                 "messages": _messages,
                 **completionArgs,
+                **overrides,
             }
 
-            if access == "http":
-                return await self.__usingHttp("chatCompletions", request, retries=retries)
-            elif access == "openai":
-                return await self.__usingOpenAI(openai.ChatCompletion.acreate, request, retries=retries)
-            else:
-                errorMsg = f"Unknown access {access}"
-                self.logger.error(errorMsg)
-                raise self.InvalidRequest(errorMsg)
+            return await self.__request("chat/completions", request, access, retryPolicy, priority, tags)
 
-        response = await invokeChatComplete(messages)
+        async def invokeContinuation(_messages, **overrides):
+            async with continuing:
+                return await invokeChatComplete(_messages, forceSingle=True, **overrides)
 
-        completions = [{
-            "role": r["message"].role,
-            "content": r["message"].content,
-            "finish_reason": r["finish_reason"]
-        } for r in response["choices"]]
-
-        # Go through all the completions and see if any of them are not completed.  If so, call GPT again to complete them.
-        for completion in completions:
+        async def complete(completion: dict):
+            startTime = time.perf_counter()
             pieces = 1
+
+            maxTokens = kwargs.get("max_tokens")
+            try:
+                if adaptiveMaxTokens and maxTokens:
+                    # A single longer answer is usually faster than several rounds of continuation
+                    response = await invokeContinuation(
+                        messages, max_tokens=maxTokens * self.ADAPTIVE_MAX_TOKENS_FACTOR
+                    )
+                    retried = response["choices"][0]
+                    completion["finish_reason"] = retried["finish_reason"]
+                    completion["content"] = self.__messageField(retried["message"], "content")
+            except self.DeadlineExceededError:
+                pass  # Keep the truncated choice
+
             while completion['finish_reason'] == "length":
+                # Expect a continuation to take as long as the first piece
+                if deadline and not deadline.allows(firstPieceElapsed):
+                    self.logger.info(f"No time left to continue a truncated choice.  Returning it partial.")
+                    completion["partial"] = True
+                    break
+
                 conversation = messages + [
                     {"role": "assistant", "content": completion["content"]},
-                    {"role": "user", "content": "[continue, but with limits]"},
+                    {"role": "user", "content": self.__CONTINUE_PROMPT},
                 ]
 
                 # Make the subsequent API call to continue the conversation.
-                response = await invokeChatComplete(conversation, forceSingle=True)
+                try:
+                    response = await invokeContinuation(conversation)
+                except self.DeadlineExceededError:
+                    completion["partial"] = True
+                    break
                 noChoice = response["choices"][0]
                 completion["finish_reason"] = noChoice["finish_reason"]
-                completion["content"] += ' ' + noChoice["message"].content
+                completion["content"] += ' ' + self.__messageField(noChoice["message"], "content")
 
                 pieces += 1
                 if pieces > maxCompletion:
                     break
 
+            completion["pieces"] = pieces
+            completion["elapsed"] = time.perf_counter() - startTime
+            self.logger.info(f"Completed a truncated choice in {pieces} pieces, {completion['elapsed']:.2f}s")
+
+        firstPieceStart = time.perf_counter()
+        response = await invokeChatComplete(messages)
+        firstPieceElapsed = time.perf_counter() - firstPieceStart
+
+        completions = [{
+            "role": self.__messageField(r["message"], "role"),
+            "content": self.__messageField(r["message"], "content"),
+            "finish_reason": r["finish_reason"],
+            "pieces": 1,
+            "elapsed": 0.0,
+            "partial": False,
+        } for r in response["choices"]]
+
+        # Call GPT again to complete all the incomplete completions at the same time.
+        await asyncio.gather(*[complete(c) for c in completions if c["finish_reason"] == "length"])
+
         return completions if multiple else completions[0]
 
+    async def chatCompletionStream(
+            self,
+            messages: List[dict],
+            retries: int = 1,
+            maxCompletion: int = 5,
+            retryPolicy: RetryPolicy = None,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            deadline: Deadline = None,
+            tags: Dict[str, str] = None,
+            **kwargs
+    ) -> AsyncIterator[dict]:
+        """
+        Performs chat-based text completion using GPT-3.5 or -4, yielding the content as it arrives.
+        If GPT returns an incomplete response, the continuations are chained into the same stream.
+        Only a single choice is streamed.
+
+        Args:
+            messages (List[dict]): List of messages in chat conversation
+            retries (int): Number of retries (default: 1).  Ignored if retryPolicy is given.
+            maxCompletion (int): If GPT responds incompletely due to length, try at most this to complete (default: 5)
+            retryPolicy (RetryPolicy): Policy of backing off and retrying failed attempts (optional)
+            priority (RequestScheduler.Priority): Priority while waiting for the governor (default: INTERACTIVE)
+            deadline (Deadline): Deadline of the call chain, bounding the retries too (default: None for no limit)
+            tags (Dict[str, str]): Who makes the call, e.g. story, actor and purpose, for the usage ledger (optional)
+            **kwargs: Additional keyword arguments
+
+        Returns:
+            AsyncIterator[dict]: Messages of the content deltas, with finish_reason None.
+                The last message has empty content, and the finish_reason and usage of the whole response.
+                It is marked partial if the deadline cut the response short.
+        """
+        if kwargs.get("model", "default") == "default":
+            kwargs["model"] = self.__DEFAULT_MODELS["chatCompletion"]
+
+        kwargs.pop("n", None)
+        access = kwargs.pop("access", self.access)
+        retryPolicy = (retryPolicy or RetryPolicy(maxRetries=retries)).withDeadline(deadline)
+
+        role = "assistant"
+        content = ""
+        finishReason = None
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+        conversation = messages
+        pieces = 1
+        partial = False
+        while True:
+            request = {"messages": conversation, **kwargs, "stream": True}
+            separator = " " if content else ""
+            pieceUsage = None
+            pieceContent = ""
+
+            # Closed at once when cut short, so the request settles its rate limiter reservation
+            chunks = self.__stream("chat/completions", request, access, retryPolicy, priority)
+            async with contextlib.aclosing(chunks):
+                async for chunk in chunks:
+                    pieceUsage = chunk.get("usage") or pieceUsage
+                    choices = chunk.get("choices")
+                    if not choices:
+                        continue
+
+                    delta = choices[0].get("delta") or {}
+                    role = delta.get("role") or role
+                    text = delta.get("content")
+                    if text:
+                        yield {"role": role, "content": separator + text, "finish_reason": None}
+                        pieceContent += separator + text
+                        separator = ""
+
+                    finishReason = choices[0].get("finish_reason") or finishReason
+
+                    if deadline and deadline.expired() and not finishReason:
+                        self.logger.info("Deadline passed.  Cutting the stream short.")
+                        finishReason = "length"
+                        partial = True
+                        break
+
+            if not pieceUsage:
+                # The server does not report usage of streams unless asked.  Estimate it instead.
+                contents = [m.get("content") for m in conversation]
+                promptTokens = sum(self.estimateTokensMany(contents, kwargs["model"]))
+                promptTokens += self.__TOKENS_PER_MESSAGE * len(contents)
+                completionTokens = self.estimateTokens(pieceContent, kwargs["model"])
+                pieceUsage = {
+                    "prompt_tokens": promptTokens,
+                    "completion_tokens": completionTokens,
+                    "total_tokens": promptTokens + completionTokens,
+                }
+            for k in usage:
+                usage[k] += pieceUsage.get(k, 0)
+            self.ledger.record(kwargs["model"], pieceUsage, tags)
+
+            content += pieceContent
+            if finishReason != "length" or pieces >= maxCompletion + 1:
+                break
+            if deadline and deadline.expired():
+                partial = True
+                break
+
+            # Continue the response cut short by length in the same stream
+            conversation = messages + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": self.__CONTINUE_PROMPT},
+            ]
+            finishReason = None
+            pieces += 1
+
+        yield {"role": role, "content": "", "finish_reason": finishReason, "usage": usage, "partial": partial}
+
+    @classmethod
+    def __messageField(cls, message, field: str) -> str:
+        """
+        Gets a field of a response message, which is a plain dict in the http access mode.
+
+        Args:
+            message: The message in a response choice
+            field (str): Name of the field
+
+        Returns:
+            str: Value of the field
+        """
+        return message[field] if isinstance(message, dict) else getattr(message, field)
+
     @classmethod
-    def estimateTokens(cls, text: str) -> int:
+    def estimateTokens(cls, text: str, model: str = None) -> int:
         """
         Estimates the number of tokens in a given text.
 
         Args:
             text (str): Input text
+            model (str): Model whose tokenization to follow (default: None for the default chat completion model)
 
         Returns:
             int: Number of tokens
         """
         if not text:
             return 0
-        if not cls.__tokenizer:
-            cls.__tokenizer = GPT2TokenizerFast.from_pretrained("gpt2")
 
-        return len(cls.__tokenizer(text)["input_ids"])
+        return TokenCounter.forModel(model or cls.__DEFAULT_MODELS["chatCompletion"]).count(text)
+
+    @classmethod
+    def estimateTokensMany(cls, texts: List[str], model: str = None) -> List[int]:
+        """
+        Estimates the number of tokens in each of the given texts, in a single tokenizer call.
+
+        Args:
+            texts (List[str]): Input texts
+            model (str): Model whose tokenization to follow (default: None for the default chat completion model)
+
+        Returns:
+            List[int]: Number of tokens of each text
+        """
+        return TokenCounter.forModel(model or cls.__DEFAULT_MODELS["chatCompletion"]).countMany(texts)
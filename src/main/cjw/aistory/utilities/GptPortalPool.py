@@ -0,0 +1,206 @@
+import logging
+import time
+from typing import List, Dict, Tuple, AsyncIterator, Callable, Awaitable, Any
+
+from cjw.aistory.utilities.ConcurrencyGovernor import ConcurrencyGovernor
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.RateLimiter import RateLimiter
+
+
+class GptPortalPool:
+    """
+    Spreads requests over several API keys and organizations, each with its own isolated GptPortal.
+
+    Each request goes to the key with the most client-side rate limit headroom for the model, and the fewest requests
+    in flight on ties.  A key failing authentication or running out of quota is taken out of rotation and the request
+    is sent again with another key.
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    class NoKeyAvailableError(GptPortal.ServiceNotAvailableError):  # Every key of the pool is out of rotation
+        pass
+
+    class Member:
+        """
+        A key of the pool, its portal and its statistics.
+        """
+
+        def __init__(self, portal: GptPortal):
+            self.portal = portal
+            self.active = True
+            self.disabledReason: str | None = None
+            self.inFlight = 0
+            self.requests = 0
+            self.failures = 0
+            self.since = time.monotonic()
+
+        def name(self) -> str:
+            """
+            Returns:
+                str: The key masked for logs and statistics
+            """
+            masked = f"...{self.portal.key[-4:]}"
+            return f"{self.portal.organization}/{masked}" if self.portal.organization else masked
+
+    def __init__(self, keys: List[str | Tuple[str, str]], **kwargs):
+        """
+        Initializes a pool.
+
+        Args:
+            keys (List[str | Tuple[str, str]]): API keys, or pairs of API key and organization
+            **kwargs: Keyword arguments for creating the portal of each key (see GptPortal.__init__).
+                Client-side rate limiting is turned on unless rateLimited is given, as routing follows its headroom.
+                The portals share the governor of the process, as those of GptPortal.of() do, unless governor is given.
+        """
+        if not keys:
+            raise ValueError("No API keys for the pool")
+
+        kwargs.setdefault("rateLimited", True)
+        kwargs.setdefault("governor", ConcurrencyGovernor.shared())
+        self.members = [
+            self.Member(GptPortal(*((key,) if isinstance(key, str) else key), **kwargs)) for key in keys
+        ]
+
+    async def __aenter__(self) -> "GptPortalPool":
+        return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        Closes the connection pools of the portals.
+        """
+        for member in self.members:
+            await member.portal.aclose()
+
+    def __route(self, model: str) -> "GptPortalPool.Member":
+        """
+        Picks the active key with the most rate limit headroom for the model.
+
+        Args:
+            model (str): Name of the model
+
+        Returns:
+            GptPortalPool.Member: The chosen member
+        """
+        active = [m for m in self.members if m.active]
+        if not active:
+            raise self.NoKeyAvailableError(
+                f"All keys are out of rotation: {', '.join(f'{m.name()} ({m.disabledReason})' for m in self.members)}"
+            )
+
+        return max(active, key=lambda m: (RateLimiter.of(m.portal.key, model).headroom(), -m.inFlight))
+
+    def __disable(self, member: "GptPortalPool.Member", error: Exception):
+        member.active = False
+        member.disabledReason = f"{type(error).__name__}: {error}"
+        self.logger.error(f"Taking key {member.name()} out of rotation. {member.disabledReason}")
+
+    async def __call(self, model: str, call: Callable[[GptPortal], Awaitable[Any]]) -> Any:
+        """
+        Makes a call with the best key, failing over to the other keys on authentication and quota errors.
+
+        Args:
+            model (str): Name of the model of the call
+            call (Callable[[GptPortal], Awaitable[Any]]): Function making the call with a portal
+
+        Returns:
+            Any: Result of the call
+        """
+        while True:
+            member = self.__route(model)
+            member.inFlight += 1
+            try:
+                result = await call(member.portal)
+                member.requests += 1
+                return result
+            except (GptPortal.AuthenticationError, GptPortal.QuotaExceededError) as e:
+                member.failures += 1
+                self.__disable(member, e)
+            except Exception:
+                member.failures += 1
+                raise
+            finally:
+                member.inFlight -= 1
+
+    async def completion(self, prompt: str, **kwargs) -> List[str] | str:
+        """
+        Performs text completion with the best key.  See GptPortal.completion.
+        """
+        model = kwargs.get("model", GptPortal.defaultModelOf("chatCompletion"))  # As GptPortal.completion defaults
+        return await self.__call(model, lambda portal: portal.completion(prompt, **kwargs))
+
+    async def completionBatch(self, prompts: List[str], **kwargs) -> List[List[str] | str | None]:
+        """
+        Performs text completion of many prompts with the best key.  See GptPortal.completionBatch.
+        """
+        model = kwargs.get("model", GptPortal.defaultModelOf("completion"))
+        return await self.__call(model, lambda portal: portal.completionBatch(prompts, **kwargs))
+
+    async def chatCompletion(self, messages: List[dict], **kwargs) -> dict | List[dict]:
+        """
+        Performs chat completion with the best key.  See GptPortal.chatCompletion.
+        """
+        model = kwargs.get("model", GptPortal.defaultModelOf("chatCompletion"))
+        return await self.__call(model, lambda portal: portal.chatCompletion(messages, **kwargs))
+
+    async def chatCompletionStream(self, messages: List[dict], **kwargs) -> AsyncIterator[dict]:
+        """
+        Streams chat completion with the best key.  See GptPortal.chatCompletionStream.
+        Fails over to another key only if nothing has been streamed yet.
+        """
+        model = kwargs.get("model", GptPortal.defaultModelOf("chatCompletion"))
+
+        while True:
+            member = self.__route(model)
+            member.inFlight += 1
+            streamed = False
+            try:
+                async for delta in member.portal.chatCompletionStream(messages, **kwargs):
+                    streamed = True
+                    yield delta
+                member.requests += 1
+                return
+            except (GptPortal.AuthenticationError, GptPortal.QuotaExceededError) as e:
+                member.failures += 1
+                self.__disable(member, e)
+                if streamed:
+                    raise
+            except Exception:
+                member.failures += 1
+                raise
+            finally:
+                member.inFlight -= 1
+
+    def restore(self, key: str):
+        """
+        Puts a key back into rotation, e.g. after its quota is raised.
+
+        Args:
+            key (str): The API key
+        """
+        for member in self.members:
+            if member.portal.key == key:
+                member.active = True
+                member.disabledReason = None
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns:
+            Dict[str, Dict[str, Any]]: Per masked key, whether it is in rotation, requests completed and failed,
+                requests in flight and throughput in requests per second
+        """
+        now = time.monotonic()
+        return {
+            m.name(): {
+                "active": m.active,
+                "disabledReason": m.disabledReason,
+                "requests": m.requests,
+                "failures": m.failures,
+                "inFlight": m.inFlight,
+                "throughput": m.requests / max(now - m.since, 1e-9),
+            }
+            for m in self.members
+        }
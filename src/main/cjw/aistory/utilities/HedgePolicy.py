@@ -0,0 +1,126 @@
+import logging
+import math
+from collections import deque
+from typing import Deque, Dict
+
+
+class HedgePolicy:
+    """
+    Decides when to hedge a slow request by sending a duplicate, within a budget of extra requests.
+
+    The hedge is sent once the request has taken longer than a percentile of the recent latencies of its model.
+    The first of the two to finish is used and the other is cancelled.
+
+    Attributes:
+        requests (int): Number of requests seen
+        hedges (int): Number of duplicates sent
+        wins (int): Number of duplicates finishing first
+        saved (float): Estimated seconds saved by the winning duplicates
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    DEFAULT_PERCENTILE = 95
+    DEFAULT_BUDGET = 0.05  # Duplicates allowed per request
+    DEFAULT_HISTORY = 200  # Latencies remembered per model
+    DEFAULT_MIN_SAMPLES = 20  # Latencies needed before hedging a model
+
+    def __init__(
+            self,
+            percentile: float = DEFAULT_PERCENTILE,
+            budget: float = DEFAULT_BUDGET,
+            history: int = DEFAULT_HISTORY,
+            minSamples: int = DEFAULT_MIN_SAMPLES,
+    ):
+        """
+        Initializes a hedge policy.
+
+        Args:
+            percentile (float): Percentile of the recent latencies after which to hedge (default: 95)
+            budget (float): Fraction of extra requests allowed for hedging (default: 0.05)
+            history (int): Number of recent latencies remembered per model
+            minSamples (int): Number of latencies needed before hedging requests of a model
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.history = history
+        self.minSamples = minSamples
+
+        self.__latencies: Dict[str, Deque[float]] = dict()
+
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+        self.saved = 0.0
+
+    def __quantile(self, latencies: Deque[float], percentile: float) -> float:
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(percentile / 100 * len(ordered)) - 1)]
+
+    def delay(self, model: str) -> float | None:
+        """
+        Counts a request, and tells how long to wait for it before hedging.
+
+        Args:
+            model (str): Model of the request
+
+        Returns:
+            float | None: Seconds to wait before sending a duplicate, or None not to hedge the request
+        """
+        self.requests += 1
+        latencies = self.__latencies.get(model)
+        if not latencies or len(latencies) < self.minSamples:
+            return None
+        return self.__quantile(latencies, self.percentile)
+
+    def allow(self) -> bool:
+        """
+        Takes a hedge from the budget if one is left.
+
+        Returns:
+            bool: True if a duplicate may be sent
+        """
+        if self.hedges + 1 > self.budget * self.requests:
+            return False
+        self.hedges += 1
+        return True
+
+    def record(self, model: str, latency: float):
+        """
+        Remembers the latency of a finished request.
+
+        Args:
+            model (str): Model of the request
+            latency (float): Seconds the request took
+        """
+        if model not in self.__latencies:
+            self.__latencies[model] = deque(maxlen=self.history)
+        self.__latencies[model].append(latency)
+
+    def won(self, model: str, elapsed: float):
+        """
+        Records a duplicate finishing first.  The time saved is estimated by the mean of the recent latencies
+        longer than the time elapsed, as the replaced request would have been one of them.
+
+        Args:
+            model (str): Model of the request
+            elapsed (float): Seconds from sending the original request to the duplicate finishing
+        """
+        self.wins += 1
+        slower = [latency for latency in self.__latencies.get(model, []) if latency > elapsed]
+        if slower:
+            self.saved += sum(slower) / len(slower) - elapsed
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns:
+            Dict[str, float]: Numbers of requests, hedges and hedges won, the fraction of hedges won, and the
+                estimated seconds saved
+        """
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "wins": self.wins,
+            "winRate": self.wins / self.hedges if self.hedges else 0.0,
+            "saved": self.saved,
+        }
@@ -0,0 +1,187 @@
+import asyncio
+import itertools
+import logging
+import math
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from cjw.aistory.utilities.Deadline import Deadline
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+
+
+class InferenceWorker:
+    """
+    Runs blocking local inference on a dedicated thread, fed by a queue, so the event loop stays responsive.
+
+    Callers await the result of their job while the thread works through the queue one job at a time, by priority
+    and then in the order queued.  PyTorch and llama.cpp release the GIL while computing, so the event loop keeps
+    serving other coroutines meanwhile.  Jobs whose deadline passes while they wait are dropped instead of run.
+
+    Attributes:
+        completed (int): Number of jobs finished, successfully or not
+        expired (int): Number of jobs dropped because their deadline passed while they waited
+        waited (float): Total seconds the jobs waited in the queue
+        computed (float): Total seconds spent running the jobs
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    class DeadlineExceededError(Exception):  # The job could not start before its deadline
+        pass
+
+    class Job:
+        """
+        A function call queued for the worker, and the future to resolve with its result.
+        """
+
+        def __init__(
+                self,
+                function: Callable,
+                args: tuple,
+                kwargs: dict,
+                future: asyncio.Future,
+                deadline: Deadline = None,
+        ):
+            self.function = function
+            self.args = args
+            self.kwargs = kwargs
+            self.future = future
+            self.deadline = deadline
+            self.loop = future.get_loop()
+            self.queued = time.monotonic()
+
+    def __init__(self, name: str = "inference"):
+        """
+        Initializes a worker and starts its thread.
+
+        Args:
+            name (str): Name of the thread, for logs and debugging
+        """
+        self.name = name
+        self.__queue: queue.PriorityQueue[Tuple[float, int, InferenceWorker.Job | None]] = queue.PriorityQueue()
+        self.__sequence = itertools.count()  # Keeps jobs of the same priority in order
+        self.__busy = False
+
+        self.completed = 0
+        self.expired = 0
+        self.waited = 0.0
+        self.computed = 0.0
+        self.lastWait = 0.0
+        self.lastCompute = 0.0
+
+        self.__thread = threading.Thread(target=self.__serve, name=name, daemon=True)
+        self.__thread.start()
+
+    async def run(
+            self,
+            function: Callable,
+            *args,
+            priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+            deadline: Deadline = None,
+            **kwargs,
+    ) -> Any:
+        """
+        Runs a blocking function on the worker thread.
+
+        Args:
+            function (Callable): The function
+            *args: Its positional arguments
+            priority (RequestScheduler.Priority): Priority of the job in the queue (default: INTERACTIVE)
+            deadline (Deadline): Deadline by which the job shall start (optional)
+            **kwargs: Its keyword arguments
+
+        Returns:
+            Any: What the function returns
+
+        Raises:
+            InferenceWorker.DeadlineExceededError: If the deadline passes before the job starts
+        """
+        if not self.__thread.is_alive():
+            raise RuntimeError(f"Inference worker {self.name} is closed")
+        if deadline and deadline.expired():
+            raise self.DeadlineExceededError(f"Deadline passed before queueing on inference worker {self.name}")
+
+        future = asyncio.get_running_loop().create_future()
+        self.__queue.put((priority.value, next(self.__sequence), self.Job(function, args, kwargs, future, deadline)))
+        return await future
+
+    def __serve(self):
+        while True:
+            _, _, job = self.__queue.get()
+            if job is None:
+                break
+            if job.future.cancelled():
+                continue  # The caller gave up while the job was waiting
+            if job.deadline and job.deadline.expired():
+                self.expired += 1
+                error = self.DeadlineExceededError(f"Deadline passed while waiting on inference worker {self.name}")
+                self.__settle(job, None, error)
+                continue
+
+            self.__busy = True
+            start = time.monotonic()
+            try:
+                result, error = job.function(*job.args, **job.kwargs), None
+            except Exception as e:
+                result, error = None, e
+            finally:
+                self.__busy = False
+
+            self.lastWait = start - job.queued
+            self.lastCompute = time.monotonic() - start
+            self.waited += self.lastWait
+            self.computed += self.lastCompute
+            self.completed += 1
+
+            self.__settle(job, result, error)
+
+    def __settle(self, job: "InferenceWorker.Job", result: Any, error: Exception | None):
+        try:
+            job.loop.call_soon_threadsafe(self.__resolve, job.future, result, error)
+        except RuntimeError:
+            self.logger.warning("The event loop of a job closed before it finished")
+
+    @classmethod
+    def __resolve(cls, future: asyncio.Future, result: Any, error: Exception | None):
+        if future.done():
+            return
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def queueDepth(self) -> int:
+        """
+        Returns:
+            int: Number of jobs waiting, not counting the one running
+        """
+        return self.__queue.qsize()
+
+    def close(self, timeout: float = None):
+        """
+        Stops the thread once the jobs queued are done.
+
+        Args:
+            timeout (float): Seconds to wait for the thread to stop (default: None to wait until it does)
+        """
+        self.__queue.put((math.inf, next(self.__sequence), None))
+        self.__thread.join(timeout)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns:
+            Dict[str, float]: Jobs waiting, running, completed and expired, and the mean and latest seconds of
+                waiting in the queue and of computing
+        """
+        return {
+            "queueDepth": self.queueDepth(),
+            "running": int(self.__busy),
+            "completed": self.completed,
+            "expired": self.expired,
+            "meanWait": self.waited / self.completed if self.completed else 0.0,
+            "meanCompute": self.computed / self.completed if self.completed else 0.0,
+            "lastWait": self.lastWait,
+            "lastCompute": self.lastCompute,
+        }
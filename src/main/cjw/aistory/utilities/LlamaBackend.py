@@ -0,0 +1,174 @@
+from abc import ABC, abstractmethod
+from typing import Any, List, Tuple
+
+
+class LlamaBackend(ABC):
+    """
+    Abstract base class of the engines running a local model for LlamaPortal.
+
+    Its methods block for as long as the computation takes, so LlamaPortal calls them on its inference worker.
+
+    Besides completing prompts, an engine exposes the attention (KV) state of the model, so chats can resume from the
+    state of the history they extend: prefill() extends a state with more tokens, possibly in place, and decode()
+    generates from one, leaving it as it was so it can stay cached.
+    """
+
+    PIPELINE = "pipeline"
+    GGUF = "gguf"
+
+    @classmethod
+    def of(cls, engine: str, modelName: str, **kwargs) -> "LlamaBackend":
+        """
+        Loads a model with an engine.
+
+        Args:
+            engine (str): "pipeline" for Hugging Face transformers, or "gguf" for a quantized llama.cpp model
+            modelName (str): Hugging Face name of the model, or path of the GGUF file
+            **kwargs: Options of the engine
+
+        Returns:
+            LlamaBackend: The engine with the model loaded
+        """
+        if engine == cls.PIPELINE:
+            from cjw.aistory.utilities.PipelineBackend import PipelineBackend
+            return PipelineBackend(modelName, **kwargs)
+        elif engine == cls.GGUF:
+            from cjw.aistory.utilities.LlamaCppBackend import LlamaCppBackend
+            return LlamaCppBackend(modelName, **kwargs)
+        else:
+            raise ValueError(f"Unknown engine {engine}")
+
+    @classmethod
+    def engineOf(cls, modelName: str) -> str:
+        """
+        Args:
+            modelName (str): Hugging Face name of the model, or path of the GGUF file
+
+        Returns:
+            str: The engine suiting the model
+        """
+        return cls.GGUF if modelName.lower().endswith(".gguf") else cls.PIPELINE
+
+    @classmethod
+    def formatChat(cls, messages: List[dict]) -> List[str]:
+        """
+        Formats a chat by the Llama 2 chat template, in segments that each depend only on the messages up to theirs.
+
+        Args:
+            messages (List[dict]): Messages of the chat, each with a role and content
+
+        Returns:
+            List[str]: A segment per message, which joined make the prompt
+        """
+        segments = []
+        instructing = False  # Inside [INST] ... [/INST]
+        for message in messages:
+            role, content = message["role"], message["content"].strip()
+            if role == "system":
+                segments.append(("" if instructing else "<s>[INST] ") + f"<<SYS>>\n{content}\n<</SYS>>\n\n")
+                instructing = True
+            elif role == "user":
+                segments.append(("" if instructing else "<s>[INST] ") + f"{content} [/INST]")
+                instructing = False
+            else:
+                segments.append(f" {content} </s>")
+        return segments
+
+    @abstractmethod
+    def generate(self, prompts: List[str], maxTokens: int = None, temperature: float = None) -> List[str]:
+        """
+        Abstract method for completing prompts.
+
+        Args:
+            prompts (List[str]): The prompts
+            maxTokens (int): Largest number of tokens of each completion (default: None for the model's default)
+            temperature (float): Sampling temperature, 0 for greedy (default: None for the model's default)
+
+        Returns:
+            List[str]: The completion of each prompt, without the prompt
+        """
+        pass
+
+    @abstractmethod
+    def tokenize(self, text: str) -> List[int]:
+        """
+        Abstract method for tokenizing a text, without adding a beginning of sequence token.
+
+        Args:
+            text (str): The text, in which special tokens like <s> are parsed as such
+
+        Returns:
+            List[int]: The tokens
+        """
+        pass
+
+    @abstractmethod
+    def prefill(self, state: Any, tokens: List[int]) -> Any:
+        """
+        Abstract method for running the model over more tokens of a prompt.
+
+        Args:
+            state (Any): State of the prompt so far, which may be changed, or None to start a new one
+            tokens (List[int]): Tokens to add
+
+        Returns:
+            Any: A new state of the prompt with the tokens added
+        """
+        pass
+
+    @abstractmethod
+    def decode(self, state: Any, maxTokens: int = None, temperature: float = None) -> Tuple[str, str]:
+        """
+        Abstract method for generating a completion from the state of a prompt.
+
+        Args:
+            state (Any): State of the prompt
+            maxTokens (int): Largest number of tokens of the completion (default: None for up to the context window)
+            temperature (float): Sampling temperature, 0 for greedy (default: None for the model's default)
+
+        Returns:
+            Tuple[str, str]: The completion, and why it finished, "stop" or "length"
+        """
+        pass
+
+    @abstractmethod
+    def stateSize(self, state: Any) -> int:
+        """
+        Abstract method for getting the memory a state takes.
+
+        Args:
+            state (Any): The state
+
+        Returns:
+            int: Bytes taken by the state
+        """
+        pass
+
+    @abstractmethod
+    def countTokens(self, text: str) -> int:
+        """
+        Abstract method for counting the tokens of a text by the model's tokenizer.
+
+        Args:
+            text (str): The text
+
+        Returns:
+            int: Number of tokens
+        """
+        pass
+
+    @abstractmethod
+    def memoryFootprint(self) -> int:
+        """
+        Abstract method for getting the memory the model takes.
+
+        Returns:
+            int: Bytes taken by the weights
+        """
+        pass
+
+    def close(self):
+        """
+        Releases the resources of the engine.
+        """
+        pass
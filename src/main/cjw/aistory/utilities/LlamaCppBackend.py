@@ -0,0 +1,92 @@
+import os
+from typing import Any, List, Tuple
+
+from cjw.aistory.utilities.LlamaBackend import LlamaBackend
+
+
+class LlamaCppBackend(LlamaBackend):
+    """
+    Runs a quantized GGUF model with llama.cpp, which is fast enough on CPU.
+
+    The weights are memory-mapped from the file by default, so worker processes on the same node share their pages
+    instead of each reading a copy.  llama.cpp completes one prompt at a time, so the prompts of a batch are run in
+    turn.  The KV states of prompts are snapshots of the context saved by llama.cpp.
+    """
+
+    DEFAULT_CONTEXT_SIZE = 4096
+    DEFAULT_BATCH_SIZE = 512  # Prompt tokens evaluated per step
+
+    def __init__(self, modelPath: str, **kwargs):
+        """
+        Loads a model.
+
+        Args:
+            modelPath (str): Path of the GGUF file
+            **kwargs: threads for the number of CPU threads (default: None for all cores), batchSize for the prompt
+                tokens evaluated per step, contextSize for the tokens of the context window, mmap to memory-map the
+                weights (default: True), and gpuLayers to offload to a GPU (default: 0)
+        """
+        from llama_cpp import Llama
+
+        self.modelPath = modelPath
+        self.llm = Llama(
+            model_path=modelPath,
+            n_ctx=kwargs.get("contextSize", self.DEFAULT_CONTEXT_SIZE),
+            n_batch=kwargs.get("batchSize", self.DEFAULT_BATCH_SIZE),
+            n_threads=kwargs.get("threads") or os.cpu_count(),
+            use_mmap=kwargs.get("mmap", True),
+            n_gpu_layers=kwargs.get("gpuLayers", 0),
+            verbose=False,
+        )
+
+    def generate(self, prompts: List[str], maxTokens: int = None, temperature: float = None) -> List[str]:
+        options = {} if temperature is None else {"temperature": temperature}
+        return [
+            self.llm(prompt, max_tokens=maxTokens or -1, echo=False, **options)["choices"][0]["text"]
+            for prompt in prompts
+        ]
+
+    def tokenize(self, text: str) -> List[int]:
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+
+    def prefill(self, state: Any, tokens: List[int]) -> Any:
+        if not tokens:
+            return state
+        if state is None:
+            self.llm.reset()
+        else:
+            self.llm.load_state(state)
+        self.llm.eval(tokens)
+        return self.llm.save_state()
+
+    def decode(self, state: Any, maxTokens: int = None, temperature: float = None) -> Tuple[str, str]:
+        self.llm.load_state(state)
+        maxTokens = maxTokens or self.llm.n_ctx() - self.llm.n_tokens
+        options = {} if temperature is None else {"temp": temperature}
+
+        generated = []
+        finishReason = "length"
+        for _ in range(maxTokens):
+            token = self.llm.sample(**options)
+            if token == self.llm.token_eos():
+                finishReason = "stop"
+                break
+            generated.append(token)
+            self.llm.eval([token])
+
+        return self.llm.detokenize(generated).decode("utf-8", errors="ignore").strip(), finishReason
+
+    def stateSize(self, state: Any) -> int:
+        return state.llama_state_size
+
+    def countTokens(self, text: str) -> int:
+        return len(self.tokenize(text))
+
+    def memoryFootprint(self) -> int:
+        # Mapped pages are shared by the processes using the file, and can be dropped by the OS under pressure
+        return os.path.getsize(self.modelPath)
+
+    def close(self):
+        if hasattr(self.llm, "close"):  # Older versions free the model only when garbage collected
+            self.llm.close()
+        self.llm = None
@@ -1,42 +1,197 @@
-from threading import Lock
-from typing import List
+import asyncio
+import os
+import time
+from typing import Dict, List
 
-import torch
-import transformers
-from transformers import AutoTokenizer
+from cjw.aistory.utilities.Deadline import Deadline
+from cjw.aistory.utilities.InferenceWorker import InferenceWorker
+from cjw.aistory.utilities.LlamaBackend import LlamaBackend
+from cjw.aistory.utilities.MicroBatcher import MicroBatcher
+from cjw.aistory.utilities.ModelRegistry import ModelRegistry
+from cjw.aistory.utilities.PrefixCache import PrefixCache
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+from cjw.aistory.utilities.UsageLedger import UsageLedger
 
 
 class LlamaPortal:
+    DeadlineExceededError = InferenceWorker.DeadlineExceededError  # The response could not be started in time
+
+    class Model:
+        """
+        A model loaded, with the worker thread generating with it.  Portals of the same model share it.
+        """
+
+        def __init__(self, backend: LlamaBackend, name: str, **kwargs):
+            self.backend = backend
+
+            # Generation blocks, so it runs on a thread of its own, one batch of concurrent prompts at a time
+            self.worker = InferenceWorker(name=f"llama-{name}")
+            self.batcher = MicroBatcher(
+                lambda prompts, **options: self.worker.run(self.backend.generate, prompts, **options),
+                window=kwargs.get("batchWindow", MicroBatcher.DEFAULT_WINDOW),
+                maxBatch=kwargs.get("maxBatch", MicroBatcher.DEFAULT_MAX_BATCH),
+            )
+
+            # Turns of a chat resend the same history, whose KV state is kept to prefill only what is new
+            self.prefixes = PrefixCache(kwargs.get("prefixCacheBytes", PrefixCache.DEFAULT_CAPACITY))
+
+        def chat(
+                self,
+                messages: List[dict],
+                maxTokens: int = None,
+                temperature: float = None,
+                deadline: Deadline = None,
+        ) -> dict:
+            if not messages:
+                raise ValueError("No messages to respond to")
+
+            segments = self.backend.formatChat(messages)
+            keys = PrefixCache.keysOf(segments)
+            reused, state = self.prefixes.longest(keys)
+
+            tokens = [token for segment in segments[reused:] for token in self.backend.tokenize(segment)]
+            if tokens and state is not None:
+                # The chat moves on from the state of its history, so the engine may extend it instead of a copy
+                self.prefixes.take(keys[reused - 1])
+            state = self.backend.prefill(state, tokens)
+            self.prefixes.put(keys[-1], state, self.backend.stateSize(state))
+
+            # The prefilled state stays cached for a retry, but decoding past the deadline is wasted
+            if deadline and deadline.expired():
+                raise LlamaPortal.DeadlineExceededError("Deadline passed before decoding")
+
+            content, finishReason = self.backend.decode(state, maxTokens, temperature)
+            promptTokens = sum(self.backend.countTokens(segment) for segment in segments[:reused]) + len(tokens)
+            completionTokens = self.backend.countTokens(content)
+            return {
+                "role": "assistant",
+                "content": content,
+                "finish_reason": finishReason,
+                "usage": {
+                    "prompt_tokens": promptTokens,
+                    "completion_tokens": completionTokens,
+                    "total_tokens": promptTokens + completionTokens,
+                },
+                "reusedMessages": reused,
+                "prefilledTokens": len(tokens),
+            }
+
+        def memoryFootprint(self) -> int:
+            return self.backend.memoryFootprint()
+
+        def close(self):
+            self.worker.close()
+            self.prefixes.clear()
+            self.backend.close()
+
     @classmethod
     def of(cls, modelName: str, **kwargs) -> "LlamaPortal":
         return LlamaPortal(modelName, **kwargs)
 
     def __init__(self, modelName: str, **kwargs):
-        self.mutex = Lock()
+        """
+        Initializes a portal to a local model.  The model loads on first use, once per process for all portals.
 
+        Args:
+            modelName (str): Hugging Face name of the model, or path of a GGUF file
+            **kwargs: engine running the model, "pipeline" or "gguf" or a LlamaBackend class (default: by the model
+                name), key for the Hugging Face access token, dtype of the weights (default: "float16"), quantization
+                ("8bit" or "4bit", default: None), batchWindow and maxBatch for batching concurrent prompts, registry
+                to share the model through (default: ModelRegistry.shared()), prefixCacheBytes for the KV states of
+                chat prefixes kept (default: 1 GiB), ledger of the tokens of the chats (default: UsageLedger.shared()),
+                and the options of the engine, e.g. threads and batchSize for GGUF models
+        """
         self.key = kwargs.get("key", None)
+        self.modelName = modelName
+        self.ledger = kwargs.pop("ledger", None) or UsageLedger.shared()
+        engine = kwargs.pop("engine", None) or LlamaBackend.engineOf(modelName)
+        registry = kwargs.pop("registry", None) or ModelRegistry.shared()
+
+        def load() -> LlamaPortal.Model:
+            if isinstance(engine, str):
+                backend = LlamaBackend.of(engine, modelName, **kwargs)
+            else:
+                backend = engine(modelName, **kwargs)
+            return LlamaPortal.Model(backend, os.path.basename(modelName), **kwargs)
 
-        self.tokenizer = AutoTokenizer.from_pretrained(modelName, user_auth_token=self.key)
-        self.pipeline = transformers.pipeline(
-            task="text-generation",
-            model=modelName,
-            torch_dtype=torch.float16,
-            device_map="auto",
+        # Portals share a model only if it is loaded the same way, so the key has all the options but the token
+        engineName = engine if isinstance(engine, str) else f"{engine.__module__}.{engine.__qualname__}"
+        options = tuple(sorted((k, str(v)) for k, v in kwargs.items() if k not in ["key", "dtype", "quantization"]))
+        self.model = registry.acquire(
+            (modelName, engineName, kwargs.get("dtype", "float16"), kwargs.get("quantization"), options),
+            loader=load,
+            unloader=LlamaPortal.Model.close,
         )
 
+    async def __loaded(self) -> "LlamaPortal.Model":
+        # Loading takes long, so it is kept off the event loop
+        return self.model.loaded or await asyncio.to_thread(self.model.get)
+
     async def completion(self, prompt: str, **kwargs) -> List[str]:
-        self.mutex.acquire()
-        sequences = self.pipeline(
-            prompt,
-            # do_sample=True,
-            # top_k=10,
-            # num_return_sequences=1,
-            eos_token_id=self.tokenizer.eos_token_id,
-            # max_length=200,
-        )
-        self.mutex.release()
-        return sequences
+        """
+        Completes a prompt, batched with the prompts of the same options requested at the same time.
+
+        Args:
+            prompt (str): The prompt
+            **kwargs: maxTokens and temperature of the completion (optional)
+
+        Returns:
+            List[str]: The completion
+        """
+        options = {k: kwargs[k] for k in ["maxTokens", "temperature"] if kwargs.get(k) is not None}
+        with self.model.using():
+            model = await self.__loaded()
+            return [await model.batcher.submit(prompt, **options)]
 
     async def chatCompletion(self, messages: List[dict], **kwargs) -> List[dict]:
-        pass
+        """
+        Responds to a chat, resuming from the KV state of the longest prefix of it seen recently, so that only the
+        messages after it are prefilled.
+
+        Args:
+            messages (List[dict]): List of messages in chat conversation
+            **kwargs: maxTokens and temperature of the response, priority of the chat waiting for the model
+                (default: INTERACTIVE), deadline by which it shall start decoding, and tags of who makes the call for
+                the usage ledger (optional)
+
+        Returns:
+            List[dict]: The response as a message.  Besides role, content, finish_reason and usage, it has the number
+                of messages whose state was reused, the number of tokens prefilled, and the seconds spent.
+
+        Raises:
+            LlamaPortal.DeadlineExceededError: If the deadline passes before the response is decoded
+        """
+        deadline = kwargs.get("deadline")
+        startTime = time.perf_counter()
+        with self.model.using():
+            model = await self.__loaded()
+            completion = await model.worker.run(
+                model.chat,
+                messages,
+                kwargs.get("maxTokens"),
+                kwargs.get("temperature"),
+                deadline,
+                priority=kwargs.get("priority") or RequestScheduler.Priority.INTERACTIVE,
+                deadline=deadline,
+            )
+
+        self.ledger.record(self.modelName, completion["usage"], kwargs.get("tags"))
+        completion["elapsed"] = time.perf_counter() - startTime
+        return [completion]
+
+    def close(self):
+        """
+        Releases the model, which unloads once no portal uses it for the idle timeout of the registry.
+        """
+        self.model.release()
 
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns:
+            Dict[str, float]: Queue depth, the mean and latest seconds the batches waited and computed, the sizes of
+                the batches, and the use of the prefix cache, or nothing while the model is not loaded
+        """
+        model = self.model.loaded
+        if model is None:
+            return {}
+        return {**model.worker.stats(), "batching": model.batcher.stats(), "prefixes": model.prefixes.stats()}
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests for a short window and serves them with a single batched call.
+
+    A batch is sent once the window since its first request closes, or as soon as it holds the maximum number of
+    requests.  Only requests with the same keyword arguments, e.g. the same generation parameters, share a batch.  The
+    batched function takes the list of items and returns the list of their results in the same order.
+
+    Attributes:
+        batches (int): Number of batches sent
+        items (int): Number of requests served in the batches
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    DEFAULT_WINDOW = 0.02  # Seconds to wait for more requests after the first of a batch
+    DEFAULT_MAX_BATCH = 8
+
+    class Batch:
+        """
+        Requests waiting to be sent together.
+        """
+
+        def __init__(self, kwargs: dict):
+            self.kwargs = kwargs
+            self.items: List[Any] = []
+            self.futures: List[asyncio.Future] = []
+            self.timer: asyncio.TimerHandle | None = None
+
+    def __init__(
+            self,
+            function: Callable[..., Awaitable[List[Any]]],
+            window: float = DEFAULT_WINDOW,
+            maxBatch: int = DEFAULT_MAX_BATCH,
+    ):
+        """
+        Initializes a batcher.
+
+        Args:
+            function (Callable[..., Awaitable[List[Any]]]): Async function of a list of items and keyword arguments,
+                returning their results
+            window (float): Seconds to wait for more requests after the first of a batch
+            maxBatch (int): Largest number of requests in a batch
+        """
+        if maxBatch < 1:
+            raise ValueError(f"Batches must hold at least one request, not {maxBatch}")
+
+        self.function = function
+        self.window = window
+        self.maxBatch = maxBatch
+
+        self.__pending: Dict[str, MicroBatcher.Batch] = dict()  # Keyword arguments: batch being collected
+        self.__tasks: set[asyncio.Task] = set()
+
+        self.batches = 0
+        self.items = 0
+        self.sizes: Dict[int, int] = dict()  # Batch size: number of batches of that size
+
+    async def submit(self, item: Any, **kwargs) -> Any:
+        """
+        Adds an item to the batch being collected and waits for its result.
+
+        Args:
+            item (Any): The item, e.g. a prompt
+            **kwargs: Keyword arguments of the batched call
+
+        Returns:
+            Any: The result of the item
+        """
+        key = repr(sorted(kwargs.items()))
+        batch = self.__pending.get(key)
+        if batch is None:
+            batch = self.__pending[key] = self.Batch(kwargs)
+            if self.window > 0 and self.maxBatch > 1:
+                batch.timer = asyncio.get_running_loop().call_later(self.window, self.__flush, key)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+
+        if len(batch.items) >= self.maxBatch or batch.timer is None:
+            self.__flush(key)
+
+        return await future
+
+    def __flush(self, key: str):
+        batch = self.__pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer:
+            batch.timer.cancel()
+
+        task = asyncio.create_task(self.__send(batch))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def __send(self, batch: "MicroBatcher.Batch"):
+        size = len(batch.items)
+        self.batches += 1
+        self.items += size
+        self.sizes[size] = self.sizes.get(size, 0) + 1
+
+        try:
+            results = await self.function(batch.items, **batch.kwargs)
+            if len(results) != size:
+                raise ValueError(f"Batch of {size} requests got {len(results)} results")
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result in zip(batch.futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, float | Dict[int, int]]:
+        """
+        Returns:
+            Dict[str, float | Dict[int, int]]: Batches sent, requests served, the mean batch size, and the number of
+                batches of each size
+        """
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "meanBatchSize": self.items / self.batches if self.batches else 0.0,
+            "sizes": dict(sorted(self.sizes.items())),
+        }
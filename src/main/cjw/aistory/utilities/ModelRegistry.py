@@ -0,0 +1,333 @@
+import contextlib
+import gc
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterator
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of the local models loaded, so all portals and bots using a model share one copy of it.
+
+    A user acquires a handle on a model by its key, e.g. (name, dtype, quantization), which counts as a reference.  The
+    model loads on the first use through any handle, and unloads once it has been idle for the idle timeout, or to make
+    room when the models loaded exceed the memory limit.  The next use loads it again.  A model unloaded with no
+    reference left is forgotten.
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    DEFAULT_IDLE_TIMEOUT = 600  # Seconds a model stays loaded without being used
+
+    __shared: "ModelRegistry" = None
+
+    class Entry:
+        """
+        A model of the registry, loaded or not.
+        """
+
+        def __init__(self, key: Hashable, loader: Callable[[], Any], unloader: Callable[[Any], None] | None):
+            self.key = key
+            self.loader = loader
+            self.unloader = unloader
+            self.model: Any = None
+            self.size = 0
+            self.references = 0
+            self.active = 0
+            self.loads = 0
+            self.lastUsed = time.monotonic()
+            self.loading = threading.Lock()
+
+    class Handle:
+        """
+        A reference to a model of the registry.  Release it once done with the model.
+        """
+
+        def __init__(self, registry: "ModelRegistry", key: Hashable):
+            self.registry = registry
+            self.key = key
+            self.released = False
+
+        def get(self) -> Any:
+            """
+            Returns:
+                Any: The model, loading it first if needed, which blocks for as long as the loading takes
+            """
+            return self.registry.load(self.key)
+
+        @property
+        def loaded(self) -> Any:
+            """
+            Returns:
+                Any: The model if it is loaded, else None
+            """
+            return self.registry.peek(self.key)
+
+        @contextlib.contextmanager
+        def using(self) -> Iterator[None]:
+            """
+            Keeps the model from unloading while the block runs.
+            """
+            self.registry.begin(self.key)
+            try:
+                yield
+            finally:
+                self.registry.end(self.key)
+
+        def release(self):
+            """
+            Gives up the reference to the model.
+            """
+            if not self.released:
+                self.released = True
+                self.registry.release(self.key)
+
+    @classmethod
+    def shared(cls) -> "ModelRegistry":
+        """
+        Returns:
+            ModelRegistry: The registry shared by the whole process
+        """
+        if cls.__shared is None:
+            cls.__shared = ModelRegistry()
+        return cls.__shared
+
+    @classmethod
+    def footprintOf(cls, model: Any) -> int:
+        """
+        Args:
+            model (Any): A model loaded
+
+        Returns:
+            int: Bytes the model takes, as told by its memoryFootprint() method, or 0 if it has none
+        """
+        footprint = getattr(model, "memoryFootprint", None)
+        return int(footprint()) if callable(footprint) else 0
+
+    def __init__(
+            self,
+            idleTimeout: float | None = DEFAULT_IDLE_TIMEOUT,
+            memoryLimit: int = None,
+            sweepInterval: float = None,
+    ):
+        """
+        Initializes a registry.  Use shared() to get the one of the process.
+
+        Args:
+            idleTimeout (float | None): Seconds a model stays loaded without being used (None to keep it loaded)
+            memoryLimit (int): Bytes the models loaded may take together (default: None for no limit)
+            sweepInterval (float): Seconds between checks for idle models by a background thread (default: None for
+                half the idle timeout, up to a minute; 0 for no background checks)
+        """
+        self.idleTimeout = idleTimeout
+        self.memoryLimit = memoryLimit
+        if sweepInterval is None:
+            sweepInterval = min(idleTimeout / 2, 60) if idleTimeout else 0
+        self.sweepInterval = sweepInterval
+
+        self.__entries: Dict[Hashable, ModelRegistry.Entry] = dict()
+        self.__lock = threading.Lock()
+        self.__sweeper: threading.Thread | None = None
+
+    def acquire(
+            self,
+            key: Hashable,
+            loader: Callable[[], Any],
+            unloader: Callable[[Any], None] = None,
+    ) -> "ModelRegistry.Handle":
+        """
+        Acquires a reference to a model, without loading it yet.
+
+        Args:
+            key (Hashable): What identifies the model, e.g. (name, dtype, quantization)
+            loader (Callable[[], Any]): Function loading the model, if the registry does not have it yet
+            unloader (Callable[[Any], None]): Function releasing the resources of the model when it unloads (optional)
+
+        Returns:
+            ModelRegistry.Handle: The reference
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                entry = self.__entries[key] = self.Entry(key, loader, unloader)
+            entry.references += 1
+
+            if self.sweepInterval and self.__sweeper is None:
+                self.__sweeper = threading.Thread(target=self.__sweepPeriodically, name="model-sweeper", daemon=True)
+                self.__sweeper.start()
+
+        return self.Handle(self, key)
+
+    def __entry(self, key: Hashable) -> "ModelRegistry.Entry":
+        entry = self.__entries.get(key)
+        if entry is None:
+            raise KeyError(f"Model {key} is not acquired")
+        return entry
+
+    def load(self, key: Hashable) -> Any:
+        """
+        Args:
+            key (Hashable): Key of an acquired model
+
+        Returns:
+            Any: The model, loading it first if needed
+        """
+        entry = self.__entry(key)
+        with entry.loading:
+            if entry.model is None:
+                start = time.monotonic()
+                model = entry.loader()
+                with self.__lock:
+                    entry.model = model
+                    entry.size = self.footprintOf(model)
+                    entry.loads += 1
+                self.logger.info(f"Loaded {key} in {time.monotonic() - start:.1f}s, taking {entry.size} bytes")
+            entry.lastUsed = time.monotonic()
+            model = entry.model
+
+        self.__relieve(spare=entry)
+        return model
+
+    def peek(self, key: Hashable) -> Any:
+        """
+        Args:
+            key (Hashable): Key of an acquired model
+
+        Returns:
+            Any: The model if it is loaded, else None
+        """
+        entry = self.__entries.get(key)
+        if entry is None or entry.model is None:
+            return None
+        entry.lastUsed = time.monotonic()
+        return entry.model
+
+    def begin(self, key: Hashable):
+        """
+        Marks a model in use, so it does not unload.
+
+        Args:
+            key (Hashable): Key of an acquired model
+        """
+        with self.__lock:
+            entry = self.__entry(key)
+            entry.active += 1
+            entry.lastUsed = time.monotonic()
+
+    def end(self, key: Hashable):
+        """
+        Marks the end of a use of a model.
+
+        Args:
+            key (Hashable): Key of an acquired model
+        """
+        with self.__lock:
+            entry = self.__entry(key)
+            entry.active -= 1
+            entry.lastUsed = time.monotonic()
+
+    def release(self, key: Hashable):
+        """
+        Gives up a reference to a model.  Prefer ModelRegistry.Handle.release(), which does it once.
+
+        Args:
+            key (Hashable): Key of an acquired model
+        """
+        with self.__lock:
+            entry = self.__entry(key)
+            entry.references -= 1
+            if entry.references <= 0 and entry.model is None:
+                del self.__entries[key]
+
+    def unload(self, key: Hashable) -> bool:
+        """
+        Unloads a model unless it is in use or loading.
+
+        Args:
+            key (Hashable): Key of the model
+
+        Returns:
+            bool: Whether the model unloaded
+        """
+        entry = self.__entries.get(key)
+        if entry is None or not entry.loading.acquire(blocking=False):
+            return False
+
+        try:
+            with self.__lock:
+                if entry.model is None or entry.active > 0:
+                    return False
+                model, entry.model, entry.size = entry.model, None, 0
+                if entry.references <= 0:
+                    del self.__entries[key]
+        finally:
+            entry.loading.release()
+
+        if entry.unloader:
+            entry.unloader(model)
+        del model
+        gc.collect()
+
+        self.logger.info(f"Unloaded {key}")
+        return True
+
+    def sweep(self):
+        """
+        Unloads the models idle for longer than the idle timeout, and more if they take more than the memory limit.
+        """
+        if self.idleTimeout is not None:
+            now = time.monotonic()
+            for entry in list(self.__entries.values()):
+                if entry.model is not None and entry.active <= 0 and now - entry.lastUsed >= self.idleTimeout:
+                    self.unload(entry.key)
+
+        self.__relieve()
+
+    def __sweepPeriodically(self):
+        while True:
+            time.sleep(self.sweepInterval)
+            try:
+                self.sweep()
+            except Exception as e:
+                self.logger.warning(f"Failed to sweep idle models: {e}")
+
+    def __relieve(self, spare: "ModelRegistry.Entry" = None):
+        if self.memoryLimit is None:
+            return
+
+        # Least recently used first, sparing those in use and the one just loaded
+        for entry in sorted(self.__entries.values(), key=lambda e: e.lastUsed):
+            if self.memoryUsed() <= self.memoryLimit:
+                return
+            if entry.active <= 0 and entry is not spare:
+                self.unload(entry.key)
+
+        if self.memoryUsed() > self.memoryLimit:
+            self.logger.warning(f"Models in use take {self.memoryUsed()} bytes, over the limit of {self.memoryLimit}")
+
+    def memoryUsed(self) -> int:
+        """
+        Returns:
+            int: Bytes the models loaded take together
+        """
+        return sum(entry.size for entry in list(self.__entries.values()))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns:
+            Dict[str, Dict[str, Any]]: Per model, whether it is loaded, its size, references, uses in progress, times
+                loaded and seconds idle
+        """
+        now = time.monotonic()
+        return {
+            str(entry.key): {
+                "loaded": entry.model is not None,
+                "size": entry.size,
+                "references": entry.references,
+                "active": entry.active,
+                "loads": entry.loads,
+                "idle": now - entry.lastUsed,
+            }
+            for entry in list(self.__entries.values())
+        }
@@ -0,0 +1,312 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Callable, Dict, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+class OpenAIStub:
+    """
+    Local server mimicking the /v1/chat/completions and /v1/completions endpoints of OpenAI, for load and soak tests.
+
+    Responses are made of filler words, one token each, after a latency drawn from a configurable distribution.
+    Completions longer than max_tokens are truncated with finish_reason "length", and usage is accounted by words.
+    Rate limiting (429) and server errors (5xx) are injected at configurable rates, and prompts longer than the context
+    window are rejected (400) like the real service does.  Streaming requests get server-sent events.
+
+    Attributes:
+        requests (int): Number of requests received
+        errors (Dict[int, int]): Number of errors returned, by HTTP status
+        promptTokens (int): Prompt tokens of the requests answered
+        completionTokensServed (int): Completion tokens of the requests answered
+        inFlight (int): Number of requests being answered
+        maxInFlight (int): Largest number of requests answered at the same time
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    DEFAULT_COMPLETION_TOKENS = 64
+    DEFAULT_CONTEXT_WINDOW = 8192
+
+    __WORDS = [
+        "once", "upon", "a", "time", "the", "dragon", "slept", "under", "mountain", "and", "dreamed", "of", "gold"
+    ]
+    __TOKENS_PER_MESSAGE = 4
+
+    @classmethod
+    def constant(cls, seconds: float) -> Callable[[random.Random], float]:
+        """
+        Returns:
+            Callable[[random.Random], float]: Latency distribution always giving the same seconds
+        """
+        return lambda rng: seconds
+
+    @classmethod
+    def exponential(cls, mean: float) -> Callable[[random.Random], float]:
+        """
+        Returns:
+            Callable[[random.Random], float]: Exponential latency distribution of the given mean seconds
+        """
+        return lambda rng: rng.expovariate(1 / mean) if mean > 0 else 0.0
+
+    @classmethod
+    def lognormal(cls, median: float, sigma: float = 0.5) -> Callable[[random.Random], float]:
+        """
+        Returns:
+            Callable[[random.Random], float]: Log-normal latency distribution of the given median seconds, with the
+                long tail typical of API latencies
+        """
+        return lambda rng: median * rng.lognormvariate(0, sigma)
+
+    def __init__(
+            self,
+            latency: Callable[[random.Random], float] = None,
+            chunkDelay: float = 0.0,
+            completionTokens: int | Callable[[random.Random], int] = DEFAULT_COMPLETION_TOKENS,
+            errorRates: Dict[int, float] = None,
+            retryAfter: float = None,
+            contextWindow: int = DEFAULT_CONTEXT_WINDOW,
+            seed: int = None,
+    ):
+        """
+        Initializes a stub server.  Start it with start(), or use it as an async context manager.
+
+        Args:
+            latency (Callable[[random.Random], float]): Distribution of the seconds before responding, e.g.
+                OpenAIStub.lognormal(0.5) (default: None to respond at once)
+            chunkDelay (float): Seconds between the chunks of a streamed response
+            completionTokens (int | Callable[[random.Random], int]): Tokens of each choice before truncation by
+                max_tokens, or their distribution
+            errorRates (Dict[int, float]): Probability of responding with each HTTP error status, e.g. {429: 0.05}
+            retryAfter (float): Seconds advised by the retry-after-ms header of 429 responses (default: None)
+            contextWindow (int): Tokens of the context window shared by the prompt and max_tokens
+            seed (int): Seed of the random draws, for repeatable runs (optional)
+        """
+        self.latency = latency
+        self.chunkDelay = chunkDelay
+        self.completionTokens = completionTokens
+        self.errorRates = errorRates or {}
+        self.retryAfter = retryAfter
+        self.contextWindow = contextWindow
+        self.random = random.Random(seed)
+
+        self.url: str | None = None
+        self.__runner: "web.AppRunner | None" = None
+
+        self.requests = 0
+        self.errors: Dict[int, int] = dict()
+        self.promptTokens = 0
+        self.completionTokensServed = 0
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.__since = time.monotonic()
+
+    async def __aenter__(self) -> "OpenAIStub":
+        await self.start()
+        return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+        await self.stop()
+
+    def application(self) -> "web.Application":
+        """
+        Returns:
+            web.Application: The aiohttp application serving the endpoints
+        """
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.__chatCompletions)
+        app.router.add_post("/v1/completions", self.__completions)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Starts serving.
+
+        Args:
+            host (str): Host to listen on
+            port (int): Port to listen on (default: 0 for any free port)
+
+        Returns:
+            str: Base URL of the API, to be given to GptPortal with the http access mode
+        """
+        from aiohttp import web
+
+        self.__runner = web.AppRunner(self.application(), access_log=None)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, host, port)
+        await site.start()
+
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}/v1"
+        self.logger.info(f"Serving at {self.url}")
+        return self.url
+
+    async def stop(self):
+        """
+        Stops serving.
+        """
+        if self.__runner:
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    def __countTokens(self, texts: List[str]) -> int:
+        return sum(len((t or "").split()) for t in texts)
+
+    def __drawCompletionTokens(self) -> int:
+        if callable(self.completionTokens):
+            return max(1, int(self.completionTokens(self.random)))
+        return self.completionTokens
+
+    def __words(self, tokens: int) -> List[str]:
+        return [self.random.choice(self.__WORDS) for _ in range(tokens)]
+
+    def __error(self, status: int, message: str, headers: dict = None) -> "web.Response":
+        from aiohttp import web
+
+        self.errors[status] = self.errors.get(status, 0) + 1
+        return web.json_response({"error": {"message": message, "code": status}}, status=status, headers=headers)
+
+    def __injectedError(self) -> "web.Response | None":
+        draw = self.random.random()
+        for status, rate in self.errorRates.items():
+            if draw < rate:
+                if status == 429:
+                    headers = {"retry-after-ms": str(int(self.retryAfter * 1000))} if self.retryAfter else None
+                    return self.__error(status, "Rate limit reached for requests", headers)
+                return self.__error(status, "The server had an error while processing your request")
+            draw -= rate
+        return None
+
+    async def __respond(self, request: "web.Request", chat: bool) -> "web.StreamResponse":
+        self.requests += 1
+        self.inFlight += 1
+        self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        try:
+            body = await request.json()
+            if self.latency:
+                await asyncio.sleep(max(0.0, self.latency(self.random)))
+
+            error = self.__injectedError()
+            if error:
+                return error
+
+            if chat:
+                messages = body.get("messages", [])
+                contents = [m.get("content") for m in messages]
+                prompts = [self.__countTokens(contents) + self.__TOKENS_PER_MESSAGE * len(messages)]
+            else:
+                prompt = body.get("prompt", "")
+                prompts = [self.__countTokens([p]) for p in ([prompt] if isinstance(prompt, str) else prompt)]
+
+            requested = max(prompts) + (body.get("max_tokens") or 0)
+            if requested > self.contextWindow or max(prompts) >= self.contextWindow:
+                return self.__error(
+                    400,
+                    f"This model's maximum context length is {self.contextWindow} tokens. "
+                    f"However, you requested {requested} tokens."
+                )
+            maxTokens = body.get("max_tokens") or self.contextWindow - max(prompts)
+
+            n = body.get("n", 1)
+            choices = []
+            for index in range(len(prompts) * n):
+                tokens = self.__drawCompletionTokens()
+                finishReason = "length" if tokens > maxTokens else "stop"
+                choices.append((index, self.__words(min(tokens, maxTokens)), finishReason))
+
+            usage = {
+                "prompt_tokens": sum(prompts),
+                "completion_tokens": sum(len(words) for _, words, _ in choices),
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            self.promptTokens += usage["prompt_tokens"]
+            self.completionTokensServed += usage["completion_tokens"]
+
+            if body.get("stream"):
+                return await self.__stream(request, body, chat, choices)
+            return self.__whole(body, chat, choices, usage)
+
+        finally:
+            self.inFlight -= 1
+
+    def __whole(self, body: dict, chat: bool, choices: list, usage: dict) -> "web.Response":
+        from aiohttp import web
+
+        return web.json_response({
+            "object": "chat.completion" if chat else "text_completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [
+                {
+                    "index": index,
+                    **(
+                        {"message": {"role": "assistant", "content": " ".join(words)}} if chat
+                        else {"text": " " + " ".join(words)}
+                    ),
+                    "finish_reason": finishReason,
+                }
+                for index, words, finishReason in choices
+            ],
+            "usage": usage,
+        })
+
+    async def __stream(self, request: "web.Request", body: dict, chat: bool, choices: list) -> "web.StreamResponse":
+        from aiohttp import web
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(index: int, delta: dict | str, finishReason: str = None):
+            payload = {"delta": delta} if chat else {"text": delta}
+            choice = {"index": index, **payload, "finish_reason": finishReason}
+            chunk = {"model": body.get("model"), "choices": [choice]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        for index, words, finishReason in choices:
+            if chat:
+                await send(index, {"role": "assistant"})
+            for i, word in enumerate(words):
+                if self.chunkDelay:
+                    await asyncio.sleep(self.chunkDelay)
+                text = word if i == 0 else " " + word
+                await send(index, {"content": text} if chat else text)
+            await send(index, {} if chat else "", finishReason)
+
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def __chatCompletions(self, request: "web.Request") -> "web.StreamResponse":
+        return await self.__respond(request, chat=True)
+
+    async def __completions(self, request: "web.Request") -> "web.StreamResponse":
+        return await self.__respond(request, chat=False)
+
+    def stats(self) -> Dict[str, float | Dict[int, int]]:
+        """
+        Returns:
+            Dict[str, float | Dict[int, int]]: Requests received and their throughput per second, errors by status,
+                tokens served, and requests in flight now and at most
+        """
+        return {
+            "requests": self.requests,
+            "throughput": self.requests / max(time.monotonic() - self.__since, 1e-9),
+            "errors": dict(self.errors),
+            "promptTokens": self.promptTokens,
+            "completionTokens": self.completionTokensServed,
+            "inFlight": self.inFlight,
+            "maxInFlight": self.maxInFlight,
+        }
+
+
+if __name__ == '__main__':
+    from aiohttp import web
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(OpenAIStub(latency=OpenAIStub.lognormal(0.5), chunkDelay=0.02).application(), port=8001)
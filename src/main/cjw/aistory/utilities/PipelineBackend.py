@@ -0,0 +1,149 @@
+from typing import Any, List, Tuple
+
+from cjw.aistory.utilities.LlamaBackend import LlamaBackend
+
+
+class PipelineBackend(LlamaBackend):
+    """
+    Runs a Hugging Face model with a transformers text generation pipeline, batching the prompts given together.
+    """
+
+    class State:
+        """
+        The KV cache of the model over a prompt, and the logits of the token following it.
+        """
+
+        def __init__(self, past: Any, logits: Any, length: int):
+            self.past = past
+            self.logits = logits
+            self.length = length
+
+        def tensors(self) -> List[Any]:
+            past = self.past
+            if past is None:
+                return []
+            if hasattr(past, "layers"):
+                return [t for layer in past.layers for t in [layer.keys, layer.values] if t is not None]
+            if hasattr(past, "key_cache"):
+                return list(past.key_cache) + list(past.value_cache)
+            return [t for layer in past for t in layer]
+
+    def __init__(self, modelName: str, **kwargs):
+        """
+        Loads a model.
+
+        Args:
+            modelName (str): Hugging Face name of the model
+            **kwargs: key for the Hugging Face access token, dtype of the weights (default: "float16"),
+                quantization ("8bit" or "4bit", default: None), and deviceMap (default: "auto")
+        """
+        import torch
+        import transformers
+        from transformers import AutoTokenizer
+
+        key = kwargs.get("key")
+        quantization = kwargs.get("quantization")
+
+        modelArgs = {}
+        if quantization:
+            if quantization not in ["8bit", "4bit"]:
+                raise ValueError(f"Unknown quantization {quantization}")
+            modelArgs["quantization_config"] = transformers.BitsAndBytesConfig(
+                load_in_8bit=quantization == "8bit", load_in_4bit=quantization == "4bit"
+            )
+
+        self.tokenizer = AutoTokenizer.from_pretrained(modelName, token=key)
+        self.pipeline = transformers.pipeline(
+            task="text-generation",
+            model=modelName,
+            torch_dtype=getattr(torch, kwargs.get("dtype", "float16")),
+            device_map=kwargs.get("deviceMap", "auto"),
+            token=key,
+            model_kwargs=modelArgs,
+        )
+
+        # Prompts of a batch are padded on the left, so their completions all start at the end of the input
+        if self.pipeline.tokenizer.pad_token_id is None:
+            self.pipeline.tokenizer.pad_token_id = self.tokenizer.eos_token_id
+        self.pipeline.tokenizer.padding_side = "left"
+
+    def generate(self, prompts: List[str], maxTokens: int = None, temperature: float = None) -> List[str]:
+        options = {}
+        if maxTokens:
+            options["max_new_tokens"] = maxTokens
+        if temperature is not None:
+            options.update({"do_sample": True, "temperature": temperature} if temperature > 0 else {"do_sample": False})
+
+        sequences = self.pipeline(
+            prompts,
+            batch_size=len(prompts),
+            eos_token_id=self.tokenizer.eos_token_id,
+            return_full_text=False,
+            **options,
+        )
+        return [s[0]["generated_text"] for s in sequences]
+
+    def tokenize(self, text: str) -> List[int]:
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def __forward(self, state: "PipelineBackend.State", tokens: List[int]) -> "PipelineBackend.State":
+        import torch
+
+        model = self.pipeline.model
+        with torch.no_grad():
+            output = model(
+                input_ids=torch.tensor([tokens], device=model.device),
+                past_key_values=state.past,
+                use_cache=True,
+            )
+        return self.State(output.past_key_values, output.logits[0, -1], state.length + len(tokens))
+
+    def prefill(self, state: "PipelineBackend.State | None", tokens: List[int]) -> "PipelineBackend.State":
+        if not tokens:
+            return state
+        # The model extends the KV cache of the state given in place
+        return self.__forward(state or self.State(None, None, 0), tokens)
+
+    def decode(
+            self,
+            state: "PipelineBackend.State",
+            maxTokens: int = None,
+            temperature: float = None,
+    ) -> Tuple[str, str]:
+        import torch
+
+        if temperature is None:
+            temperature = self.pipeline.model.generation_config.temperature or 0
+        maxTokens = maxTokens or self.pipeline.model.config.max_position_embeddings - state.length
+
+        current = state
+        generated = []
+        finishReason = "length"
+        try:
+            for _ in range(maxTokens):
+                if temperature > 0:
+                    probabilities = torch.softmax(current.logits.float() / temperature, dim=-1)
+                    token = int(torch.multinomial(probabilities, 1))
+                else:
+                    token = int(torch.argmax(current.logits))
+                if token == self.tokenizer.eos_token_id:
+                    finishReason = "stop"
+                    break
+                generated.append(token)
+                current = self.__forward(current, [token])
+        finally:
+            # Generating extended the KV cache in place, so it is cut back to the prompt for the state to be reused.
+            # Legacy tuple caches are not changed in place.
+            if hasattr(state.past, "crop"):
+                state.past.crop(state.length)
+
+        return self.tokenizer.decode(generated, skip_special_tokens=True).strip(), finishReason
+
+    def stateSize(self, state: "PipelineBackend.State") -> int:
+        return sum(t.numel() * t.element_size() for t in state.tensors())
+
+    def countTokens(self, text: str) -> int:
+        return len(self.tokenize(text))
+
+    def memoryFootprint(self) -> int:
+        return self.pipeline.model.get_memory_footprint()
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+
+class PrefixCache:
+    """
+    Keeps the attention (KV) states a local model computed for recently seen prompt prefixes, in least recently used
+    order under a memory cap.
+
+    A chat is formatted into one segment per message, and each prefix of the segments is identified by a rolling hash,
+    chained from the hash of the prefix before it.  So a new turn of a story finds the state of the history it extends,
+    and only the new messages need to be prefilled.
+
+    Attributes:
+        hits (int): Lookups finding a prefix
+        misses (int): Lookups finding nothing
+        evictions (int): States evicted to stay under the capacity
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    DEFAULT_CAPACITY = 2 ** 30  # Bytes
+
+    @classmethod
+    def keysOf(cls, segments: List[str]) -> List[bytes]:
+        """
+        Args:
+            segments (List[str]): Segments of a formatted prompt, e.g. one per message
+
+        Returns:
+            List[bytes]: Rolling hash of each prefix, i.e. of the segments up to and including each of them
+        """
+        keys = []
+        key = b""
+        for segment in segments:
+            key = hashlib.blake2b(key + segment.encode("utf-8"), digest_size=16).digest()
+            keys.append(key)
+        return keys
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        """
+        Initializes a cache.
+
+        Args:
+            capacity (int): Bytes the states cached may take together
+        """
+        self.capacity = capacity
+
+        self.__states: OrderedDict[bytes, Tuple[Any, int]] = OrderedDict()  # Prefix key: state and its size
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def longest(self, keys: List[bytes]) -> Tuple[int, Any]:
+        """
+        Looks up the longest prefix cached.
+
+        Args:
+            keys (List[bytes]): Keys of the prefixes, as given by keysOf()
+
+        Returns:
+            Tuple[int, Any]: Number of segments of the prefix found and its state, or 0 and None
+        """
+        for i in range(len(keys) - 1, -1, -1):
+            entry = self.__states.get(keys[i])
+            if entry is not None:
+                self.__states.move_to_end(keys[i])
+                self.hits += 1
+                return i + 1, entry[0]
+
+        self.misses += 1
+        return 0, None
+
+    def put(self, key: bytes, state: Any, size: int):
+        """
+        Caches the state of a prefix, evicting the least recently used ones to make room.
+
+        Args:
+            key (bytes): Key of the prefix
+            state (Any): The state
+            size (int): Bytes the state takes
+        """
+        if size > self.capacity:
+            self.logger.debug(f"A state of {size} bytes does not fit the cache of {self.capacity}")
+            return
+
+        old = self.__states.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+
+        while self.__states and self.size + size > self.capacity:
+            _, (_, evicted) = self.__states.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+        self.__states[key] = (state, size)
+        self.size += size
+
+    def take(self, key: bytes) -> Any:
+        """
+        Takes the state of a prefix out of the cache, e.g. to extend it in place.
+
+        Args:
+            key (bytes): Key of the prefix
+
+        Returns:
+            Any: The state, or None if it is not cached
+        """
+        entry = self.__states.pop(key, None)
+        if entry is None:
+            return None
+        self.size -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        """
+        Drops all the states.
+        """
+        self.__states.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.__states)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: States cached and their bytes, and the lookups hitting and missing, and evictions
+        """
+        return {
+            "states": len(self.__states),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
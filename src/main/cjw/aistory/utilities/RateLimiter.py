@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Tuple
+
+
+class RateLimiter:
+    """
+    Client-side rate limiter of requests per minute and tokens per minute, shared by all callers of an API key and model.
+
+    Each limit is a token bucket holding up to a minute's worth of capacity and refilling continuously.
+    A caller is charged as soon as it asks and waits asynchronously until the bucket is out of debt,
+    so callers are served in the order they arrive and no retries are burned on 429 errors.
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    DEFAULT_LIMITS = {  # Model: (requests per minute, tokens per minute)
+        "gpt-4": (200, 40000),
+        "gpt-4-32k": (200, 80000),
+        "gpt-3.5-turbo": (3500, 90000),
+        "gpt-3.5-turbo-16k": (3500, 180000),
+        "text-davinci-003": (3000, 250000),
+    }
+    DEFAULT_MODEL_LIMITS = (200, 40000)  # Limits of models not listed above
+
+    __limits: Dict[str, Tuple[float, float]] = dict(DEFAULT_LIMITS)
+    __instances: Dict[Tuple[str, str], "RateLimiter"] = dict()
+
+    class TokenBucket:
+        """
+        A token bucket that may go into debt.  A charge is granted once the debt is paid off by the refill.
+        """
+
+        def __init__(self, perMinute: float):
+            """
+            Initializes a full bucket.
+
+            Args:
+                perMinute (float): Capacity of the bucket, refilled evenly over a minute
+            """
+            self.capacity = perMinute
+            self.rate = perMinute / 60
+            self.level = perMinute
+            self.lastRefill = time.monotonic()
+
+        def refill(self):
+            """
+            Adds the capacity accumulated since the last refill.
+            """
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.lastRefill) * self.rate)
+            self.lastRefill = now
+
+        def charge(self, amount: float) -> float:
+            """
+            Takes the amount out of the bucket.
+
+            Args:
+                amount (float): The amount to take
+
+            Returns:
+                float: Seconds to wait before the charge is covered
+            """
+            self.refill()
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+        def refund(self, amount: float):
+            """
+            Puts the amount back to the bucket.  A negative amount charges more without waiting.
+
+            Args:
+                amount (float): The amount to put back
+            """
+            self.refill()
+            self.level = min(self.capacity, self.level + amount)
+
+        def available(self) -> float:
+            """
+            Returns:
+                float: Fraction of the capacity currently available (negative when in debt)
+            """
+            self.refill()
+            return self.level / self.capacity
+
+    class Reservation:
+        """
+        Capacity granted to a request, to be reconciled with the actual usage after the response.
+
+        Attributes:
+            attempts (int): Times the request was sent, each charged a request
+        """
+
+        def __init__(self, limiter: "RateLimiter", tokens: int):
+            self.limiter = limiter
+            self.tokens = tokens
+            self.attempts = 0
+
+        def attempt(self):
+            """
+            Records that the request is being sent.  The first attempt was charged when reserving, and each retry is
+            charged another request, without waiting since it is already on its way.
+            """
+            self.attempts += 1
+            if self.attempts > 1:
+                self.limiter.requests.refund(-1)
+
+        def reconcile(self, usedTokens: int | None):
+            """
+            Corrects the token bucket with the tokens the request actually used.
+
+            Args:
+                usedTokens (int | None): Total tokens reported in the usage of the response (None if unknown)
+            """
+            if usedTokens is not None:
+                self.limiter.tokens.refund(self.tokens - usedTokens)
+                self.tokens = usedTokens
+
+        def cancel(self):
+            """
+            Gives back the whole reservation when the request was not sent.  Once sent, even if it failed, the request
+            counts against the limits of the server, so it is only reconciled.
+            """
+            if self.attempts:
+                return
+            self.limiter.requests.refund(1)
+            self.limiter.tokens.refund(self.tokens)
+            self.tokens = 0
+
+    @classmethod
+    def configure(cls, model: str, requestsPerMinute: float, tokensPerMinute: float):
+        """
+        Sets the limits of a model, or of the models named after it, e.g. gpt-4 for gpt-4-0613.  Limiters already
+        created for those models are reset to the new limits.
+
+        Args:
+            model (str): Name of the model
+            requestsPerMinute (float): Requests allowed per minute
+            tokensPerMinute (float): Tokens (prompt and completion) allowed per minute
+        """
+        cls.__limits[model] = (requestsPerMinute, tokensPerMinute)
+        for (_, limitedModel), limiter in cls.__instances.items():
+            if cls.__prefixOf(limitedModel) == model:
+                limiter.requests = cls.TokenBucket(requestsPerMinute)
+                limiter.tokens = cls.TokenBucket(tokensPerMinute)
+
+    @classmethod
+    def __prefixOf(cls, model: str) -> str | None:
+        # The longest matching prefix wins, e.g. gpt-4-32k over gpt-4
+        prefixes = [prefix for prefix in cls.__limits if model and model.startswith(prefix)]
+        return max(prefixes, key=len) if prefixes else None
+
+    @classmethod
+    def limitsOf(cls, model: str) -> Tuple[float, float]:
+        """
+        Args:
+            model (str): Name of the model, matched by its longest configured prefix, e.g. gpt-4 for gpt-4-0613
+
+        Returns:
+            Tuple[float, float]: Requests per minute and tokens per minute allowed for the model
+        """
+        prefix = cls.__prefixOf(model)
+        return cls.__limits[prefix] if prefix else cls.DEFAULT_MODEL_LIMITS
+
+    @classmethod
+    def of(cls, key: str, model: str) -> "RateLimiter":
+        """
+        Returns the limiter shared by all callers of the API key and model.
+
+        Args:
+            key (str): API key
+            model (str): Name of the model
+
+        Returns:
+            RateLimiter: The limiter
+        """
+        if (key, model) not in cls.__instances:
+            cls.__instances[(key, model)] = RateLimiter(*cls.limitsOf(model))
+        return cls.__instances[(key, model)]
+
+    def __init__(self, requestsPerMinute: float, tokensPerMinute: float):
+        """
+        Initializes a limiter.  Use of() to get the limiter shared per API key and model.
+
+        Args:
+            requestsPerMinute (float): Requests allowed per minute
+            tokensPerMinute (float): Tokens allowed per minute
+        """
+        self.requests = self.TokenBucket(requestsPerMinute)
+        self.tokens = self.TokenBucket(tokensPerMinute)
+
+    async def acquire(self, tokens: int) -> "RateLimiter.Reservation":
+        """
+        Waits asynchronously until a request of the estimated tokens fits in the limits.
+
+        Args:
+            tokens (int): Estimated tokens of the request (prompt plus maximum completion)
+
+        Returns:
+            RateLimiter.Reservation: The granted reservation
+        """
+        tokens = min(tokens, self.tokens.capacity)  # A request larger than the capacity shall not wait forever
+        reservation = self.Reservation(self, tokens)
+        delay = max(self.requests.charge(1), self.tokens.charge(tokens))
+
+        if delay > 0:
+            self.logger.info(f"Waiting {delay:.2f}s for rate limit capacity of {tokens} tokens")
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                reservation.cancel()
+                raise
+
+        return reservation
+
+    def headroom(self) -> float:
+        """
+        Returns:
+            float: Fraction of the tighter of the two limits currently available (negative when in debt)
+        """
+        return min(self.requests.available(), self.tokens.available())
@@ -0,0 +1,132 @@
+import logging
+import time
+from collections import deque
+from enum import Enum
+from typing import Any, Deque, Dict, Tuple
+
+
+class RequestScheduler:
+    """
+    Queue of requests waiting to be sent, served by priority class with weighted-fair dequeuing.
+
+    Each class gets a share of the turns proportional to its weight (stride scheduling), so interactive requests
+    jump ahead of background work without starving it.  A request waiting longer than the aging limit is served
+    before any request that waited less, whatever its class.
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    class Priority(Enum):
+        INTERACTIVE = 0  # A player is waiting for the response
+        CONDENSE = 1  # Summarizing stories to keep them within the context window
+        BATCH = 2  # Bulk work nobody is waiting for, e.g. exploring story boards
+
+    DEFAULT_WEIGHTS = {
+        Priority.INTERACTIVE: 16,
+        Priority.CONDENSE: 4,
+        Priority.BATCH: 1,
+    }
+    DEFAULT_AGING = 30  # Seconds after which a waiting request is served first
+
+    def __init__(self, weights: Dict["RequestScheduler.Priority", float] = None, aging: float = DEFAULT_AGING):
+        """
+        Initializes a scheduler.
+
+        Args:
+            weights (Dict[RequestScheduler.Priority, float]): Share of the turns of each class
+                (default: DEFAULT_WEIGHTS)
+            aging (float): Seconds after which a waiting request is served before fresher ones (default: 30)
+        """
+        self.weights = dict(self.DEFAULT_WEIGHTS)
+        self.weights.update(weights or {})
+        self.aging = aging
+
+        self.__queues: Dict[RequestScheduler.Priority, Deque[Tuple[Any, float]]] = {p: deque() for p in self.Priority}
+        self.__passes: Dict[RequestScheduler.Priority, float] = {p: 0.0 for p in self.Priority}
+        self.__virtualTime = 0.0
+
+        self.served: Dict[RequestScheduler.Priority, int] = {p: 0 for p in self.Priority}
+        self.waited: Dict[RequestScheduler.Priority, float] = {p: 0.0 for p in self.Priority}
+        self.aged = 0
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self.__queues.values())
+
+    def push(self, item: Any, priority: "RequestScheduler.Priority" = Priority.INTERACTIVE):
+        """
+        Queues a request.
+
+        Args:
+            item (Any): The request, e.g. the future to resolve when it may be sent
+            priority (RequestScheduler.Priority): Priority class of the request
+        """
+        queue = self.__queues[priority]
+        if not queue:
+            # A class coming back from idle does not get credit for the turns it did not need
+            self.__passes[priority] = max(self.__passes[priority], self.__virtualTime)
+        queue.append((item, time.monotonic()))
+
+    def pop(self) -> Any:
+        """
+        Dequeues the next request to serve.
+
+        Returns:
+            Any: The request, or None if none is waiting
+        """
+        waiting = [p for p in self.Priority if self.__queues[p]]
+        if not waiting:
+            return None
+
+        now = time.monotonic()
+        oldest = min(waiting, key=lambda p: self.__queues[p][0][1])
+        if now - self.__queues[oldest][0][1] >= self.aging:
+            priority = oldest
+            self.aged += 1
+        else:
+            priority = min(waiting, key=lambda p: (self.__passes[p], p.value))
+
+        item, queued = self.__queues[priority].popleft()
+        self.__virtualTime = self.__passes[priority]
+        self.__passes[priority] += 1 / self.weights[priority]
+
+        self.served[priority] += 1
+        self.waited[priority] += now - queued
+        return item
+
+    def remove(self, item: Any) -> bool:
+        """
+        Removes a request that no longer waits, e.g. because it was cancelled.
+
+        Args:
+            item (Any): The request
+
+        Returns:
+            bool: True if the request was in the queue
+        """
+        for queue in self.__queues.values():
+            for entry in queue:
+                if entry[0] == item:
+                    queue.remove(entry)
+                    return True
+        return False
+
+    def depths(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: Number of requests waiting in each class
+        """
+        return {p.name: len(q) for p, q in self.__queues.items()}
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns:
+            Dict[str, Dict[str, float]]: Per class, requests waiting and served, and mean wait in seconds
+        """
+        return {
+            p.name: {
+                "waiting": len(self.__queues[p]),
+                "served": self.served[p],
+                "meanWait": self.waited[p] / self.served[p] if self.served[p] else 0.0,
+            }
+            for p in self.Priority
+        }
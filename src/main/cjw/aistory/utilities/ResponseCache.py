@@ -0,0 +1,237 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of API responses, with a bounded in-memory LRU in front of an optional SQLite file.
+
+    Responses are keyed by a canonical hash of the API function and the request payload.  Only deterministic
+    requests (temperature 0) are cached unless non-deterministic ones are explicitly allowed.
+
+    Attributes:
+        hits (int): Number of lookups found in the cache
+        memoryHits (int): Number of hits served by the in-memory tier
+        diskHits (int): Number of hits served by the SQLite tier
+        misses (int): Number of lookups not found in the cache
+        bypasses (int): Number of requests not looked up for being non-deterministic
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    DEFAULT_MEMORY_ENTRIES = 1024
+    DEFAULT_DISK_ENTRIES = 100000
+
+    def __init__(
+            self,
+            file: str = None,
+            memoryEntries: int = DEFAULT_MEMORY_ENTRIES,
+            diskEntries: int = DEFAULT_DISK_ENTRIES,
+            ttl: float = None,
+            allowNonDeterministic: bool = False,
+    ):
+        """
+        Initializes a response cache.
+
+        Args:
+            file (str): Path of the SQLite file for the persistent tier (default: None for in-memory only)
+            memoryEntries (int): Maximum number of responses kept in memory
+            diskEntries (int): Maximum number of responses kept in the SQLite file
+            ttl (float): Seconds a response stays valid (default: None for never expiring)
+            allowNonDeterministic (bool): Whether to cache requests with temperature above 0 (default: False)
+        """
+        self.file = file
+        self.memoryEntries = memoryEntries
+        self.diskEntries = diskEntries
+        self.ttl = ttl
+        self.allowNonDeterministic = allowNonDeterministic
+
+        self.__memory: OrderedDict[str, (float, dict)] = OrderedDict()
+
+        self.__db = None
+        if file:
+            directory = os.path.dirname(file)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+            self.__db = sqlite3.connect(file, check_same_thread=False)
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.__db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self.__db.commit()
+
+        self.hits = 0
+        self.memoryHits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    @classmethod
+    def keyOf(cls, function: str, request: dict) -> str:
+        """
+        Computes the canonical hash of a request.
+
+        Args:
+            function (str): API function of the request
+            request (dict): API request payload
+
+        Returns:
+            str: The hash
+        """
+        canonical = json.dumps([function, request], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def isDeterministic(cls, request: dict) -> bool:
+        """
+        Checks whether a request always yields the same response.  OpenAI samples with temperature 1 by default.
+
+        Args:
+            request (dict): API request payload
+
+        Returns:
+            bool: True if the request has temperature 0
+        """
+        return request.get("temperature", 1) == 0
+
+    def cacheable(self, request: dict) -> bool:
+        """
+        Checks whether the response of a request may be cached.
+
+        Args:
+            request (dict): API request payload
+
+        Returns:
+            bool: True if the request may be looked up and stored
+        """
+        return not request.get("stream") and (self.allowNonDeterministic or self.isDeterministic(request))
+
+    def __expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def __remember(self, key: str, created: float, response: dict):
+        self.__memory[key] = (created, response)
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.memoryEntries:
+            self.__memory.popitem(last=False)
+
+    def get(self, function: str, request: dict) -> dict | None:
+        """
+        Looks up the response of a request.
+
+        Args:
+            function (str): API function of the request
+            request (dict): API request payload
+
+        Returns:
+            dict | None: The cached response, or None if not cached or not cacheable
+        """
+        if not self.cacheable(request):
+            self.bypasses += 1
+            return None
+
+        key = self.keyOf(function, request)
+
+        if key in self.__memory:
+            created, response = self.__memory[key]
+            if not self.__expired(created):
+                self.__memory.move_to_end(key)
+                self.hits += 1
+                self.memoryHits += 1
+                return response
+            del self.__memory[key]
+
+        if self.__db:
+            row = self.__db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                response, created = json.loads(row[0]), row[1]
+                if not self.__expired(created):
+                    self.__db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                    self.__db.commit()
+                    self.__remember(key, created, response)
+                    self.hits += 1
+                    self.diskHits += 1
+                    return response
+                self.__db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.__db.commit()
+
+        self.misses += 1
+        return None
+
+    def put(self, function: str, request: dict, response: dict):
+        """
+        Stores the response of a request if it is cacheable.
+
+        Args:
+            function (str): API function of the request
+            request (dict): API request payload
+            response (dict): API response
+        """
+        if not self.cacheable(request):
+            return
+
+        key = self.keyOf(function, request)
+        now = time.time()
+        serialized = json.dumps(response)
+        self.__remember(key, now, json.loads(serialized))
+
+        if self.__db:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, serialized, now, now)
+            )
+            self.__evict()
+            self.__db.commit()
+
+    def __evict(self):
+        """
+        Removes expired responses, then the least recently used ones above the size limit, from the SQLite file.
+        """
+        if self.ttl is not None:
+            self.__db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+
+        count = self.__db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.diskEntries:
+            self.__db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                (count - self.diskEntries,)
+            )
+
+    def clear(self):
+        """
+        Removes all responses from both tiers.
+        """
+        self.__memory.clear()
+        if self.__db:
+            self.__db.execute("DELETE FROM responses")
+            self.__db.commit()
+
+    def close(self):
+        """
+        Closes the SQLite file.
+        """
+        if self.__db:
+            self.__db.close()
+            self.__db = None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: Hit, miss and bypass counters and the number of responses in memory
+        """
+        return {
+            "hits": self.hits,
+            "memoryHits": self.memoryHits,
+            "diskHits": self.diskHits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "memoryEntries": len(self.__memory),
+        }
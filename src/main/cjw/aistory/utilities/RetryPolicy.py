@@ -0,0 +1,241 @@
+import asyncio
+import email.utils
+import logging
+import random
+import re
+import copy
+import time
+from typing import Mapping
+
+from cjw.aistory.utilities.Deadline import Deadline
+
+
+class RetryPolicy:
+    """
+    Policy of retrying failed API calls with exponential backoff and full jitter.
+
+    Waiting is done with asyncio.sleep(), so a call backing off never blocks other coroutines on the event loop.
+    Delays suggested by the server through Retry-After or x-ratelimit-reset-* headers are honored.
+
+    Attributes:
+        maxRetries (int): Maximum number of retries after the first attempt
+        baseDelay (float): Backoff ceiling in seconds for the first retry
+        maxDelay (float): Upper bound in seconds of the backoff ceiling
+        multiplier (float): Growth factor of the backoff ceiling per retry
+        jitter (bool): Whether to draw the delay uniformly between 0 and the ceiling (full jitter)
+        rateLimitDelay (float): Minimum delay in seconds after being rate limited without a hint from the server
+        deadline (float): Seconds a call, including all its retries, may take (None for no limit)
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    DEFAULT_MAX_RETRIES = 1
+    DEFAULT_BASE_DELAY = 1
+    DEFAULT_MAX_DELAY = 60
+    DEFAULT_MULTIPLIER = 2
+    DEFAULT_RATE_LIMIT_DELAY = 5
+
+    __DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+    class Schedule:
+        """
+        Retry state of a single call made under a RetryPolicy.
+        """
+
+        def __init__(self, policy: "RetryPolicy"):
+            """
+            Initializes the schedule and starts the clock for the deadline.
+
+            Args:
+                policy (RetryPolicy): The policy this schedule follows
+            """
+            self.policy = policy
+            self.retries = 0
+            self.startTime = time.monotonic()
+
+        def remaining(self) -> float | None:
+            """
+            Returns the time left before the deadline of the call.
+
+            Returns:
+                float | None: Seconds left, or None if the call has no deadline
+            """
+            remaining = None
+            if self.policy.deadline is not None:
+                remaining = max(0.0, self.policy.deadline - (time.monotonic() - self.startTime))
+            if self.policy.until is not None and self.policy.until.remaining() is not None:
+                untilRemaining = self.policy.until.remaining()
+                remaining = untilRemaining if remaining is None else min(remaining, untilRemaining)
+            return remaining
+
+        async def backoff(self, headers: Mapping[str, str] = None, rateLimited: bool = False) -> bool:
+            """
+            Waits, without blocking the event loop, before the next retry.
+
+            Args:
+                headers (Mapping[str, str]): Response headers of the failed attempt, if any
+                rateLimited (bool): Whether the failed attempt was rejected for exceeding the rate limit
+
+            Returns:
+                bool: True if a retry may follow, or False if retries are exhausted or the deadline would be passed
+            """
+            self.retries += 1
+            if self.retries > self.policy.maxRetries:
+                return False
+
+            delay = self.policy.delay(self.retries, headers, rateLimited)
+
+            remaining = self.remaining()
+            if remaining is not None and delay >= remaining:
+                self.policy.logger.warning(f"Not retrying: waiting {delay:.2f}s would pass the deadline")
+                return False
+
+            self.policy.logger.info(f"Retry {self.retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            return True
+
+    def __init__(
+            self,
+            maxRetries: int = DEFAULT_MAX_RETRIES,
+            baseDelay: float = DEFAULT_BASE_DELAY,
+            maxDelay: float = DEFAULT_MAX_DELAY,
+            multiplier: float = DEFAULT_MULTIPLIER,
+            jitter: bool = True,
+            rateLimitDelay: float = DEFAULT_RATE_LIMIT_DELAY,
+            deadline: float = None,
+    ):
+        """
+        Initializes a retry policy.
+
+        Args:
+            maxRetries (int): Maximum number of retries after the first attempt (default: 1)
+            baseDelay (float): Backoff ceiling in seconds for the first retry (default: 1)
+            maxDelay (float): Upper bound in seconds of the backoff ceiling (default: 60)
+            multiplier (float): Growth factor of the backoff ceiling per retry (default: 2)
+            jitter (bool): Whether to use full jitter (default: True)
+            rateLimitDelay (float): Minimum delay after being rate limited without a server hint (default: 5)
+            deadline (float): Seconds a call, including all its retries, may take (default: None for no limit)
+        """
+        self.maxRetries = maxRetries
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.rateLimitDelay = rateLimitDelay
+        self.deadline = deadline
+        self.until: Deadline | None = None  # Deadline of the whole call chain, see withDeadline()
+
+    def withDeadline(self, deadline: Deadline | None) -> "RetryPolicy":
+        """
+        Binds the policy to the deadline of the call chain, on top of the deadline of each call.
+
+        Args:
+            deadline (Deadline | None): Deadline of the call chain
+
+        Returns:
+            RetryPolicy: A copy of the policy bound to the deadline, or this policy if the deadline is None
+        """
+        if deadline is None:
+            return self
+        bound = copy.copy(self)
+        bound.until = deadline
+        return bound
+
+    def start(self) -> "RetryPolicy.Schedule":
+        """
+        Starts the retry schedule of a new call.
+
+        Returns:
+            RetryPolicy.Schedule: The schedule of the call
+        """
+        return self.Schedule(self)
+
+    def delay(self, retry: int, headers: Mapping[str, str] = None, rateLimited: bool = False) -> float:
+        """
+        Computes how long to wait before a retry.
+
+        Args:
+            retry (int): The retry about to be made, starting from 1
+            headers (Mapping[str, str]): Response headers of the failed attempt, if any
+            rateLimited (bool): Whether the failed attempt was rejected for exceeding the rate limit
+
+        Returns:
+            float: Seconds to wait
+        """
+        ceiling = min(self.maxDelay, self.baseDelay * self.multiplier ** (retry - 1))
+        delay = random.uniform(0, ceiling) if self.jitter else ceiling
+
+        suggested = self.retryAfter(headers) if headers else None
+        if suggested is not None:
+            # The server knows better when capacity comes back.  Never retry earlier than that.
+            delay = max(delay, suggested)
+        elif rateLimited:
+            delay = max(delay, self.rateLimitDelay)
+
+        return delay
+
+    @classmethod
+    def retryAfter(cls, headers: Mapping[str, str]) -> float | None:
+        """
+        Gets the delay suggested by the server from the response headers.
+
+        Retry-After may be in seconds or an HTTP date.  For x-ratelimit-reset-requests and x-ratelimit-reset-tokens
+        (such as '1s', '6m0s' or '20ms'), only those of the exhausted limits are considered if known.
+
+        Args:
+            headers (Mapping[str, str]): Response headers
+
+        Returns:
+            float | None: Seconds to wait, or None if the server did not suggest
+        """
+        headers = {k.lower(): v for k, v in headers.items()}
+
+        if "retry-after-ms" in headers:
+            try:
+                return float(headers["retry-after-ms"]) / 1000
+            except ValueError:
+                pass
+
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                pass
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                cls.logger.warning(f"Unrecognized Retry-After header {value}")
+
+        resets = []
+        for limit in ["requests", "tokens"]:
+            reset = headers.get(f"x-ratelimit-reset-{limit}")
+            remaining = headers.get(f"x-ratelimit-remaining-{limit}")
+            if reset is not None and remaining in [None, "0"]:
+                seconds = cls.parseDuration(reset)
+                if seconds is not None:
+                    resets.append(seconds)
+
+        return max(resets) if resets else None
+
+    @classmethod
+    def parseDuration(cls, duration: str) -> float | None:
+        """
+        Parses a duration such as '1s', '6m0s', '1h2m3.5s' or '120ms'.
+
+        Args:
+            duration (str): The duration
+
+        Returns:
+            float | None: The duration in seconds, or None if it cannot be parsed
+        """
+        try:
+            return float(duration)
+        except ValueError:
+            pass
+
+        parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", duration.strip())
+        if not parts or "".join(n + u for n, u in parts) != duration.strip():
+            return None
+
+        return sum(float(n) * cls.__DURATION_UNITS[u] for n, u in parts)
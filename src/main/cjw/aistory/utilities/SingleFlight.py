@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls, so only the first one does the work and the others await its result.
+
+    Cancelling a waiter does not cancel the shared call while other waiters remain.  The shared call is cancelled
+    only when every waiter has given up.
+
+    Attributes:
+        calls (int): Number of calls that did the work
+        coalesced (int): Number of calls that awaited the result of another identical call
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    class Flight:
+        """
+        A shared call in progress and the number of callers awaiting it.
+        """
+
+        def __init__(self, task: asyncio.Future):
+            self.task = task
+            self.waiters = 0
+
+    def __init__(self):
+        self.__flights: Dict[str, SingleFlight.Flight] = dict()
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Makes the call, or awaits the identical call already in flight.
+
+        Args:
+            key (str): Key identifying identical calls
+            call (Callable[[], Awaitable[Any]]): Function creating the awaitable of the call
+
+        Returns:
+            Any: Result of the call
+        """
+        flight = self.__flights.get(key)
+
+        if flight is None:
+            flight = self.Flight(asyncio.ensure_future(call()))
+            self.__flights[key] = flight
+            flight.task.add_done_callback(lambda _: self.__land(key, flight))
+            self.calls += 1
+        else:
+            self.logger.debug(f"Coalescing with the call {key} in flight")
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every waiter has been cancelled.  No one needs the result anymore.
+                flight.task.cancel()
+
+    def __land(self, key: str, flight: "SingleFlight.Flight"):
+        if self.__flights.get(key) is flight:
+            del self.__flights[key]
+
+    def inFlight(self) -> int:
+        """
+        Returns:
+            int: Number of shared calls in progress
+        """
+        return len(self.__flights)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: Numbers of calls made, calls coalesced, and shared calls in progress
+        """
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "inFlight": self.inFlight(),
+        }
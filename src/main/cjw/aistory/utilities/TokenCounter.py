@@ -0,0 +1,202 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+
+class TokenCounter:
+    """
+    Counts the tokens of texts with the encoding of the target model.
+
+    Counts are memoized in a bounded LRU keyed by the hash of the content, so counting the same story messages over
+    and over does not tokenize them again.  Uncached texts of a batch are tokenized together in one tokenizer call.
+
+    Encodings are pluggable through register().  'gpt2' uses the GPT-2 tokenizer of transformers.  The tiktoken
+    encodings (e.g. 'cl100k_base' of GPT-3.5 and -4) are used if tiktoken is installed and can load them, or fall back
+    to 'gpt2'.
+
+    Attributes:
+        encoding (str): Name of the encoding
+        hits (int): Number of counts served from the memo
+        misses (int): Number of texts tokenized
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    DEFAULT_ENCODING = "gpt2"
+    DEFAULT_CACHE_ENTRIES = 65536
+
+    MODEL_ENCODINGS = {  # Model name prefix: encoding
+        "gpt-4": "cl100k_base",
+        "gpt-3.5-turbo": "cl100k_base",
+        "text-embedding-ada-002": "cl100k_base",
+        "text-davinci-002": "p50k_base",
+        "text-davinci-003": "p50k_base",
+        "code-davinci": "p50k_base",
+    }
+
+    # Encoding: factory of the function returning the token counts of a batch of texts
+    __encoders: Dict[str, Callable[[], Callable[[List[str]], List[int]]]] = dict()
+    __instances: Dict[str, "TokenCounter"] = dict()
+
+    @classmethod
+    def register(cls, encoding: str, factory: Callable[[], Callable[[List[str]], List[int]]]):
+        """
+        Registers an encoding.  The counter already created for the encoding starts over with the new one.
+
+        Args:
+            encoding (str): Name of the encoding
+            factory (Callable[[], Callable[[List[str]], List[int]]]): Function creating the batch counting function.
+                It is called once, on the first count.
+        """
+        cls.__encoders[encoding] = factory
+
+        counter = cls.__instances.get(encoding)
+        if counter:
+            counter.__encode = None
+            counter.__counts.clear()
+            counter.hits = counter.misses = 0
+
+    @classmethod
+    def of(cls, encoding: str = DEFAULT_ENCODING) -> "TokenCounter":
+        """
+        Returns the counter of an encoding, shared process-wide.
+
+        Args:
+            encoding (str): Name of the encoding (default: gpt2)
+
+        Returns:
+            TokenCounter: The counter
+        """
+        if encoding not in cls.__instances:
+            cls.__instances[encoding] = TokenCounter(encoding)
+        return cls.__instances[encoding]
+
+    @classmethod
+    def forModel(cls, model: str = None) -> "TokenCounter":
+        """
+        Returns the counter matching the tokenization of a model.
+
+        Args:
+            model (str): Name of the model (default: None for the default encoding)
+
+        Returns:
+            TokenCounter: The counter
+        """
+        for prefix, encoding in cls.MODEL_ENCODINGS.items():
+            if model and model.startswith(prefix):
+                return cls.of(encoding)
+        return cls.of(cls.DEFAULT_ENCODING)
+
+    def __init__(self, encoding: str, cacheEntries: int = DEFAULT_CACHE_ENTRIES):
+        """
+        Initializes a counter.  Use of() or forModel() to get the shared counters.
+
+        Args:
+            encoding (str): Name of the encoding
+            cacheEntries (int): Maximum number of counts memoized
+        """
+        self.encoding = encoding
+        self.cacheEntries = cacheEntries
+        self.__encode: Callable[[List[str]], List[int]] | None = None
+        self.__counts: OrderedDict[bytes, int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __encoder(self) -> Callable[[List[str]], List[int]]:
+        if not self.__encode:
+            factory = self.__encoders.get(self.encoding)
+            if factory:
+                self.__encode = factory()
+            else:
+                self.__encode = self.__tiktoken(self.encoding) or self.__gpt2()
+        return self.__encode
+
+    @classmethod
+    def __gpt2(cls) -> Callable[[List[str]], List[int]]:
+        from transformers import GPT2TokenizerFast
+
+        tokenizer = GPT2TokenizerFast.from_pretrained("gpt2")
+        return lambda texts: [len(ids) for ids in tokenizer(texts)["input_ids"]]
+
+    @classmethod
+    def __tiktoken(cls, encoding: str) -> Callable[[List[str]], List[int]] | None:
+        if encoding == "gpt2":
+            return None
+        try:
+            import tiktoken
+        except ImportError:
+            cls.logger.warning(f"tiktoken is not installed.  Counting {encoding} tokens with GPT-2 tokenizer instead.")
+            return None
+
+        try:
+            tokenizer = tiktoken.get_encoding(encoding)
+        except Exception as e:  # The encoding is downloaded on first use, which fails offline
+            cls.logger.warning(f"Cannot load tiktoken {encoding}: {e}.  Counting with GPT-2 tokenizer instead.")
+            return None
+        return lambda texts: [len(ids) for ids in tokenizer.encode_ordinary_batch(texts)]
+
+    @classmethod
+    def __keyOf(cls, text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def count(self, text: str) -> int:
+        """
+        Counts the tokens of a text.
+
+        Args:
+            text (str): The text
+
+        Returns:
+            int: Number of tokens
+        """
+        return self.countMany([text])[0]
+
+    def countMany(self, texts: List[str]) -> List[int]:
+        """
+        Counts the tokens of many texts, tokenizing all the uncached ones in one call.
+
+        Args:
+            texts (List[str]): The texts
+
+        Returns:
+            List[int]: Number of tokens of each text
+        """
+        counts = [0] * len(texts)
+        missing: Dict[bytes, List[int]] = dict()
+        missingTexts = []
+
+        for i, text in enumerate(texts):
+            if not text:
+                continue
+
+            key = self.__keyOf(text)
+            if key in self.__counts:
+                self.__counts.move_to_end(key)
+                counts[i] = self.__counts[key]
+                self.hits += 1
+            elif key in missing:
+                missing[key].append(i)
+                self.hits += 1
+            else:
+                missing[key] = [i]
+                missingTexts.append(text)
+
+        if missingTexts:
+            self.misses += len(missingTexts)
+            for (key, indices), count in zip(missing.items(), self.__encoder()(missingTexts)):
+                for i in indices:
+                    counts[i] = count
+                self.__counts[key] = count
+
+            while len(self.__counts) > self.cacheEntries:
+                self.__counts.popitem(last=False)
+
+        return counts
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: Numbers of hits, misses and memoized counts
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.__counts)}
@@ -0,0 +1,264 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Iterator, List
+
+
+class Tracer:
+    """
+    Dependency-free tracing of nested spans, from the stage and the story down to the API calls.
+
+    Spans nest by the context they are opened in, which asyncio tasks inherit, so the calls gathered concurrently under
+    a span are its children.  Finished spans are kept in memory, and the spans of each trace are appended to a file
+    when its root span ends, either as JSON lines of spans or as OTLP/JSON that OpenTelemetry collectors accept.
+    Spans ending after their root, e.g. of tasks left running, are appended on their own.
+
+    Attributes:
+        finished (Deque[Tracer.Span]): Most recently finished spans
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    JSONL = "jsonl"
+    OTLP = "otlp"
+
+    DEFAULT_MAX_SPANS = 10000  # Finished spans kept in memory
+    DEFAULT_MAX_PENDING = 1000  # Traces whose spans wait for their root to end before being exported
+    DEFAULT_SERVICE = "aistory"
+
+    __shared: "Tracer" = None
+    __current: contextvars.ContextVar["Tracer.Span | None"] = contextvars.ContextVar("span", default=None)
+
+    class Span:
+        """
+        A timed operation, with attributes describing it.
+        """
+
+        def __init__(self, name: str, traceId: str, parentId: str | None, attributes: Dict[str, Any]):
+            self.name = name
+            self.traceId = traceId
+            self.spanId = secrets.token_hex(8)
+            self.parentId = parentId
+            self.attributes = attributes
+            self.startTime = time.time_ns()
+            self.endTime: int | None = None
+            self.error: str | None = None
+
+        def set(self, **attributes):
+            """
+            Adds attributes to the span, e.g. the token usage once the response arrives.
+            """
+            self.attributes.update(attributes)
+
+        def duration(self) -> float | None:
+            """
+            Returns:
+                float | None: Seconds the span took, or None if it has not ended
+            """
+            return None if self.endTime is None else (self.endTime - self.startTime) / 1e9
+
+        def toDict(self) -> Dict[str, Any]:
+            """
+            Returns:
+                Dict[str, Any]: The span as a flat dictionary
+            """
+            return {
+                "name": self.name,
+                "traceId": self.traceId,
+                "spanId": self.spanId,
+                "parentId": self.parentId,
+                "start": self.startTime / 1e9,
+                "duration": self.duration(),
+                "attributes": self.attributes,
+                "error": self.error,
+            }
+
+        def toOtlp(self) -> Dict[str, Any]:
+            """
+            Returns:
+                Dict[str, Any]: The span in the OTLP/JSON encoding
+            """
+            def value(v: Any) -> Dict[str, Any]:
+                if isinstance(v, bool):
+                    return {"boolValue": v}
+                if isinstance(v, int):
+                    return {"intValue": str(v)}
+                if isinstance(v, float):
+                    return {"doubleValue": v}
+                return {"stringValue": str(v)}
+
+            span = {
+                "traceId": self.traceId,
+                "spanId": self.spanId,
+                "name": self.name,
+                "kind": 1,  # Internal
+                "startTimeUnixNano": str(self.startTime),
+                "endTimeUnixNano": str(self.endTime),
+                "attributes": [{"key": k, "value": value(v)} for k, v in self.attributes.items() if v is not None],
+                "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+            }
+            if self.parentId:
+                span["parentSpanId"] = self.parentId
+            return span
+
+    @classmethod
+    def shared(cls) -> "Tracer":
+        """
+        Returns:
+            Tracer: The tracer shared by the whole process
+        """
+        if cls.__shared is None:
+            cls.__shared = Tracer()
+        return cls.__shared
+
+    @classmethod
+    def setShared(cls, tracer: "Tracer"):
+        """
+        Replaces the tracer shared by the whole process, e.g. with one exporting to a file.
+
+        Args:
+            tracer (Tracer): The new shared tracer
+        """
+        cls.__shared = tracer
+
+    @classmethod
+    def traced(cls, name: str = None, attributes: Callable[..., Dict[str, Any]] = None) -> Callable:
+        """
+        Decorates an async function to run in a span of the shared tracer.
+
+        Args:
+            name (str): Name of the span (default: the qualified name of the function, e.g. "Story.generate")
+            attributes (Callable[..., Dict[str, Any]]): Function of the arguments of the call giving the attributes
+                of the span (optional)
+
+        Returns:
+            Callable: The decorator
+        """
+        def decorate(function: Callable) -> Callable:
+            spanName = name or function.__qualname__
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with cls.shared().span(spanName, **(attributes(*args, **kwargs) if attributes else {})):
+                    return await function(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+    @classmethod
+    def current(cls) -> "Tracer.Span | None":
+        """
+        Returns:
+            Tracer.Span | None: The innermost span open in the current context, or None
+        """
+        return cls.__current.get()
+
+    def __init__(
+            self,
+            file: str = None,
+            exportFormat: str = JSONL,
+            maxSpans: int = DEFAULT_MAX_SPANS,
+            maxPending: int = DEFAULT_MAX_PENDING,
+            service: str = DEFAULT_SERVICE,
+    ):
+        """
+        Initializes a tracer.  Use shared() to get the one of the process.
+
+        Args:
+            file (str): Path of the file to append the finished traces to (default: None for in-memory only)
+            exportFormat (str): "jsonl" for a line per span, or "otlp" for a line of OTLP/JSON per trace
+            maxSpans (int): Number of finished spans kept in memory
+            maxPending (int): Number of traces waiting for their root to end, beyond which the oldest is exported
+                without it
+            service (str): Name of the service in the OTLP resource
+        """
+        if exportFormat not in [self.JSONL, self.OTLP]:
+            raise ValueError(f"Unknown export format {exportFormat}")
+
+        self.file = file
+        self.exportFormat = exportFormat
+        self.maxPending = maxPending
+        self.service = service
+
+        if file:
+            directory = os.path.dirname(file)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+        self.finished: Deque[Tracer.Span] = deque(maxlen=maxSpans)
+        self.__pending: OrderedDict[str, List[Tracer.Span]] = OrderedDict()  # Trace ID: finished spans not exported yet
+        self.__exported: OrderedDict[str, None] = OrderedDict()  # IDs of the traces whose root was exported lately
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator["Tracer.Span"]:
+        """
+        Opens a span around a block of code, as a child of the span open in the current context.
+
+        Args:
+            name (str): Name of the operation, e.g. "Story.generate"
+            **attributes: Attributes describing the operation
+
+        Returns:
+            Iterator[Tracer.Span]: The span, to add attributes to
+        """
+        parent = self.__current.get()
+        span = self.Span(name, parent.traceId if parent else secrets.token_hex(16), parent and parent.spanId, attributes)
+        token = self.__current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.endTime = time.time_ns()
+            self.__current.reset(token)
+            self.__finish(span, root=parent is None)
+
+    def __finish(self, span: "Tracer.Span", root: bool):
+        self.finished.append(span)
+        if not self.file:
+            return
+
+        if span.traceId in self.__exported:  # Ended after its root, so nothing is left to wait for
+            self.__export([span])
+            return
+
+        self.__pending.setdefault(span.traceId, []).append(span)
+        if root:
+            self.__export(self.__pending.pop(span.traceId))
+            self.__exported[span.traceId] = None
+            if len(self.__exported) > self.maxPending:
+                self.__exported.popitem(last=False)
+
+        while len(self.__pending) > self.maxPending:
+            traceId, spans = self.__pending.popitem(last=False)
+            self.logger.warning(f"Exporting {len(spans)} spans of trace {traceId} without waiting for its root")
+            self.__export(spans)
+
+    def __export(self, spans: List["Tracer.Span"]):
+        with open(self.file, "a") as f:
+            if self.exportFormat == self.JSONL:
+                for span in spans:
+                    f.write(json.dumps(span.toDict(), default=str) + "\n")
+            else:
+                f.write(json.dumps({"resourceSpans": [{
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+                    "scopeSpans": [{"scope": {"name": "cjw.aistory"}, "spans": [s.toOtlp() for s in spans]}],
+                }]}) + "\n")
+
+    def trace(self, traceId: str) -> List["Tracer.Span"]:
+        """
+        Args:
+            traceId (str): ID of the trace
+
+        Returns:
+            List[Tracer.Span]: The finished spans of the trace still in memory, in the order they started
+        """
+        return sorted([s for s in self.finished if s.traceId == traceId], key=lambda s: s.startTime)
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Tuple
+
+
+class UsageLedger:
+    """
+    Tallies the tokens and estimated cost of the API calls, attributed to the caller by tags.
+
+    Tags tell who made a call, e.g. {"story": "dragon", "actor": "Alice", "purpose": "condense"}.  The ledger keeps
+    the totals of each model and combination of tags in memory, and appends snapshots of them to a JSON lines file
+    every export interval if a file is given.
+
+    Attributes:
+        calls (int): Number of calls recorded
+        cost (float): Estimated cost of the calls recorded, in US dollars
+    """
+
+    logger = logging.getLogger(__qualname__)
+
+    PRICES = {  # Model name prefix: US dollars per 1K prompt and completion tokens
+        "gpt-4-1106": (0.01, 0.03),
+        "gpt-4-32k": (0.06, 0.12),
+        "gpt-4": (0.03, 0.06),
+        "gpt-3.5-turbo-1106": (0.001, 0.002),
+        "gpt-3.5-turbo-16k": (0.003, 0.004),
+        "gpt-3.5-turbo": (0.0015, 0.002),
+        "text-davinci-003": (0.02, 0.02),
+        "text-davinci-002": (0.02, 0.02),
+    }
+
+    DEFAULT_EXPORT_INTERVAL = 60  # Seconds between snapshots exported to the file
+
+    __shared: "UsageLedger" = None
+
+    @classmethod
+    def shared(cls) -> "UsageLedger":
+        """
+        Returns:
+            UsageLedger: The ledger shared by all portals of the process
+        """
+        if cls.__shared is None:
+            cls.__shared = UsageLedger()
+        return cls.__shared
+
+    @classmethod
+    def costOf(cls, model: str, promptTokens: int, completionTokens: int) -> float:
+        """
+        Estimates the cost of a call.
+
+        Args:
+            model (str): Name of the model
+            promptTokens (int): Tokens of the prompt
+            completionTokens (int): Tokens of the completion
+
+        Returns:
+            float: Cost in US dollars, or 0 if the price of the model is unknown
+        """
+        # The longest matching prefix wins, e.g. gpt-4-32k over gpt-4
+        prefixes = [prefix for prefix in cls.PRICES if model and model.startswith(prefix)]
+        if not prefixes:
+            return 0.0
+        promptPrice, completionPrice = cls.PRICES[max(prefixes, key=len)]
+        return (promptTokens * promptPrice + completionTokens * completionPrice) / 1000
+
+    def __init__(self, file: str = None, exportInterval: float = DEFAULT_EXPORT_INTERVAL):
+        """
+        Initializes a ledger.  Use shared() to get the one of the process.
+
+        Args:
+            file (str): Path of the JSON lines file to export snapshots to (default: None for in-memory only)
+            exportInterval (float): Seconds between snapshots exported to the file
+        """
+        self.file = file
+        self.exportInterval = exportInterval
+
+        if file:
+            directory = os.path.dirname(file)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+        self.__entries: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Dict[str, float]] = dict()
+        self.__lastExport = time.monotonic()
+
+        self.calls = 0
+        self.cost = 0.0
+
+    def record(self, model: str, usage: Dict[str, int], tags: Dict[str, str] = None):
+        """
+        Records the usage of a call.
+
+        Args:
+            model (str): Name of the model
+            usage (Dict[str, int]): Usage block of the response, with prompt_tokens and completion_tokens
+            tags (Dict[str, str]): Who made the call (optional)
+        """
+        promptTokens = usage.get("prompt_tokens") or 0
+        completionTokens = usage.get("completion_tokens") or 0
+        cost = self.costOf(model, promptTokens, completionTokens)
+
+        key = (model, tuple(sorted((k, str(v)) for k, v in (tags or {}).items() if v is not None)))
+        entry = self.__entries.setdefault(
+            key, {"calls": 0, "promptTokens": 0, "completionTokens": 0, "totalTokens": 0, "cost": 0.0}
+        )
+        entry["calls"] += 1
+        entry["promptTokens"] += promptTokens
+        entry["completionTokens"] += completionTokens
+        entry["totalTokens"] += usage.get("total_tokens") or promptTokens + completionTokens
+        entry["cost"] += cost
+
+        self.calls += 1
+        self.cost += cost
+
+        if self.file and time.monotonic() - self.__lastExport >= self.exportInterval:
+            self.export()
+
+    def totals(self, by: List[str] = None) -> Dict[str, Dict[str, float]]:
+        """
+        Sums up the usage by some of the tags.
+
+        Args:
+            by (List[str]): Tags to group by, "model" included (default: None for every model and combination of tags)
+
+        Returns:
+            Dict[str, Dict[str, float]]: Per group, named like "model=gpt-4,purpose=condense", the numbers of calls
+                and tokens, and the cost
+        """
+        totals: Dict[str, Dict[str, float]] = dict()
+        for (model, tags), entry in self.__entries.items():
+            labels = {"model": model, **dict(tags)}
+            names = sorted(labels) if by is None else by
+            group = ",".join(f"{name}={labels.get(name, '')}" for name in names)
+
+            total = totals.setdefault(group, {k: 0 for k in entry})
+            for k, v in entry.items():
+                total[k] += v
+
+        return totals
+
+    def export(self):
+        """
+        Appends a snapshot of the totals to the file, if any, and logs the overall cost.
+        """
+        self.__lastExport = time.monotonic()
+        self.logger.info(f"{self.calls} calls so far, costing about ${self.cost:.4f}")
+
+        if self.file:
+            with open(self.file, "a") as f:
+                f.write(json.dumps({"time": time.time(), "totals": self.totals()}) + "\n")
+
+    def reset(self):
+        """
+        Forgets the usage recorded.
+        """
+        self.__entries.clear()
+        self.calls = 0
+        self.cost = 0.0
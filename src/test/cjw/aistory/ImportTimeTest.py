@@ -0,0 +1,58 @@
+import os
+import re
+import subprocess
+import sys
+import unittest
+from typing import Dict, Set
+
+
+class ImportTimeTest(unittest.TestCase):
+    """
+    Keeps the start-up of API workers and scripts fast.  Measured with python -X importtime in a fresh interpreter.
+
+    The budget may be set in milliseconds with the environment variable AISTORY_IMPORT_BUDGET_MS.
+    """
+
+    DEFAULT_BUDGET_MS = 300
+    HEAVY_MODULES = {"transformers", "torch", "openai", "aiohttp", "jsonpickle", "fastapi", "tiktoken"}
+
+    __sourceRoot = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "main"))
+    __line = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+    @classmethod
+    def __importTime(cls, module: str) -> (float, Set[str]):
+        """
+        Imports a module in a fresh interpreter.
+
+        Returns:
+            (float, Set[str]): Cumulative import time of the module in milliseconds, and all modules imported
+        """
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(p for p in [cls.__sourceRoot, env.get("PYTHONPATH")] if p)
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            env=env, capture_output=True, text=True, check=True
+        )
+
+        cumulative: Dict[str, int] = dict()
+        for match in cls.__line.finditer(result.stderr):
+            cumulative[match.group(4)] = int(match.group(2))
+
+        return cumulative[module] / 1000, set(cumulative.keys())
+
+    def __checkBudget(self, module: str):
+        budget = float(os.environ.get("AISTORY_IMPORT_BUDGET_MS", self.DEFAULT_BUDGET_MS))
+        elapsed, imported = self.__importTime(module)
+
+        self.assertEqual({m.split(".")[0] for m in imported} & self.HEAVY_MODULES, set())
+        self.assertLessEqual(elapsed, budget, f"{module} took {elapsed:.1f}ms to import")
+
+    def test_story(self):
+        self.__checkBudget("cjw.aistory.adventure.Story")
+
+    def test_stage(self):
+        self.__checkBudget("cjw.aistory.storyboard.Stage")
+
+
+if __name__ == '__main__':
+    unittest.main()
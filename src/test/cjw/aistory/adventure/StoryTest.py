@@ -1,15 +1,55 @@
 import asyncio
 import os.path
 import unittest
+from typing import Dict
 from unittest.mock import patch, AsyncMock
 
 from cjw.aistory.adventure.GptTeller import GptTeller
 from cjw.aistory.adventure.PolishProgressStory import PolishProgressStory
 from cjw.aistory.adventure.Story import Story
+from cjw.aistory.adventure.Teller import Teller
+from cjw.aistory.utilities.ChatPrompt import ChatPrompt
+from cjw.aistory.utilities.Deadline import Deadline
 from cjw.aistory.utilities.Protagonist import Protagonist
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
 
 
 class StoryTest(unittest.TestCase):
+    class WordTeller(Teller):
+        """Responds with numbered responses, counting words as tokens, and records the requests."""
+
+        def __init__(self):
+            self.requests = []
+            self.tooManyTokens = False
+
+        def getName(self) -> str:
+            return "test"
+
+        def isCompatible(self, name: str) -> bool:
+            return name == self.getName()
+
+        async def generate(
+                self,
+                prompt: ChatPrompt,
+                redo: bool = True,
+                priority: RequestScheduler.Priority = RequestScheduler.Priority.INTERACTIVE,
+                deadline: Deadline = None,
+                tags: Dict[str, str] = None,
+        ) -> str:
+            self.requests.append((priority, deadline))
+            if self.tooManyTokens:
+                raise Teller.TooManyTokensError("Too many tokens")
+            response = f"response {len(self.requests)}"
+            prompt.bot(response, replace=redo)
+            return response
+
+        def getNumTokens(self, prompt: str | ChatPrompt) -> int:
+            if isinstance(prompt, str):
+                return len(prompt.split())
+            return sum(len(m["content"].split()) for m in prompt.messages)
+
+        def createPrompt(self) -> ChatPrompt:
+            return ChatPrompt(bot="assistant")
 
     nextStep = 0
 
@@ -146,6 +186,40 @@ class StoryTest(unittest.TestCase):
 
             story.show()
 
+    def test_deadline(self):
+        teller = self.WordTeller()
+        story = PolishProgressStory(teller, preservedFromCondense=1)
+
+        async def go():
+            for i in range(3):
+                await story.add(f"user {i}")
+                await story.generate(redo=False)
+            await story.add("user 3")
+            story.maxPromptTokens = story.currentPromptTokens
+
+            # Too little time left to condense, so it is deferred and the response kept
+            teller.requests.clear()
+            response = await story.generate(deadline=Deadline.after(1))
+            self.assertEqual(story.archivedPrompt.getContent(-1), response)
+            self.assertEqual([r[0] for r in teller.requests], [RequestScheduler.Priority.INTERACTIVE])
+            self.assertGreater(story.currentPromptTokens, story.maxPromptTokens)
+
+            # With time enough, the story condenses within the deadline of the response
+            teller.requests.clear()
+            deadline = Deadline.after(60)
+            await story.generate(redo=False, deadline=deadline)
+            self.assertEqual([r[0] for r in teller.requests][1:], [RequestScheduler.Priority.CONDENSE])
+            self.assertTrue(all(r[1] is deadline for r in teller.requests))
+
+            # Over the limit of the teller, it neither condenses nor retries without the time to
+            teller.requests.clear()
+            teller.tooManyTokens = True
+            with self.assertRaises(Teller.TooManyTokensError):
+                await story.generate(deadline=Deadline.after(1))
+            self.assertEqual(len(teller.requests), 1)
+
+        asyncio.run(go())
+
 
 if __name__ == '__main__':
     unittest.main()
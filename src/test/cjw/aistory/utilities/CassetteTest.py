@@ -0,0 +1,72 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from cjw.aistory.utilities.Cassette import Cassette
+from cjw.aistory.utilities.GptPortal import GptPortal
+
+
+class CassetteTest(unittest.TestCase):
+    messages = [{"role": "user", "content": "Tell a story"}]
+
+    @classmethod
+    async def complete(cls, **kwargs):
+        await asyncio.sleep(0.2)
+        if not kwargs.get("stream"):
+            content = f"Story {kwargs.get('temperature')}"
+            return {"choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]}
+
+        async def chunks():
+            for text in ["Once", " upon", " a time."]:
+                await asyncio.sleep(0.1)
+                yield {"choices": [{"delta": {"content": text}, "finish_reason": None}]}
+            yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+
+        return chunks()
+
+    def test_recordReplay(self):
+        async def run(cassette: Cassette):
+            portal = GptPortal("sk-test-cassette", cassette=cassette, coalescing=False)
+            with patch.object(GptPortal, "estimateTokens", side_effect=lambda text, model=None: len(text.split())), \
+                    patch.object(GptPortal, "estimateTokensMany",
+                                 side_effect=lambda texts, model=None: [len(t.split()) for t in texts]):
+                start = time.monotonic()
+                results = [
+                    (await portal.chatCompletion(self.messages, temperature=t))["content"] for t in [0, 1, 0]
+                ]
+                streamed = "".join([d["content"] async for d in portal.chatCompletionStream(self.messages)])
+                return results, streamed, time.monotonic() - start
+
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "cassettes", "story.jsonl.gz")
+
+            recorder = Cassette(file, mode="record")
+            with patch("openai.ChatCompletion.acreate", side_effect=self.complete):
+                recorded = asyncio.run(run(recorder))
+            self.assertEqual(recorder.stats()["recorded"], 4)
+
+            # Replaying touches no network
+            with patch("openai.ChatCompletion.acreate", side_effect=ConnectionError("Offline")):
+                player = Cassette(file)
+                replayed = asyncio.run(run(player))
+                self.assertEqual(replayed[:2], recorded[:2])
+                self.assertLess(replayed[2], 0.1)
+                self.assertEqual(player.stats(), {"requests": 3, "played": 4, "recorded": 0})
+
+                paced = asyncio.run(run(Cassette(file, latencyScale=0.5)))
+                self.assertAlmostEqual(paced[2], recorded[2] * 0.5, delta=0.2)
+
+                with self.assertRaises(Cassette.MissingRecordingError):
+                    asyncio.run(GptPortal("sk-test-cassette", cassette=player).chatCompletion(
+                        [{"role": "user", "content": "Never asked"}]
+                    ))
+
+        self.assertEqual(recorded[0], ["Story 0", "Story 1", "Story 0"])
+        self.assertEqual(recorded[1], "Once upon a time.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import openai
+
+from cjw.aistory.utilities.ConcurrencyGovernor import ConcurrencyGovernor
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.RetryPolicy import RetryPolicy
+
+
+class ConcurrencyGovernorTest(unittest.TestCase):
+    def test_additiveIncrease(self):
+        async def run():
+            governor = ConcurrencyGovernor(initialWindow=4)
+            for _ in range(4):
+                async with governor.slot():
+                    pass
+            return governor
+
+        governor = asyncio.run(run())
+        self.assertAlmostEqual(governor.window, 5, delta=0.1)  # One slot per window of successes
+        self.assertEqual(governor.inFlight, 0)
+
+    def test_multiplicativeDecrease(self):
+        async def run():
+            governor = ConcurrencyGovernor(initialWindow=16)
+            slots = [governor.slot() for _ in range(8)]
+            for slot in slots:
+                await slot.__aenter__()
+
+            # A burst of congestion from calls of the same window cuts it only once
+            for slot in slots:
+                slot.congested()
+                await slot.__aexit__(None, None, None)
+            self.assertEqual(governor.window, 8)
+
+            try:
+                async with governor.slot():
+                    raise asyncio.TimeoutError()
+            except asyncio.TimeoutError:
+                pass
+            self.assertEqual(governor.window, 4)
+
+            async with governor.slot() as slot:
+                slot.failed()
+            self.assertEqual(governor.window, 4)
+
+        asyncio.run(run())
+
+    def test_queueing(self):
+        async def run():
+            governor = ConcurrencyGovernor(initialWindow=2, maxWindow=2)
+            peak = 0
+            order = []
+
+            async def call(i):
+                nonlocal peak
+                async with governor.slot():
+                    peak = max(peak, governor.inFlight)
+                    order.append(i)
+                    await asyncio.sleep(0.02)
+
+            tasks = [asyncio.create_task(call(i)) for i in range(6)]
+            await asyncio.sleep(0.01)
+            depth = governor.queueDepth()
+            tasks[5].cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            return governor, peak, depth, order
+
+        governor, peak, depth, order = asyncio.run(run())
+        print(governor.stats())
+        self.assertEqual(peak, 2)
+        self.assertEqual(depth, 4)
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+        self.assertEqual(governor.inFlight, 0)
+        self.assertGreater(governor.stats()["meanWait"], 0.01)
+
+    def test_portal(self):
+        attempts = 0
+
+        async def rateLimited(**kwargs):
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise openai.error.RateLimitError("Rate limit reached", headers={"retry-after-ms": "10"})
+            return {"choices": [{"text": "done"}]}
+
+        async def run():
+            governor = ConcurrencyGovernor(initialWindow=8)
+            portal = GptPortal("sk-test-governed", governor=governor)
+            with patch("openai.Completion.acreate", side_effect=rateLimited):
+                result = await portal.completion("Hello", retryPolicy=RetryPolicy(maxRetries=2, rateLimitDelay=0.01))
+            return result, governor
+
+        result, governor = asyncio.run(run())
+        self.assertEqual(result, "done")
+        self.assertEqual(governor.decreases, 1)
+        self.assertEqual(governor.increases, 1)
+        self.assertAlmostEqual(governor.window, 4.25)
+
+    def test_deadline(self):
+        async def slow(*args, **kwargs):
+            await asyncio.sleep(1)
+
+        async def run(access: str):
+            governor = ConcurrencyGovernor(initialWindow=8)
+            portal = GptPortal("sk-test-deadline", access=access, governor=governor)
+            with patch("openai.Completion.acreate", side_effect=slow), \
+                    patch.object(GptPortal, "_GptPortal__post", side_effect=slow):
+                with self.assertRaises(GptPortal.DeadlineExceededError):
+                    await portal.completion("Hello", retryPolicy=RetryPolicy(deadline=0.05))
+            return governor
+
+        # Running out of the caller's own deadline says nothing of the server, so the window is not cut
+        for access in ["http", "openai"]:
+            governor = asyncio.run(run(access))
+            self.assertEqual(governor.window, 8)
+            self.assertEqual(governor.decreases, 0)
+            self.assertEqual(governor.inFlight, 0)
+
+    def test_shared(self):
+        self.assertIs(ConcurrencyGovernor.shared(), ConcurrencyGovernor.shared())
+
+        # Portals handed out by GptPortal.of() share the governor, unless opted out
+        self.assertIs(GptPortal.of("sk-test-shared-governor").governor, ConcurrencyGovernor.shared())
+        self.assertIsNone(GptPortal.of("sk-test-ungoverned", governor=None).governor)
+
+
+if __name__ == '__main__':
+    unittest.main()
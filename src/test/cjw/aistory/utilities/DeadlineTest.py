@@ -0,0 +1,81 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from cjw.aistory.utilities.Deadline import Deadline
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.RetryPolicy import RetryPolicy
+
+
+class DeadlineTest(unittest.TestCase):
+    def test_remaining(self):
+        unlimited = Deadline()
+        self.assertIsNone(unlimited.remaining())
+        self.assertFalse(unlimited.expired())
+        self.assertTrue(unlimited.allows(3600))
+
+        deadline = Deadline.after(10)
+        self.assertTrue(9 < deadline.remaining() <= 10)
+        self.assertTrue(deadline.allows(5))
+        self.assertFalse(deadline.allows(20))
+
+        deadline.cancel("player left")
+        self.assertEqual(deadline.remaining(), 0)
+        self.assertTrue(deadline.expired())
+        self.assertEqual(deadline.reason, "player left")
+
+        self.assertTrue(Deadline.after(-1).expired())
+
+    def test_retryPolicy(self):
+        policy = RetryPolicy(maxRetries=5, baseDelay=10, jitter=False)
+        self.assertIs(policy.withDeadline(None), policy)
+
+        async def run():
+            schedule = policy.withDeadline(Deadline.after(1)).start()
+            start = time.monotonic()
+            retrying = await schedule.backoff()
+            return retrying, time.monotonic() - start
+
+        retrying, elapsed = asyncio.run(run())
+        self.assertFalse(retrying)
+        self.assertLess(elapsed, 0.5)
+        self.assertIsNone(policy.until)
+
+    def test_partialContinuation(self):
+        async def complete(**kwargs):
+            if len(kwargs["messages"]) == 1:
+                await asyncio.sleep(0.05)
+                return {"choices": [
+                    {"message": {"role": "assistant", "content": "Once upon"}, "finish_reason": "length"}
+                ]}
+            await asyncio.sleep(2)
+            return {"choices": [
+                {"message": {"role": "assistant", "content": "a time."}, "finish_reason": "stop"}
+            ]}
+
+        async def run(deadline: Deadline):
+            portal = GptPortal("sk-test-deadline")
+            with patch("openai.ChatCompletion.acreate", side_effect=complete):
+                start = time.monotonic()
+                result = await portal.chatCompletion([{"role": "user", "content": "Tell a story"}], deadline=deadline)
+                return result, time.monotonic() - start
+
+        result, elapsed = asyncio.run(run(Deadline.after(0.5)))
+        self.assertEqual(result["content"], "Once upon")
+        self.assertTrue(result["partial"])
+        self.assertLess(elapsed, 1)
+
+        # No time is left for a continuation at all
+        deadline = Deadline.after(0.06)
+        result, elapsed = asyncio.run(run(deadline))
+        self.assertTrue(result["partial"])
+        self.assertEqual(result["pieces"], 1)
+        self.assertLess(elapsed, 0.5)
+
+        with self.assertRaises(GptPortal.DeadlineExceededError):
+            asyncio.run(run(Deadline.after(0.01)))
+
+
+if __name__ == '__main__':
+    unittest.main()
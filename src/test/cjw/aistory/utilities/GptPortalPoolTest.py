@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+from collections import Counter
+from unittest.mock import patch
+
+import openai
+
+from cjw.aistory.utilities.ConcurrencyGovernor import ConcurrencyGovernor
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.GptPortalPool import GptPortalPool
+from cjw.aistory.utilities.RateLimiter import RateLimiter
+
+
+class GptPortalPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.used = Counter()
+
+        async def complete(**kwargs):
+            key = kwargs["api_key"]
+            await asyncio.sleep(0.01)
+            if key == "sk-pool-bad":
+                raise openai.error.AuthenticationError("Incorrect API key provided")
+            if key == "sk-pool-quota":
+                raise openai.error.RateLimitError("You exceeded your current quota")
+            self.used[key] += 1
+            return {"choices": [{"text": f"{key} {kwargs['organization']}"}], "usage": {"total_tokens": 100}}
+
+        self.complete = complete
+
+    def test_isolatedKeys(self):
+        """Concurrent requests of different keys don't share the global key of the openai module."""
+        async def run():
+            portals = [GptPortal(f"sk-isolated-{i}", f"org-{i}") for i in range(3)]
+            with patch("openai.Completion.acreate", side_effect=self.complete):
+                return await asyncio.gather(*[p.completion("Hello", model="test-isolated") for p in portals * 3])
+
+        results = asyncio.run(run())
+        self.assertEqual(results, [f"sk-isolated-{i} org-{i}" for i in range(3)] * 3)
+
+    def test_sharedGovernor(self):
+        # The keys of a pool share the governor of the process, as the portals of GptPortal.of() do
+        pool = GptPortalPool(["sk-pool-governed-1", "sk-pool-governed-2"])
+        self.assertTrue(all(m.portal.governor is ConcurrencyGovernor.shared() for m in pool.members))
+
+        governor = ConcurrencyGovernor()
+        pool = GptPortalPool(["sk-pool-governed-1", "sk-pool-governed-2"], governor=governor)
+        self.assertTrue(all(m.portal.governor is governor for m in pool.members))
+        pool = GptPortalPool(["sk-pool-ungoverned"], governor=None)
+        self.assertIsNone(pool.members[0].portal.governor)
+
+    def test_balancing(self):
+        RateLimiter.configure("test-pool-balancing", 6000, 6000)
+
+        async def run():
+            async with GptPortalPool(["sk-pool-a", ("sk-pool-b", "org-b")]) as pool:
+                with patch("openai.Completion.acreate", side_effect=self.complete):
+                    for _ in range(10):
+                        await pool.completion("Hello", model="test-pool-balancing", max_tokens=100)
+                return pool.stats()
+
+        stats = asyncio.run(run())
+        self.assertEqual(self.used, {"sk-pool-a": 5, "sk-pool-b": 5})
+        self.assertEqual(stats["org-b/...ol-b"]["requests"], 5)
+        self.assertEqual(stats["...ol-a"]["requests"], 5)
+        self.assertEqual(stats["...ol-a"]["failures"], 0)
+        self.assertEqual(stats["...ol-a"]["inFlight"], 0)
+
+    def test_defaultModel(self):
+        """A completion without a model is routed by the headroom of the model it is sent with."""
+        RateLimiter.of("sk-pool-busy", GptPortal.defaultModelOf("chatCompletion")).tokens.level = -1000
+
+        async def run():
+            async with GptPortalPool(["sk-pool-busy", "sk-pool-idle"]) as pool:
+                with patch("openai.Completion.acreate", side_effect=self.complete), \
+                        patch.object(GptPortal, "estimateTokensMany", return_value=[5]):
+                    return [await pool.completion("Hello", max_tokens=10) for _ in range(3)]
+
+        self.assertEqual(asyncio.run(run()), ["sk-pool-idle None"] * 3)
+        self.assertEqual(self.used, {"sk-pool-idle": 3})
+
+    def test_failover(self):
+        RateLimiter.configure("test-pool-failover", 6000, 60000)
+
+        async def run():
+            pool = GptPortalPool(["sk-pool-bad", "sk-pool-quota", "sk-pool-good"])
+            with patch("openai.Completion.acreate", side_effect=self.complete):
+                results = await asyncio.gather(*[pool.completion("Hello", model="test-pool-failover") for _ in range(6)])
+            return pool, results
+
+        pool, results = asyncio.run(run())
+        stats = pool.stats()
+        self.assertEqual(results, ["sk-pool-good None"] * 6)
+        self.assertFalse(stats["...-bad"]["active"])
+        self.assertIn("AuthenticationError", stats["...-bad"]["disabledReason"])
+        self.assertFalse(stats["...uota"]["active"])
+        self.assertIn("QuotaExceededError", stats["...uota"]["disabledReason"])
+        self.assertEqual(stats["...good"]["requests"], 6)
+        self.assertEqual(stats["...good"]["failures"], 0)
+        self.assertGreaterEqual(stats["...-bad"]["failures"], 1)  # Calls in flight fail before it is taken out
+
+        with patch("openai.Completion.acreate", side_effect=self.complete):
+            pool.members[-1].active = False
+            with self.assertRaises(GptPortalPool.NoKeyAvailableError):
+                asyncio.run(pool.completion("Hello", model="test-pool-failover"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import asyncio
+import statistics
+import time
+import unittest
+from typing import List
+
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.OpenAIStub import OpenAIStub
+
+
+class GptPortalPoolingBenchmark(unittest.TestCase):
+    """
+    Compares the http access mode of GptPortal with and without connection pooling against a local OpenAIStub.
+    """
+
+    REQUESTS = 2000
+    CONCURRENCY = 50
+
+    @classmethod
+    async def __run(cls, portal: GptPortal, requests: int, concurrency: int) -> (float, List[float]):
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                await portal.completion("Tell me a story.", model="text-davinci-003")
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(requests)])
+        return time.perf_counter() - start, latencies
+
+    @classmethod
+    def __report(cls, label: str, elapsed: float, latencies: List[float]):
+        percentiles = statistics.quantiles(latencies, n=100)
+        print(
+            f"{label:>10}: {len(latencies) / elapsed:8.1f} requests/s, "
+            f"p50={percentiles[49] * 1000:.2f}ms, p99={percentiles[98] * 1000:.2f}ms"
+        )
+
+    async def __benchmark(self):
+        async with OpenAIStub(completionTokens=4) as stub:
+            for pooled in [False, True]:
+                async with GptPortal("sk-benchmark", access="http", baseUrl=stub.url, pooled=pooled) as portal:
+                    await self.__run(portal, self.CONCURRENCY, self.CONCURRENCY)  # Warm up
+                    elapsed, latencies = await self.__run(portal, self.REQUESTS, self.CONCURRENCY)
+                    self.__report("pooled" if pooled else "unpooled", elapsed, latencies)
+                    self.assertEqual(len(latencies), self.REQUESTS)
+
+    def test_pooling(self):
+        asyncio.run(self.__benchmark())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,12 +2,17 @@ import asyncio
 import itertools
 import json
 import os
+import time
 import unittest
 from unittest.mock import patch, AsyncMock
 
+import openai
 import requests
+from aiohttp import web
 
+from cjw.aistory.utilities.ConcurrencyGovernor import ConcurrencyGovernor
 from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.RateLimiter import RateLimiter
 
 
 class GptPortalTest(unittest.TestCase):
@@ -143,6 +148,219 @@ The Kagas: Kaga is an intelligent species who lived on Luytan b.  A Kaga looks l
             self.assertEqual(result[4]["content"], 'patch 0/4 patch 1/4 patch 2/4 patch 3/4 patch 4/4')
             loop.close()
 
+    def test_concurrentContinuation(self):
+        messages = [{"role": "user", "content": "Tell me four stories."}]
+
+        async def slowResponse(func, request, **kwargs):
+            await asyncio.sleep(0.1)
+            if request["messages"][-1]["content"] == "Tell me four stories.":
+                if request.get("max_tokens", 10) > 10:
+                    # Adaptive retry with a larger max_tokens finishes in one piece
+                    return {"choices": [{"message": {"role": "assistant", "content": "whole"}, "finish_reason": "stop"}]}
+                return {"choices": [
+                    {"message": {"role": "assistant", "content": f"story {i}"}, "finish_reason": "length"}
+                    for i in range(request.get("n", 1))
+                ]}
+
+            # Every story takes two continuations
+            done = request["messages"][-2]["content"].count("more") == 1
+            return {"choices": [
+                {"message": {"role": "assistant", "content": "more"}, "finish_reason": "stop" if done else "length"}
+            ]}
+
+        async def run(**kwargs):
+            portal = GptPortal("sk-test")
+            start = time.perf_counter()
+            with patch(
+                    "cjw.aistory.utilities.GptPortal.GptPortal._GptPortal__usingOpenAI", new_callable=AsyncMock
+            ) as mockResponse:
+                mockResponse.side_effect = slowResponse
+                results = await portal.chatCompletion(messages, n=4, max_tokens=10, **kwargs)
+            return results, time.perf_counter() - start
+
+        results, elapsed = asyncio.run(run())
+        self.assertEqual([r["content"] for r in results], [f"story {i} more more" for i in range(4)])
+        self.assertEqual([r["pieces"] for r in results], [3] * 4)
+        self.assertLess(elapsed, 0.6)  # 0.9 seconds if continued one after another
+
+        results, _ = asyncio.run(run(adaptiveMaxTokens=True))
+        self.assertEqual([r["content"] for r in results], ["whole"] * 4)
+
+    def test_chatCompletionStream(self):
+        pieces = [["Once upon", " a time"], ["there was", " a dragon."]]
+
+        async def streamChunks(request: web.Request) -> web.StreamResponse:
+            body = await request.json()
+            self.assertTrue(body["stream"])
+            piece = 0 if len(body["messages"]) == 1 else 1
+
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            await response.write(b'data: {"choices": [{"delta": {"role": "assistant"}, "finish_reason": null}]}\n\n')
+            for text in pieces[piece]:
+                chunk = {"choices": [{"delta": {"content": text}, "finish_reason": None}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            finish = {"choices": [{"delta": {}, "finish_reason": "length" if piece == 0 else "stop"}]}
+            await response.write(f"data: {json.dumps(finish)}\n\ndata: [DONE]\n\n".encode())
+            return response
+
+        async def run():
+            app = web.Application()
+            app.router.add_post("/v1/chat/completions", streamChunks)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+
+            try:
+                async with GptPortal("sk-test", access="http", baseUrl=f"http://127.0.0.1:{port}/v1") as portal:
+                    with patch.object(GptPortal, "estimateTokens", side_effect=lambda text, model=None: len(text.split())), \
+                            patch.object(GptPortal, "estimateTokensMany", side_effect=lambda texts, model=None: [len(t.split()) for t in texts]):
+                        return [d async for d in portal.chatCompletionStream([{"role": "user", "content": "Hi"}])]
+            finally:
+                await runner.cleanup()
+
+        deltas = asyncio.run(run())
+        self.assertEqual("".join(d["content"] for d in deltas), "Once upon a time there was a dragon.")
+        self.assertEqual(len(deltas), 5)
+        self.assertEqual(deltas[-1]["finish_reason"], "stop")
+        self.assertEqual(deltas[-1]["usage"]["completion_tokens"], 8)
+
+    def test_chatCompletionStreamOpenAI(self):
+        RateLimiter.configure("test-stream-model", 6000, 6000)
+        governor = ConcurrencyGovernor()
+        inFlight = []
+
+        async def stream(broken: bool):
+            yield {"choices": [{"delta": {"role": "assistant", "content": "Once upon"}, "finish_reason": None}]}
+            inFlight.append(governor.inFlight)
+            if broken:
+                raise openai.error.APIConnectionError("Connection reset")
+            yield {"choices": [{"delta": {"content": " a time"}, "finish_reason": None}]}
+            yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+
+        async def run(broken: bool, take: int = None):
+            portal = GptPortal("sk-test-stream", access="openai", governor=governor, rateLimited=True)
+            with patch("openai.ChatCompletion.acreate", side_effect=lambda **kwargs: stream(broken)), \
+                    patch.object(GptPortal, "estimateTokens", return_value=10), \
+                    patch.object(GptPortal, "estimateTokensMany", side_effect=lambda texts, model=None: [10] * len(texts)):
+                deltas = portal.chatCompletionStream([{"role": "user", "content": "Hi"}], model="test-stream-model")
+                received = []
+                async for delta in deltas:
+                    received.append(delta)
+                    if take and len(received) >= take:
+                        await deltas.aclose()
+                        break
+                return received
+
+        deltas = asyncio.run(run(broken=False))
+        self.assertEqual("".join(d["content"] for d in deltas), "Once upon a time")
+
+        # Broken midway, the stream fails as the portal does, having held its slot of the governor until then
+        with self.assertRaises(GptPortal.ServiceNotAvailableError):
+            asyncio.run(run(broken=True))
+        self.assertEqual(inFlight, [1, 1])
+        self.assertEqual(governor.inFlight, 0)
+
+        # Stopped early, the request keeps only its estimate charged: 14 tokens of prompt, 256 of completion
+        RateLimiter.configure("test-stream-model", 6000, 6000)
+        asyncio.run(run(broken=False, take=1))
+        self.assertEqual(governor.inFlight, 0)
+        self.assertAlmostEqual(RateLimiter.of("sk-test-stream", "test-stream-model").tokens.level, 6000 - 270, delta=5)
+
+    def test_completionBatch(self):
+        requested = []
+
+        async def completions(request: web.Request) -> web.Response:
+            body = await request.json()
+            requested.append(body["prompt"])
+            if any("poison" in p for p in body["prompt"]):
+                return web.json_response({"error": {"message": "Invalid prompt"}}, status=400)
+
+            n = body.get("n", 1)
+            choices = [
+                {"text": f" {p.upper()} {k}", "index": i * n + k, "finish_reason": "stop"}
+                for i, p in enumerate(body["prompt"]) for k in range(n)
+            ]
+            return web.json_response({"choices": list(reversed(choices))})
+
+        async def run(prompts, **kwargs):
+            app = web.Application()
+            app.router.add_post("/v1/completions", completions)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+
+            try:
+                async with GptPortal("sk-test", access="http", baseUrl=f"http://127.0.0.1:{port}/v1") as portal:
+                    with patch.object(GptPortal, "estimateTokensMany", side_effect=lambda texts, model=None: [10] * len(texts)):
+                        return await portal.completionBatch(prompts, maxBatchItems=4, **kwargs)
+            finally:
+                await runner.cleanup()
+
+        prompts = [f"p{i}" for i in range(10)]
+        results = asyncio.run(run(prompts))
+        self.assertEqual(results, [f"P{i} 0" for i in range(10)])
+        self.assertEqual(sorted(len(r) for r in requested), [2, 4, 4])
+
+        results = asyncio.run(run(["a", "b"], n=2))
+        self.assertEqual(results, [["A 0", "A 1"], ["B 0", "B 1"]])
+
+        # Token limit: 10 prompt + 100 completion tokens each
+        requested.clear()
+        asyncio.run(run(prompts, max_tokens=100, maxBatchTokens=250))
+        self.assertEqual(len(requested), 5)
+
+        # A rejected batch is bisected until the offending prompt is isolated
+        requested.clear()
+        prompts[5] = "poison"
+        results = asyncio.run(run(prompts))
+        self.assertIsNone(results[5])
+        self.assertEqual([r for i, r in enumerate(results) if i != 5], [f"P{i} 0" for i in range(10) if i != 5])
+        self.assertIn(["poison"], requested)
+
+    def test_tokenBudgeting(self):
+        self.assertEqual(GptPortal.contextWindowOf("gpt-4-32k-0613"), 32768)
+        self.assertEqual(GptPortal.contextWindowOf("gpt-4-0613"), 8192)
+        self.assertIsNone(GptPortal.contextWindowOf("my-own-model"))
+
+        sent = []
+
+        async def complete(**kwargs):
+            sent.append(kwargs)
+            return {"choices": [{"message": {"role": "assistant", "content": "done"}, "finish_reason": "stop"}]}
+
+        async def run(tokenBudgeting: str, words: int, **kwargs):
+            portal = GptPortal("sk-test-budget", tokenBudgeting=tokenBudgeting)
+            messages = [{"role": "user", "content": " ".join(["word"] * words)}]
+            with (
+                patch("openai.ChatCompletion.acreate", side_effect=complete),
+                patch.object(GptPortal, "estimateTokensMany",
+                             side_effect=lambda texts, model=None: [len(t.split()) for t in texts]),
+            ):
+                return await portal.chatCompletion(messages, model="gpt-4", **kwargs)
+
+        # Prompt of 4000 + 4 tokens leaves 4188 tokens of gpt-4 to complete
+        asyncio.run(run("clamp", 4000, max_tokens=6000))
+        self.assertEqual(sent[-1]["max_tokens"], 4188)
+
+        asyncio.run(run("clamp", 4000, max_tokens=1000))
+        self.assertEqual(sent[-1]["max_tokens"], 1000)
+
+        sent.clear()
+        with self.assertRaises(GptPortal.TooManyTokensError):
+            asyncio.run(run("raise", 4000, max_tokens=6000))
+        with self.assertRaises(GptPortal.TooManyTokensError):
+            asyncio.run(run("clamp", 9000))
+        self.assertEqual(sent, [])
+
+        # Without budgeting, the server is left to decide
+        asyncio.run(run(None, 9000))
+        self.assertEqual(len(sent), 1)
+
     def test_httpAccess(self):
         url = "https://api.openai.com/v1/chat/completions"
         key = os.environ['OPENAI_KEY']
@@ -0,0 +1,125 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.HedgePolicy import HedgePolicy
+from cjw.aistory.utilities.RateLimiter import RateLimiter
+
+
+class HedgePolicyTest(unittest.TestCase):
+    def test_delay(self):
+        policy = HedgePolicy(percentile=90, minSamples=10)
+        self.assertIsNone(policy.delay("gpt-4"))
+
+        for latency in range(1, 11):
+            policy.record("gpt-4", latency / 10)
+        self.assertEqual(policy.delay("gpt-4"), 0.9)
+        self.assertIsNone(policy.delay("gpt-3.5-turbo"))
+
+    def test_budget(self):
+        policy = HedgePolicy(budget=0.1)
+        for _ in range(25):
+            policy.delay("gpt-4")
+        self.assertEqual([policy.allow() for _ in range(3)], [True, True, False])
+
+    def test_portal(self):
+        calls = 0
+        slow = set()
+
+        async def complete(**kwargs):
+            nonlocal calls
+            calls += 1
+            content = kwargs["messages"][0]["content"]
+            if content in slow:
+                slow.discard(content)  # Only the first try is stuck
+                await asyncio.sleep(2)
+            elif content in ["warm up 3", "warm up 7"]:
+                await asyncio.sleep(0.3)
+            else:
+                await asyncio.sleep(0.01)
+            return {"choices": [{"message": {"role": "assistant", "content": "done"}, "finish_reason": "stop"}]}
+
+        async def run(policy: HedgePolicy):
+            portal = GptPortal("sk-test-hedged", hedgePolicy=policy)
+            with patch("openai.ChatCompletion.acreate", side_effect=complete):
+                for i in range(20):
+                    await portal.chatCompletion([{"role": "user", "content": f"warm up {i}"}])
+
+                slow.add("stuck")
+                start = time.monotonic()
+                result = await portal.chatCompletion([{"role": "user", "content": "stuck"}])
+                return result, time.monotonic() - start
+
+        policy = HedgePolicy(percentile=80, budget=0.1, minSamples=10)
+        result, elapsed = asyncio.run(run(policy))
+        self.assertEqual(result["content"], "done")
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(calls, 22)
+        self.assertEqual((policy.hedges, policy.wins), (1, 1))
+        self.assertAlmostEqual(policy.saved, 0.28, delta=0.05)  # Estimated by the slow warm-ups
+
+        # Out of budget, the slow request is waited for
+        calls = 0
+        policy = HedgePolicy(percentile=80, budget=0, minSamples=10)
+        _, elapsed = asyncio.run(run(policy))
+        self.assertGreater(elapsed, 1.5)
+        self.assertEqual(calls, 21)
+
+    def test_losingHedgeCharged(self):
+        stuck = None
+        limiter = None
+        draining = False
+
+        async def complete(**kwargs):
+            nonlocal stuck
+            if kwargs["messages"][0]["content"] == "stuck" and stuck:
+                seconds, stuck = stuck, None
+                if draining:
+                    limiter.requests.level = 0  # The hedge has to wait for a request of capacity
+                await asyncio.sleep(seconds)
+            else:
+                await asyncio.sleep(0.01)
+            return {
+                "choices": [{"message": {"role": "assistant", "content": "done"}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+
+        def estimateMany(texts, model=None):
+            return [500] * len(texts)
+
+        async def run(key: str, seconds: float, drain: bool = False):
+            nonlocal stuck, limiter, draining
+            RateLimiter.configure("test-hedge-model", 60, 6000)  # A request and 100 tokens per second
+            limiter = RateLimiter.of(key, "test-hedge-model")
+            draining = drain
+            policy = HedgePolicy(percentile=80, budget=1, minSamples=5)
+            portal = GptPortal(key, hedgePolicy=policy, rateLimited=True)
+            with patch("openai.ChatCompletion.acreate", side_effect=complete), \
+                    patch.object(GptPortal, "estimateTokens", return_value=500), \
+                    patch.object(GptPortal, "estimateTokensMany", side_effect=estimateMany):
+                for i in range(5):
+                    await portal.chatCompletion(
+                        [{"role": "user", "content": f"warm up {i}"}], model="test-hedge-model", max_tokens=100
+                    )
+                stuck = seconds
+                await portal.chatCompletion(
+                    [{"role": "user", "content": "stuck"}], model="test-hedge-model", max_tokens=100
+                )
+                await asyncio.sleep(0.01)  # Lets the losing request finish cancelling
+            return policy, limiter.requests.level, limiter.tokens.level
+
+        # The stuck request was sent before losing to the hedge, so it stays charged its request and estimate
+        policy, requests, tokens = asyncio.run(run("sk-test-hedge-sent", 2))
+        self.assertEqual((policy.hedges, policy.wins), (1, 1))
+        self.assertAlmostEqual(requests, 60 - 7, delta=0.5)
+        self.assertAlmostEqual(tokens, 6000 - 604, delta=30)
+
+        # Waiting for the rate limiter, the hedge was never sent and gives its estimate back
+        policy, _, tokens = asyncio.run(run("sk-test-hedge-unsent", 0.3, drain=True))
+        self.assertEqual((policy.hedges, policy.wins), (1, 0))
+        self.assertAlmostEqual(tokens, 6000, delta=5)
+
+if __name__ == '__main__':
+    unittest.main()
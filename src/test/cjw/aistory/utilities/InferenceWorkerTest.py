@@ -0,0 +1,100 @@
+import asyncio
+import time
+import unittest
+
+from cjw.aistory.utilities.Deadline import Deadline
+from cjw.aistory.utilities.InferenceWorker import InferenceWorker
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+
+
+class InferenceWorkerTest(unittest.TestCase):
+    @classmethod
+    def generate(cls, prompt: str, seconds: float = 0.2) -> str:
+        time.sleep(seconds)  # Blocks like a local model does
+        if prompt == "fail":
+            raise ValueError("Out of memory")
+        return prompt.upper()
+
+    def test_responsiveLoop(self):
+        async def go(worker: InferenceWorker):
+            ticks = 0
+            busy = True
+
+            async def tick():
+                nonlocal ticks
+                while busy:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.create_task(tick())
+            start = time.monotonic()
+            generations = asyncio.gather(*[worker.run(self.generate, p) for p in ["once", "upon", "a time"]])
+            await asyncio.sleep(0.05)
+            depth = worker.queueDepth()
+            results = await generations
+            elapsed = time.monotonic() - start
+            busy = False
+            await ticker
+
+            with self.assertRaises(ValueError):
+                await worker.run(self.generate, "fail", seconds=0)
+
+            return results, elapsed, ticks, depth
+
+        worker = InferenceWorker()
+        results, elapsed, ticks, depth = asyncio.run(go(worker))
+
+        self.assertEqual(results, ["ONCE", "UPON", "A TIME"])
+        self.assertGreater(elapsed, 0.55)  # One prompt at a time
+        self.assertGreater(ticks, 30)  # The loop kept running meanwhile
+        self.assertEqual(depth, 2)
+
+        stats = worker.stats()
+        self.assertEqual(stats["completed"], 4)
+        self.assertEqual(stats["queueDepth"], 0)
+        self.assertAlmostEqual(stats["meanCompute"], 0.15, delta=0.05)
+        self.assertGreater(stats["meanWait"], 0.1)  # The second and third waited for the first ones
+
+        worker.close()
+        with self.assertRaises(RuntimeError):
+            asyncio.run(worker.run(self.generate, "late"))
+
+    def test_priority(self):
+        Priority = RequestScheduler.Priority
+        order = []
+
+        def generate(prompt: str) -> str:
+            order.append(prompt)
+            return self.generate(prompt, seconds=0.05)
+
+        async def go(worker: InferenceWorker):
+            first = asyncio.create_task(worker.run(generate, "first"))
+            await asyncio.sleep(0.01)  # Running, the others wait behind it
+
+            late = Deadline.after(0.02)
+            results = await asyncio.gather(
+                worker.run(generate, "batch", priority=Priority.BATCH),
+                worker.run(generate, "condense", priority=Priority.CONDENSE),
+                worker.run(generate, "late", priority=Priority.CONDENSE, deadline=late),
+                worker.run(generate, "interactive", priority=Priority.INTERACTIVE),
+                return_exceptions=True,
+            )
+            await first
+
+            with self.assertRaises(InferenceWorker.DeadlineExceededError):
+                await worker.run(generate, "expired", deadline=late)
+
+            return results
+
+        worker = InferenceWorker()
+        results = asyncio.run(go(worker))
+        worker.close()
+
+        self.assertEqual(order, ["first", "interactive", "condense", "batch"])
+        self.assertEqual(results[:2], ["BATCH", "CONDENSE"])
+        self.assertIsInstance(results[2], InferenceWorker.DeadlineExceededError)
+        self.assertEqual(worker.stats()["expired"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import gc
+import importlib.util
+import os
+import resource
+import time
+import unittest
+
+from cjw.aistory.utilities.LlamaBackend import LlamaBackend
+
+
+class LlamaBackendBenchmark(unittest.TestCase):
+    """
+    Compares the load time, resident memory and tokens per second on CPU of the transformers pipeline and of a GGUF
+    model run by llama.cpp.
+
+    Set LLAMA_BENCHMARK_MODEL to the Hugging Face model for the pipeline, and LLAMA_BENCHMARK_GGUF to the path of the
+    GGUF file of the same model, e.g. a q8_0 quantization of it.
+    """
+
+    MODEL = os.environ.get("LLAMA_BENCHMARK_MODEL", "gpt2")
+    GGUF = os.environ.get("LLAMA_BENCHMARK_GGUF")
+    PROMPTS = 4
+    NEW_TOKENS = 64
+
+    @classmethod
+    def __residentMemory(cls) -> int:
+        # Current resident set on Linux; elsewhere, the peak one is the best available
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def __measure(self, engine: str, modelName: str, **kwargs):
+        gc.collect()
+        before = self.__residentMemory()
+        start = time.perf_counter()
+        backend = LlamaBackend.of(engine, modelName, **kwargs)
+        loadTime = time.perf_counter() - start
+        resident = self.__residentMemory() - before
+
+        prompts = [f"Chapter {i}. The knight rode into the dark forest and" for i in range(self.PROMPTS)]
+        backend.generate(prompts[:1], maxTokens=8, temperature=0)  # Warm up
+        start = time.perf_counter()
+        completions = backend.generate(prompts, maxTokens=self.NEW_TOKENS, temperature=0)
+        elapsed = time.perf_counter() - start
+        tokens = sum(backend.countTokens(c) for c in completions)
+
+        print(
+            f"{engine}: loaded in {loadTime:.1f}s, {resident / 2 ** 20:.0f} MiB resident, "
+            f"{backend.memoryFootprint() / 2 ** 20:.0f} MiB of weights, {tokens / elapsed:.1f} tokens/s"
+        )
+        backend.close()
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "Needs torch")
+    def test_pipeline(self):
+        self.__measure(LlamaBackend.PIPELINE, self.MODEL, dtype="float32", deviceMap="cpu")
+
+    @unittest.skipUnless(importlib.util.find_spec("llama_cpp") and GGUF, "Needs llama_cpp and LLAMA_BENCHMARK_GGUF")
+    def test_gguf(self):
+        self.__measure(LlamaBackend.GGUF, self.GGUF, threads=os.cpu_count(), batchSize=512)
+
+
+if __name__ == '__main__':
+    unittest.main()
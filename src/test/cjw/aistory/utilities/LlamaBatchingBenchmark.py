@@ -0,0 +1,65 @@
+import asyncio
+import importlib.util
+import os
+import time
+import unittest
+
+from cjw.aistory.utilities.LlamaBackend import LlamaBackend
+from cjw.aistory.utilities.LlamaPortal import LlamaPortal
+from cjw.aistory.utilities.ModelRegistry import ModelRegistry
+
+
+@unittest.skipUnless(importlib.util.find_spec("torch"), "Needs torch")
+class LlamaBatchingBenchmark(unittest.TestCase):
+    """
+    Measures the tokens per second of LlamaPortal completing concurrent prompts on CPU, with the prompts batched up to
+    each size.
+
+    Set LLAMA_BENCHMARK_MODEL to the Hugging Face model to use; a small one keeps the run short.
+    """
+
+    MODEL = os.environ.get("LLAMA_BENCHMARK_MODEL", "gpt2")
+    PROMPTS = 32
+    NEW_TOKENS = 32
+    BATCH_SIZES = [1, 2, 4, 8, 16]
+
+    def test_throughput(self):
+        import torch
+
+        torch.manual_seed(23)
+        registry = ModelRegistry(idleTimeout=None, sweepInterval=0)
+        prompts = [f"Chapter {i}. The knight rode into the dark forest and" for i in range(self.PROMPTS)]
+
+        async def go(portal: LlamaPortal, size: int) -> float:
+            await portal.completion(prompts[0], maxTokens=8, temperature=0)  # Loads the model and warms it up
+            start = time.perf_counter()
+            completions = await asyncio.gather(*[
+                portal.completion(p, maxTokens=self.NEW_TOKENS, temperature=0) for p in prompts
+            ])
+            elapsed = time.perf_counter() - start
+
+            self.assertEqual(len(completions), self.PROMPTS)
+            self.assertLessEqual(max(portal.stats()["batching"]["sizes"]), size)
+            backend = portal.model.loaded.backend
+            return sum(backend.countTokens(c[0]) for c in completions) / elapsed
+
+        for size in self.BATCH_SIZES:
+            # Each batch size loads a model of its own, unloaded before the next
+            portal = LlamaPortal.of(
+                self.MODEL,
+                engine=LlamaBackend.PIPELINE,
+                registry=registry,
+                dtype="float32",
+                deviceMap="cpu",
+                maxBatch=size,
+                batchWindow=0.02,
+            )
+            throughput = asyncio.run(go(portal, size))
+            print(f"batch {size}: {throughput:.1f} tokens/s")
+
+            portal.close()
+            registry.unload(portal.model.key)
+
+
+if __name__ == '__main__':
+    unittest.main()
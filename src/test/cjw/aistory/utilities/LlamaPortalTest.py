@@ -0,0 +1,143 @@
+import asyncio
+import time
+import unittest
+from typing import List, Tuple
+
+from cjw.aistory.utilities.Deadline import Deadline
+from cjw.aistory.utilities.LlamaBackend import LlamaBackend
+from cjw.aistory.utilities.LlamaPortal import LlamaPortal
+from cjw.aistory.utilities.ModelRegistry import ModelRegistry
+from cjw.aistory.utilities.UsageLedger import UsageLedger
+
+
+class LlamaPortalTest(unittest.TestCase):
+    class Backend(LlamaBackend):
+        """Completes prompts by reversing their words, blocking for a while per batch like a real model."""
+        loads = 0
+
+        def __init__(self, modelName: str, **kwargs):
+            time.sleep(0.1)
+            LlamaPortalTest.Backend.loads += 1
+            self.threads = kwargs.get("threads")
+            self.batches = []
+            self.prefilled = []
+
+        def generate(self, prompts: List[str], maxTokens: int = None, temperature: float = None) -> List[str]:
+            time.sleep(0.05)
+            self.batches.append(len(prompts))
+            return [" ".join(reversed(p.split()))[:maxTokens] for p in prompts]
+
+        def tokenize(self, text: str) -> List[int]:
+            return [len(word) for word in text.split()]
+
+        def prefill(self, state: Tuple[int, ...], tokens: List[int]) -> Tuple[int, ...]:
+            time.sleep(0.001 * len(tokens))
+            self.prefilled.append(len(tokens))
+            return (state or ()) + tuple(tokens)
+
+        def decode(self, state: Tuple[int, ...], maxTokens: int = None, temperature: float = None) -> Tuple[str, str]:
+            return f"Heard {len(state)} tokens", "stop"
+
+        def stateSize(self, state: Tuple[int, ...]) -> int:
+            return 100 * len(state)
+
+        def countTokens(self, text: str) -> int:
+            return len(text.split())
+
+        def memoryFootprint(self) -> int:
+            return 1000
+
+    def test_completion(self):
+        self.Backend.loads = 0
+        registry = ModelRegistry(sweepInterval=0)
+
+        async def go():
+            portals = [
+                LlamaPortal.of("llama-test.gguf", engine=self.Backend, registry=registry, threads=2, maxBatch=4)
+                for _ in range(3)
+            ]
+            prompts = [f"once upon a time {i}" for i in range(6)]
+            completions = await asyncio.gather(
+                *[portals[i % 3].completion(p) for i, p in enumerate(prompts)],
+                portals[0].completion("the end", maxTokens=3),
+            )
+            return portals, completions
+
+        portals, completions = asyncio.run(go())
+
+        self.assertEqual(self.Backend.loads, 1)
+        self.assertEqual(completions[0], ["0 time a upon once"])
+        self.assertEqual(completions[6], ["end"])
+
+        backend = portals[0].model.loaded.backend
+        self.assertEqual(backend.threads, 2)
+        self.assertEqual(sorted(backend.batches), [1, 2, 4])
+
+        stats = portals[1].stats()
+        self.assertEqual(stats["completed"], 3)
+        self.assertEqual(stats["batching"]["items"], 7)
+        self.assertEqual(registry.memoryUsed(), 1000)
+
+        # Loaded with other options, or by another engine, the model is not shared
+        others = [
+            LlamaPortal.of("llama-test.gguf", engine=self.Backend, registry=registry, threads=4, maxBatch=4),
+            LlamaPortal.of("llama-test.gguf", engine="gguf", registry=registry, threads=2, maxBatch=4),
+            LlamaPortal.of("llama-test.gguf", engine=self.Backend, registry=registry, threads=2, maxBatch=4, key="hf"),
+        ]
+        self.assertEqual(len({portal.model.key for portal in portals + others}), 3)
+        self.assertEqual(others[2].model.key, portals[0].model.key)  # The access token does not change the model
+
+    def test_chatCompletion(self):
+        registry = ModelRegistry(sweepInterval=0)
+        ledger = UsageLedger()
+        portal = LlamaPortal.of(
+            "llama-chat.gguf", engine=self.Backend, registry=registry, prefixCacheBytes=20000, ledger=ledger
+        )
+
+        messages = [
+            {"role": "system", "content": "You are a storyteller. " * 20},
+            {"role": "user", "content": "Tell me about the dragon"},
+        ]
+
+        async def go():
+            responses = []
+            for turn in range(3):
+                response = (await portal.chatCompletion(messages, temperature=0.9, tags={"purpose": "test"}))[0]
+                responses.append(response)
+                messages.append({"role": "assistant", "content": response["content"]})
+                messages.append({"role": "user", "content": f"And then {turn}?"})
+
+            with self.assertRaises(LlamaPortal.DeadlineExceededError):
+                await portal.chatCompletion(messages, deadline=Deadline.after(0))
+            return responses
+
+        responses = asyncio.run(go())
+        backend = portal.model.loaded.backend
+
+        # The first turn prefills the whole history, the next ones only the reply and the new question
+        self.assertEqual(backend.prefilled, [89, 9, 9])
+        self.assertEqual([r["reusedMessages"] for r in responses], [0, 2, 4])
+        self.assertEqual([r["prefilledTokens"] for r in responses], [89, 9, 9])
+        self.assertEqual(responses[2]["content"], "Heard 107 tokens")
+        self.assertEqual(responses[2]["finish_reason"], "stop")
+        self.assertEqual(responses[2]["usage"]["prompt_tokens"], 107)
+
+        # Every turn is charged its whole prompt, however little of it was prefilled
+        totals = ledger.totals(by=["purpose"])
+        self.assertEqual(totals["purpose=test"]["calls"], 3)
+        self.assertEqual(totals["purpose=test"]["promptTokens"], 89 + 98 + 107)
+        self.assertEqual(totals["purpose=test"]["completionTokens"], 9)
+
+        # The state of each history was extended into the next one, so only the latest is left
+        stats = portal.stats()["prefixes"]
+        self.assertEqual(stats, {"states": 1, "size": 10700, "hits": 2, "misses": 1, "evictions": 0})
+
+    def test_engines(self):
+        self.assertEqual(LlamaBackend.engineOf("models/llama-2-7b-chat.Q8_0.gguf"), LlamaBackend.GGUF)
+        self.assertEqual(LlamaBackend.engineOf("meta-llama/Llama-2-7b-chat-hf"), LlamaBackend.PIPELINE)
+        with self.assertRaises(ValueError):
+            LlamaBackend.of("onnx", "llama")
+
+
+if __name__ == '__main__':
+    unittest.main()
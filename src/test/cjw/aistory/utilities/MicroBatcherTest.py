@@ -0,0 +1,67 @@
+import asyncio
+import time
+import unittest
+
+from cjw.aistory.utilities.MicroBatcher import MicroBatcher
+
+
+class MicroBatcherTest(unittest.TestCase):
+    def test_batching(self):
+        calls = []
+
+        async def generate(prompts, temperature=0):
+            calls.append((list(prompts), temperature))
+            await asyncio.sleep(0.05)
+            if "fail" in prompts:
+                raise ValueError("Out of memory")
+            return [f"{p.upper()} at {temperature}" for p in prompts]
+
+        async def go():
+            batcher = MicroBatcher(generate, window=0.05, maxBatch=4)
+
+            start = time.monotonic()
+            results = await asyncio.gather(*[batcher.submit(f"p{i}") for i in range(6)])
+            elapsed = time.monotonic() - start
+
+            # Only prompts with the same generation parameters share a batch
+            mixed = await asyncio.gather(batcher.submit("a"), batcher.submit("b", temperature=1), batcher.submit("c"))
+
+            failed = await asyncio.gather(batcher.submit("ok"), batcher.submit("fail"), return_exceptions=True)
+
+            return batcher, results, elapsed, mixed, failed
+
+        batcher, results, elapsed, mixed, failed = asyncio.run(go())
+
+        self.assertEqual(results, [f"P{i} at 0" for i in range(6)])
+        self.assertEqual(calls[0], (["p0", "p1", "p2", "p3"], 0))  # Sent as soon as it was full
+        self.assertEqual(calls[1], (["p4", "p5"], 0))  # Sent when the window closed
+        self.assertLess(elapsed, 0.2)
+
+        self.assertEqual(mixed, ["A at 0", "B at 1", "C at 0"])
+        self.assertIn((["a", "c"], 0), calls)
+        self.assertIn((["b"], 1), calls)
+
+        self.assertTrue(all(isinstance(e, ValueError) for e in failed))
+
+        stats = batcher.stats()
+        self.assertEqual(stats["batches"], 5)
+        self.assertEqual(stats["items"], 11)
+        self.assertEqual(stats["sizes"], {1: 1, 2: 3, 4: 1})
+
+    def test_noWindow(self):
+        sizes = []
+
+        async def generate(prompts):
+            sizes.append(len(prompts))
+            return prompts
+
+        async def go():
+            batcher = MicroBatcher(generate, window=0)
+            return await asyncio.gather(*[batcher.submit(i) for i in range(3)])
+
+        self.assertEqual(asyncio.run(go()), [0, 1, 2])
+        self.assertEqual(sizes, [1, 1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import threading
+import time
+import unittest
+
+from cjw.aistory.bots.LlamaBot import LlamaBot
+from cjw.aistory.utilities.ModelRegistry import ModelRegistry
+
+
+class ModelRegistryTest(unittest.TestCase):
+    class Model:
+        loads = 0
+
+        def __init__(self, name: str, size: int):
+            time.sleep(0.1)
+            ModelRegistryTest.Model.loads += 1
+            self.name = name
+            self.size = size
+            self.closed = False
+
+        def memoryFootprint(self) -> int:
+            return self.size
+
+        def close(self):
+            self.closed = True
+
+    def setUp(self):
+        self.Model.loads = 0
+
+    def test_sharing(self):
+        registry = ModelRegistry(idleTimeout=0.2, sweepInterval=0)
+
+        def acquire():
+            return registry.acquire(("llama", "float16", None), lambda: self.Model("llama", 100), self.Model.close)
+
+        handles = [acquire() for _ in range(4)]
+        self.assertIsNone(handles[0].loaded)  # Loads lazily
+        self.assertEqual(self.Model.loads, 0)
+
+        models = []
+        threads = [threading.Thread(target=lambda h=h: models.append(h.get())) for h in handles]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(self.Model.loads, 1)
+        self.assertTrue(all(m is models[0] for m in models))
+        self.assertEqual(registry.stats()["('llama', 'float16', None)"]["references"], 4)
+
+        # Not while in use, but once idle for the timeout
+        with handles[0].using():
+            time.sleep(0.3)
+            registry.sweep()
+            self.assertIs(handles[1].loaded, models[0])
+        time.sleep(0.3)
+        registry.sweep()
+        self.assertIsNone(handles[1].loaded)
+        self.assertTrue(models[0].closed)
+
+        # Loads again on next use
+        self.assertIsNot(handles[2].get(), models[0])
+        self.assertEqual(self.Model.loads, 2)
+
+        for handle in handles:
+            handle.release()
+            handle.release()
+        registry.unload(("llama", "float16", None))
+        self.assertEqual(registry.stats(), {})
+
+    def test_memoryPressure(self):
+        registry = ModelRegistry(idleTimeout=None, memoryLimit=250, sweepInterval=0)
+        small = registry.acquire("small", lambda: self.Model("small", 100))
+        medium = registry.acquire("medium", lambda: self.Model("medium", 120))
+        large = registry.acquire("large", lambda: self.Model("large", 140))
+
+        small.get()
+        with medium.using():
+            medium.get()
+            large.get()
+
+            # The least recently used model not in use made room
+            self.assertIsNone(small.loaded)
+            self.assertIsNotNone(medium.loaded)
+            self.assertIsNotNone(large.loaded)
+            self.assertEqual(registry.memoryUsed(), 260)
+
+        # Used last, the medium one stays
+        registry.sweep()
+        self.assertEqual(registry.memoryUsed(), 120)
+
+    def test_llamaBots(self):
+        registry = ModelRegistry.shared()
+        bots = [LlamaBot.of("llama2-7b", key="hf-test") for _ in range(4)]
+        stats = registry.stats()["('meta-llama/Llama-2-7b-chat-hf', 'pipeline', 'float16', None, ())"]
+        self.assertEqual(stats["references"], 4)
+        self.assertFalse(stats["loaded"])
+
+        bots[0].withKey("hf-other")
+        self.assertEqual(registry.stats()["('meta-llama/Llama-2-7b-chat-hf', 'pipeline', 'float16', None, ())"]["references"], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
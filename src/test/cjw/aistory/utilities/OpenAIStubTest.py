@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.OpenAIStub import OpenAIStub
+from cjw.aistory.utilities.RetryPolicy import RetryPolicy
+
+
+class OpenAIStubTest(unittest.TestCase):
+    messages = [{"role": "user", "content": "Tell me a story"}]
+
+    @classmethod
+    async def serve(cls, stub: OpenAIStub, call):
+        async with stub:
+            async with GptPortal("sk-stub", access="http", baseUrl=stub.url) as portal:
+                with patch.object(GptPortal, "estimateTokens", side_effect=lambda text, model=None: len(text.split())), \
+                        patch.object(GptPortal, "estimateTokensMany",
+                                     side_effect=lambda texts, model=None: [len(t.split()) for t in texts]):
+                    return await call(portal)
+
+    def test_chatCompletion(self):
+        stub = OpenAIStub(completionTokens=3, seed=1)
+        result = asyncio.run(self.serve(stub, lambda portal: portal.chatCompletion(self.messages)))
+        self.assertEqual((result["pieces"], result["finish_reason"]), (1, "stop"))
+        self.assertEqual(len(result["content"].split()), 3)
+
+        # Every piece is cut short by max_tokens
+        stub = OpenAIStub(completionTokens=10, seed=1)
+        result = asyncio.run(self.serve(
+            stub, lambda portal: portal.chatCompletion(self.messages, max_tokens=4, maxCompletion=2)
+        ))
+        self.assertEqual((result["pieces"], result["finish_reason"]), (3, "length"))
+        self.assertEqual(len(result["content"].split()), 12)
+        self.assertEqual(stub.stats()["completionTokens"], 12)
+        self.assertEqual(stub.stats()["requests"], 3)
+
+        results = asyncio.run(self.serve(OpenAIStub(), lambda portal: portal.completionBatch(["a b", "c"], max_tokens=8)))
+        self.assertEqual([len(r.split()) for r in results], [8, 8])
+
+    def test_stream(self):
+        async def stream(portal: GptPortal):
+            return [d async for d in portal.chatCompletionStream(self.messages, max_tokens=20)]
+
+        deltas = asyncio.run(self.serve(OpenAIStub(completionTokens=12, chunkDelay=0.001), stream))
+        self.assertEqual(len("".join(d["content"] for d in deltas).split()), 12)
+        self.assertEqual(deltas[-1]["finish_reason"], "stop")
+
+    def test_errors(self):
+        stub = OpenAIStub(errorRates={429: 1.0}, retryAfter=0.01)
+        policy = RetryPolicy(maxRetries=2, baseDelay=0.01)
+        with self.assertRaises(GptPortal.ServiceNotAvailableError):
+            asyncio.run(self.serve(stub, lambda portal: portal.chatCompletion(self.messages, retryPolicy=policy)))
+        self.assertEqual(stub.errors, {429: 3})
+
+        stub = OpenAIStub(contextWindow=5)
+        with self.assertRaises(GptPortal.TooManyTokensError):
+            asyncio.run(self.serve(stub, lambda portal: portal.chatCompletion(self.messages)))
+
+
+if __name__ == '__main__':
+    unittest.main()
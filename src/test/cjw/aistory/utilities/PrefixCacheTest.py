@@ -0,0 +1,43 @@
+import unittest
+
+from cjw.aistory.utilities.PrefixCache import PrefixCache
+
+
+class PrefixCacheTest(unittest.TestCase):
+    def test_longestPrefix(self):
+        cache = PrefixCache(capacity=1000)
+        history = ["<<SYS>> Tell a story", "The dragon [/INST]", " It slept </s>", "[INST] And then? [/INST]"]
+        keys = PrefixCache.keysOf(history)
+
+        # Rolling: a prefix has the same key in any history extending it
+        self.assertEqual(PrefixCache.keysOf(history[:2]), keys[:2])
+        self.assertNotEqual(PrefixCache.keysOf(["The dragon [/INST]"])[0], keys[1])
+
+        self.assertEqual(cache.longest(keys), (0, None))
+        cache.put(keys[0], "system", 100)
+        cache.put(keys[1], "first turn", 200)
+        self.assertEqual(cache.longest(keys), (2, "first turn"))
+        self.assertEqual(cache.longest(PrefixCache.keysOf(history[:1] + ["The knight [/INST]"])), (1, "system"))
+
+        self.assertEqual(cache.take(keys[1]), "first turn")
+        self.assertIsNone(cache.take(keys[1]))
+        self.assertEqual(cache.longest(keys), (1, "system"))
+        self.assertEqual(cache.stats()["size"], 100)
+
+    def test_eviction(self):
+        cache = PrefixCache(capacity=500)
+        keys = PrefixCache.keysOf(["a", "b", "c", "d"])
+        cache.put(keys[0], "a", 200)
+        cache.put(keys[1], "b", 200)
+        cache.longest(keys[:1])  # Uses a, so b is the least recently used
+        cache.put(keys[2], "c", 200)
+
+        self.assertEqual(cache.longest(keys[:2]), (1, "a"))
+        self.assertEqual(cache.longest(keys[:3]), (3, "c"))
+
+        cache.put(keys[3], "too large", 501)
+        self.assertEqual(cache.stats(), {"states": 2, "size": 400, "hits": 3, "misses": 0, "evictions": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+import openai
+
+from cjw.aistory.utilities.ConcurrencyGovernor import ConcurrencyGovernor
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.RateLimiter import RateLimiter
+from cjw.aistory.utilities.RetryPolicy import RetryPolicy
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_sharedPerKeyAndModel(self):
+        RateLimiter.configure("test-shared-4", 10, 1000)
+        RateLimiter.configure("test-shared-3.5", 100, 10000)
+
+        self.assertIs(RateLimiter.of("key1", "test-shared-4"), RateLimiter.of("key1", "test-shared-4"))
+        self.assertIsNot(RateLimiter.of("key1", "test-shared-4"), RateLimiter.of("key2", "test-shared-4"))
+        self.assertIsNot(RateLimiter.of("key1", "test-shared-4"), RateLimiter.of("key1", "test-shared-3.5"))
+        self.assertEqual(RateLimiter.of("key1", "test-shared-3.5").tokens.capacity, 10000)
+
+    def test_datedModels(self):
+        # Dated models take the limits of their longest listed prefix
+        self.assertEqual(RateLimiter.limitsOf("gpt-4-0613"), RateLimiter.DEFAULT_LIMITS["gpt-4"])
+        self.assertEqual(RateLimiter.limitsOf("gpt-4-32k-0613"), RateLimiter.DEFAULT_LIMITS["gpt-4-32k"])
+        self.assertEqual(RateLimiter.limitsOf("gpt-3.5-turbo-16k-0613"), RateLimiter.DEFAULT_LIMITS["gpt-3.5-turbo-16k"])
+        self.assertEqual(RateLimiter.limitsOf("test-unlisted"), RateLimiter.DEFAULT_MODEL_LIMITS)
+
+        RateLimiter.configure("test-dated", 10, 1000)
+        limiter = RateLimiter.of("key1", "test-dated-0613")
+        self.assertEqual(limiter.tokens.capacity, 1000)
+        RateLimiter.configure("test-dated", 20, 2000)
+        self.assertEqual(limiter.tokens.capacity, 2000)
+
+    def test_waitForTokens(self):
+        async def run():
+            limiter = RateLimiter(requestsPerMinute=6000, tokensPerMinute=600)  # 10 tokens per second
+
+            start = time.monotonic()
+            reservation = await limiter.acquire(600)
+            self.assertLess(time.monotonic() - start, 0.1)
+
+            # The estimate was too high.  Reconciling gives back the unused 5 tokens.
+            reservation.reconcile(595)
+            await limiter.acquire(5)
+            self.assertLess(time.monotonic() - start, 0.1)
+
+            await limiter.acquire(3)
+            return time.monotonic() - start
+
+        elapsed = asyncio.run(run())
+        self.assertGreater(elapsed, 0.25)
+        self.assertLess(elapsed, 1)
+
+    def test_waitForRequests(self):
+        async def run():
+            limiter = RateLimiter(requestsPerMinute=600, tokensPerMinute=1000000)  # 10 requests per second
+            limiter.requests.level = 1
+
+            start = time.monotonic()
+            await asyncio.gather(*[limiter.acquire(1) for _ in range(4)])
+            return time.monotonic() - start
+
+        elapsed = asyncio.run(run())
+        self.assertGreater(elapsed, 0.25)
+
+    def test_portal(self):
+        RateLimiter.configure("test-portal-model", 6000, 60)
+        response = {"choices": [{"text": "done"}], "usage": {"total_tokens": 5}}
+
+        async def run():
+            portal = GptPortal("sk-test-rate-limited", rateLimited=True)
+            with patch("openai.Completion.acreate", return_value=response), \
+                    patch.object(GptPortal, "estimateTokensMany", return_value=[5]):
+                await portal.completion("Hello", model="test-portal-model", max_tokens=50)
+            return RateLimiter.of("sk-test-rate-limited", "test-portal-model").tokens.level
+
+        # 55 tokens estimated, reconciled to the 5 actually used
+        self.assertAlmostEqual(asyncio.run(run()), 55, delta=1)
+
+    def test_portalFailure(self):
+        RateLimiter.configure("test-failure-model", 6000, 60)
+        key = "sk-test-rate-limited-failure"
+
+        def levels():
+            limiter = RateLimiter.of(key, "test-failure-model")
+            return round(limiter.tokens.level), round(limiter.requests.level)
+
+        async def fail():
+            portal = GptPortal(key, rateLimited=True)
+            with patch("openai.Completion.acreate", side_effect=ValueError("Bad request")), \
+                    patch.object(GptPortal, "estimateTokensMany", return_value=[5]):
+                with self.assertRaises(ValueError):
+                    await portal.completion("Hello", model="test-failure-model", max_tokens=50)
+
+        async def cancelBeforeSending():
+            governor = ConcurrencyGovernor(initialWindow=1, maxWindow=1)
+            portal = GptPortal(key, rateLimited=True, governor=governor)
+            with patch.object(GptPortal, "estimateTokensMany", return_value=[5]):
+                async with governor.slot():  # Keeps the request waiting for the governor
+                    task = asyncio.create_task(portal.completion("Hello", model="test-failure-model", max_tokens=50))
+                    await asyncio.sleep(0.01)
+                    task.cancel()
+                    with self.assertRaises(asyncio.CancelledError):
+                        await task
+
+        # A request failing once sent stays charged, as the server counted it
+        asyncio.run(fail())
+        self.assertEqual(levels(), (5, 5999))
+
+        # A request cancelled before it was sent gives its whole reservation back
+        RateLimiter.configure("test-failure-model", 6000, 60)
+        asyncio.run(cancelBeforeSending())
+        self.assertEqual(levels(), (60, 6000))
+
+    def test_portalRetries(self):
+        RateLimiter.configure("test-retry-model", 6, 600)  # Refills slowly during the retries
+        response = {"choices": [{"text": "done"}], "usage": {"total_tokens": 5}}
+        attempts = 0
+
+        async def rateLimited(**kwargs):
+            nonlocal attempts
+            attempts += 1
+            if attempts < 3:
+                raise openai.error.RateLimitError("Rate limit reached", headers={"retry-after-ms": "10"})
+            return response
+
+        async def run():
+            portal = GptPortal("sk-test-rate-limited-retries", rateLimited=True)
+            with patch("openai.Completion.acreate", side_effect=rateLimited), \
+                    patch.object(GptPortal, "estimateTokensMany", return_value=[5]):
+                await portal.completion(
+                    "Hello", model="test-retry-model", max_tokens=50,
+                    retryPolicy=RetryPolicy(maxRetries=2, rateLimitDelay=0.01),
+                )
+            return RateLimiter.of("sk-test-rate-limited-retries", "test-retry-model")
+
+        limiter = asyncio.run(run())
+        # Each of the three attempts is a request to the server
+        self.assertAlmostEqual(limiter.requests.level, 3, delta=0.5)
+
+if __name__ == '__main__':
+    unittest.main()
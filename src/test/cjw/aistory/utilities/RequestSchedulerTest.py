@@ -0,0 +1,80 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from cjw.aistory.utilities.ConcurrencyGovernor import ConcurrencyGovernor
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.RequestScheduler import RequestScheduler
+
+Priority = RequestScheduler.Priority
+
+
+class RequestSchedulerTest(unittest.TestCase):
+    def test_weightedFair(self):
+        scheduler = RequestScheduler(weights={Priority.INTERACTIVE: 4, Priority.CONDENSE: 2, Priority.BATCH: 1})
+        for i in range(20):
+            scheduler.push(f"b{i}", Priority.BATCH)
+            scheduler.push(f"c{i}", Priority.CONDENSE)
+            scheduler.push(f"i{i}", Priority.INTERACTIVE)
+
+        served = [scheduler.pop()[0] for _ in range(14)]
+        print(served)
+        self.assertEqual(served[0], "i")
+        self.assertEqual((served.count("i"), served.count("c"), served.count("b")), (8, 4, 2))
+        self.assertEqual(len(scheduler), 46)
+
+    def test_interactiveJumpsAhead(self):
+        scheduler = RequestScheduler()
+        for i in range(100):
+            scheduler.push(f"b{i}", Priority.BATCH)
+        scheduler.pop()
+
+        scheduler.push("player", Priority.INTERACTIVE)
+        self.assertEqual(scheduler.pop(), "player")
+
+        # An idle class gets no credit for the turns it skipped
+        for i in range(3):
+            scheduler.push(f"player{i}", Priority.INTERACTIVE)
+        self.assertEqual([scheduler.pop() for _ in range(4)], ["player0", "player1", "player2", "b1"])
+
+    def test_aging(self):
+        scheduler = RequestScheduler(aging=0.05)
+        scheduler.push("old", Priority.BATCH)
+        time.sleep(0.06)
+        for i in range(5):
+            scheduler.push(f"i{i}", Priority.INTERACTIVE)
+
+        self.assertEqual(scheduler.pop(), "old")
+        self.assertEqual(scheduler.aged, 1)
+        self.assertTrue(scheduler.remove("i3"))
+        self.assertFalse(scheduler.remove("i3"))
+        self.assertEqual(scheduler.depths(), {"INTERACTIVE": 4, "CONDENSE": 0, "BATCH": 0})
+
+    def test_governor(self):
+        """A player's turn waiting for the governor is sent before a queue of background requests."""
+        sent = []
+
+        async def complete(**kwargs):
+            sent.append(kwargs["prompt"])
+            await asyncio.sleep(0.01)
+            return {"choices": [{"text": "done"}]}
+
+        async def run():
+            governor = ConcurrencyGovernor(initialWindow=1, maxWindow=1)
+            portal = GptPortal("sk-test-scheduled", governor=governor)
+            with patch("openai.Completion.acreate", side_effect=complete):
+                crawl = [
+                    asyncio.create_task(portal.completion(f"crawl {i}", priority=Priority.BATCH)) for i in range(5)
+                ]
+                await asyncio.sleep(0.005)
+                await asyncio.gather(portal.completion("player"), *crawl)
+            return governor
+
+        governor = asyncio.run(run())
+        self.assertEqual(sent[:2], ["crawl 0", "player"])
+        self.assertEqual(governor.scheduler.stats()["BATCH"]["served"], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
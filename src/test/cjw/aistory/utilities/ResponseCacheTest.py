@@ -0,0 +1,85 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.ResponseCache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    request = {"model": "gpt-4", "messages": [{"role": "user", "content": "Hi"}], "temperature": 0}
+    response = {"choices": [{"message": {"role": "assistant", "content": "Hello"}, "finish_reason": "stop"}]}
+
+    def test_canonicalKey(self):
+        reordered = {"temperature": 0, "messages": [{"content": "Hi", "role": "user"}], "model": "gpt-4"}
+        self.assertEqual(
+            ResponseCache.keyOf("chat/completions", self.request),
+            ResponseCache.keyOf("chat/completions", reordered)
+        )
+        self.assertNotEqual(
+            ResponseCache.keyOf("chat/completions", self.request),
+            ResponseCache.keyOf("completions", self.request)
+        )
+
+    def test_memory(self):
+        cache = ResponseCache(memoryEntries=2)
+        self.assertIsNone(cache.get("chat/completions", self.request))
+        cache.put("chat/completions", self.request, self.response)
+        self.assertEqual(cache.get("chat/completions", self.request), self.response)
+
+        # The least recently used request is evicted
+        for i in range(2):
+            cache.put("chat/completions", {**self.request, "n": i + 2}, self.response)
+        self.assertIsNone(cache.get("chat/completions", self.request))
+
+        # Sampling with temperature is not cached unless allowed
+        sampling = {**self.request, "temperature": 0.9}
+        cache.put("chat/completions", sampling, self.response)
+        self.assertIsNone(cache.get("chat/completions", sampling))
+        self.assertEqual(cache.stats()["bypasses"], 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+        permissive = ResponseCache(allowNonDeterministic=True)
+        permissive.put("chat/completions", sampling, self.response)
+        self.assertEqual(permissive.get("chat/completions", sampling), self.response)
+
+    def test_disk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "responses.sqlite")
+
+            cache = ResponseCache(file, diskEntries=2)
+            for i in range(3):
+                cache.put("chat/completions", {**self.request, "n": i + 1}, self.response)
+            cache.close()
+
+            reopened = ResponseCache(file)
+            self.assertIsNone(reopened.get("chat/completions", {**self.request, "n": 1}))
+            self.assertEqual(reopened.get("chat/completions", {**self.request, "n": 3}), self.response)
+            self.assertEqual(reopened.stats()["diskHits"], 1)
+            reopened.close()
+
+            expiring = ResponseCache(file, ttl=0.05)
+            expiring.put("chat/completions", self.request, self.response)
+            time.sleep(0.1)
+            self.assertIsNone(expiring.get("chat/completions", self.request))
+            expiring.close()
+
+    def test_portal(self):
+        async def run():
+            portal = GptPortal("sk-test", cache=ResponseCache())
+            with patch("openai.ChatCompletion.acreate", return_value=self.response) as mockResponse:
+                first = await portal.chatCompletion(self.request["messages"], temperature=0)
+                second = await portal.chatCompletion(self.request["messages"], temperature=0)
+                return first, second, mockResponse.await_count
+
+        first, second, calls = asyncio.run(run())
+        self.assertEqual(first, second)
+        self.assertEqual(calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+import openai
+
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.RetryPolicy import RetryPolicy
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_delay(self):
+        policy = RetryPolicy(baseDelay=1, maxDelay=8, jitter=False)
+        self.assertEqual([policy.delay(r) for r in range(1, 6)], [1, 2, 4, 8, 8])
+
+        jittered = RetryPolicy(baseDelay=1, maxDelay=8)
+        for r in range(1, 6):
+            self.assertTrue(0 <= jittered.delay(r) <= min(8, 2 ** (r - 1)))
+
+        self.assertGreaterEqual(jittered.delay(1, rateLimited=True), jittered.rateLimitDelay)
+        self.assertGreaterEqual(jittered.delay(1, headers={"Retry-After": "7"}), 7)
+
+    def test_retryAfter(self):
+        self.assertEqual(RetryPolicy.retryAfter({"retry-after-ms": "250"}), 0.25)
+        self.assertEqual(RetryPolicy.retryAfter({"Retry-After": "3"}), 3)
+        self.assertIsNone(RetryPolicy.retryAfter({"Content-Type": "application/json"}))
+
+        headers = {
+            "x-ratelimit-remaining-requests": "10",
+            "x-ratelimit-reset-requests": "6m0s",
+            "x-ratelimit-remaining-tokens": "0",
+            "x-ratelimit-reset-tokens": "1.5s",
+        }
+        self.assertEqual(RetryPolicy.retryAfter(headers), 1.5)
+
+        self.assertEqual(RetryPolicy.parseDuration("1h2m3.5s"), 3723.5)
+        self.assertEqual(RetryPolicy.parseDuration("20ms"), 0.02)
+        self.assertIsNone(RetryPolicy.parseDuration("soon"))
+
+    def test_deadline(self):
+        async def run():
+            schedule = RetryPolicy(maxRetries=5, baseDelay=10, jitter=False, deadline=1).start()
+            start = time.monotonic()
+            retrying = await schedule.backoff()
+            return retrying, time.monotonic() - start
+
+        retrying, elapsed = asyncio.run(run())
+        self.assertFalse(retrying)
+        self.assertLess(elapsed, 0.5)
+
+    def test_backoffDoesNotBlock(self):
+        """While one call backs off from rate limiting, other coroutines keep running."""
+        attempts = 0
+
+        async def rateLimited(**kwargs):
+            nonlocal attempts
+            attempts += 1
+            if attempts < 3:
+                raise openai.error.RateLimitError("Rate limit reached", headers={"retry-after-ms": "200"})
+            return {"choices": [{"text": "done"}]}
+
+        async def run():
+            ticks = 0
+            finished = False
+
+            async def ticker():
+                nonlocal ticks
+                while not finished:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            tickerTask = asyncio.create_task(ticker())
+            portal = GptPortal("sk-test")
+            policy = RetryPolicy(maxRetries=3, baseDelay=0.01, rateLimitDelay=0.1)
+            with patch("openai.Completion.acreate", side_effect=rateLimited):
+                result = await portal.completion("Hello", retryPolicy=policy)
+            finished = True
+            await tickerTask
+            return result, ticks
+
+        result, ticks = asyncio.run(run())
+        self.assertEqual(result, "done")
+        self.assertEqual(attempts, 3)
+        # Two back-offs of at least 0.2s each.  A blocking sleep would have let the ticker run only once.
+        self.assertGreater(ticks, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.SingleFlight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_coalescing(self):
+        calls = 0
+
+        async def slowCall():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return calls
+
+        async def run():
+            flights = SingleFlight()
+            results = await asyncio.gather(*[flights.do("same", slowCall) for _ in range(5)])
+            other = await flights.do("other", slowCall)
+            return results, other, flights.stats()
+
+        results, other, stats = asyncio.run(run())
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(other, 2)
+        self.assertEqual(stats, {"calls": 2, "coalesced": 4, "inFlight": 0})
+
+    def test_cancellation(self):
+        started = 0
+        cancelled = False
+
+        async def slowCall():
+            nonlocal started, cancelled
+            started += 1
+            try:
+                await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            return "done"
+
+        async def run():
+            flights = SingleFlight()
+
+            # Cancelling one of the waiters leaves the shared call running for the other
+            first = asyncio.create_task(flights.do("key", slowCall))
+            second = asyncio.create_task(flights.do("key", slowCall))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            self.assertEqual(await second, "done")
+            self.assertTrue(first.cancelled())
+            self.assertFalse(cancelled)
+
+            # Cancelling all the waiters cancels the shared call
+            only = asyncio.create_task(flights.do("key", slowCall))
+            await asyncio.sleep(0.01)
+            only.cancel()
+            await asyncio.sleep(0.01)
+            self.assertTrue(cancelled)
+            self.assertEqual(flights.inFlight(), 0)
+
+        asyncio.run(run())
+        self.assertEqual(started, 2)
+
+    def test_portal(self):
+        response = {"choices": [{"message": {"role": "assistant", "content": "Hello"}, "finish_reason": "stop"}]}
+        messages = [{"role": "user", "content": "Hi"}]
+
+        async def slowResponse(**kwargs):
+            await asyncio.sleep(0.05)
+            return response
+
+        async def run():
+            portal = GptPortal("sk-test")
+            with patch("openai.ChatCompletion.acreate", side_effect=slowResponse) as mockResponse:
+                await asyncio.gather(*[portal.chatCompletion(messages, temperature=0) for _ in range(3)])
+                await asyncio.gather(*[portal.chatCompletion(messages, temperature=0.9) for _ in range(3)])
+                return mockResponse.await_count, portal.singleFlight.coalesced
+
+        calls, coalesced = asyncio.run(run())
+        self.assertEqual(calls, 4)
+        self.assertEqual(coalesced, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import random
+import re
+import time
+import unittest
+
+from cjw.aistory.utilities.TokenCounter import TokenCounter
+
+
+class TokenCounterBenchmark(unittest.TestCase):
+    """
+    Compares counting the messages of a growing story one by one, in batches, and with the memo warm.
+
+    A regular expression stands in for the tokenizer, with a fixed cost per tokenizer call like the real ones.
+    """
+
+    MESSAGES = 200
+    ROUNDS = 50
+    CALL_OVERHEAD = 0.0002
+
+    __words = re.compile(r"\w+|[^\w\s]")
+
+    @classmethod
+    def __encoder(cls):
+        def encode(texts):
+            time.sleep(cls.CALL_OVERHEAD)
+            return [len(cls.__words.findall(t)) for t in texts]
+        return encode
+
+    @classmethod
+    def __story(cls):
+        random.seed(23)
+        vocabulary = "the knight dragon castle rode into dark forest and found a sword , . !".split()
+        return [" ".join(random.choices(vocabulary, k=random.randint(20, 120))) for _ in range(cls.MESSAGES)]
+
+    def test_throughput(self):
+        TokenCounter.register("benchmark", self.__encoder)
+        story = self.__story()
+        encode = self.__encoder()
+
+        def perCall():
+            return sum(encode([m])[0] for m in story)
+
+        def batched():
+            return sum(encode(story))
+
+        counter = TokenCounter.of("benchmark")
+
+        def memoized():
+            return sum(counter.countMany(story))
+
+        expected = perCall()
+        for name, count in [("per call", perCall), ("batched", batched), ("memoized", memoized)]:
+            start = time.perf_counter()
+            for _ in range(self.ROUNDS):
+                self.assertEqual(count(), expected)
+            elapsed = time.perf_counter() - start
+            print(f"{name}: {self.MESSAGES * self.ROUNDS / elapsed:.0f} counts/s")
+
+        print(counter.stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
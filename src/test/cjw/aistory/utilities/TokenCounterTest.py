@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import patch
+
+from cjw.aistory.utilities.TokenCounter import TokenCounter
+
+
+class TokenCounterTest(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+
+        def whitespace():
+            def encode(texts):
+                self.batches.append(list(texts))
+                return [len(t.split()) for t in texts]
+            return encode
+
+        TokenCounter.register("test-whitespace", whitespace)
+
+    def test_memoized(self):
+        counter = TokenCounter.of("test-whitespace")
+        self.assertEqual(counter.count("Once upon a time"), 4)
+        self.assertEqual(counter.count("Once upon a time"), 4)
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(counter.stats(), {"hits": 1, "misses": 1, "entries": 1})
+        self.assertEqual(counter.count(""), 0)
+
+    def test_countMany(self):
+        counter = TokenCounter.of("test-whitespace")
+        counter.count("a dragon")
+
+        counts = counter.countMany(["a dragon", "the knight rode", "", "the knight rode", "to the castle"])
+        self.assertEqual(counts, [2, 3, 0, 3, 3])
+        # Only the uncached texts are tokenized, once each and in a single call
+        self.assertEqual(self.batches, [["a dragon"], ["the knight rode", "to the castle"]])
+
+    def test_bounded(self):
+        counter = TokenCounter("test-whitespace", cacheEntries=2)
+        counter.countMany(["one", "two two", "three three three"])
+        self.assertEqual(counter.stats()["entries"], 2)
+
+        counter.count("one")
+        self.assertEqual(self.batches[-1], ["one"])  # Evicted as the least recently used
+
+    def test_fallback(self):
+        # An encoding tiktoken cannot load, e.g. offline before its first download, is counted with GPT-2 instead
+        counter = TokenCounter("test-unloadable")
+        gpt2 = lambda: lambda texts: [len(t.split()) for t in texts]
+        with patch("tiktoken.get_encoding", side_effect=ConnectionError("Offline")), \
+                patch.object(TokenCounter, "_TokenCounter__gpt2", side_effect=gpt2), \
+                self.assertLogs(TokenCounter.logger, "WARNING") as logs:
+            self.assertEqual(counter.count("Once upon a time"), 4)
+            self.assertEqual(counter.count("the knight rode"), 3)
+        self.assertEqual(len(logs.records), 1)  # Warned once, when the encoder is first needed
+
+    def test_forModel(self):
+        self.assertEqual(TokenCounter.forModel("gpt-3.5-turbo-16k").encoding, "cl100k_base")
+        self.assertEqual(TokenCounter.forModel("gpt-4").encoding, "cl100k_base")
+        self.assertEqual(TokenCounter.forModel("text-davinci-003").encoding, "p50k_base")
+        self.assertEqual(TokenCounter.forModel("llama-2-7b").encoding, TokenCounter.DEFAULT_ENCODING)
+        self.assertIs(TokenCounter.forModel("gpt-4"), TokenCounter.of("cl100k_base"))
+
+
+if __name__ == '__main__':
+    unittest.main()
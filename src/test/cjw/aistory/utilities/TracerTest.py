@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from cjw.aistory.adventure.Condenser import Condenser
+from cjw.aistory.adventure.GptTeller import GptTeller
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.OpenAIStub import OpenAIStub
+from cjw.aistory.utilities.Tracer import Tracer
+
+
+class TracerTest(unittest.TestCase):
+    def test_nesting(self):
+        tracer = Tracer()
+
+        async def child(i: int):
+            with tracer.span("child", index=i):
+                await asyncio.sleep(0.01)
+
+        async def run():
+            with tracer.span("root") as root:
+                await asyncio.gather(*[child(i) for i in range(3)])
+                root.set(children=3)
+            return root
+
+        root = asyncio.run(run())
+        self.assertIsNone(Tracer.current())
+        spans = tracer.trace(root.traceId)
+        self.assertEqual([s.name for s in spans], ["root", "child", "child", "child"])
+        self.assertTrue(all(s.parentId == root.spanId for s in spans[1:]))
+        self.assertGreaterEqual(root.duration(), 0.01)
+        self.assertEqual(root.attributes, {"children": 3})
+
+        with self.assertRaises(ValueError):
+            with tracer.span("failing"):
+                raise ValueError("Bad")
+        self.assertEqual(tracer.finished[-1].error, "ValueError: Bad")
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for exportFormat in [Tracer.JSONL, Tracer.OTLP]:
+                file = os.path.join(directory, f"traces.{exportFormat}")
+                tracer = Tracer(file, exportFormat=exportFormat)
+                with tracer.span("root", story="dragon"):
+                    with tracer.span("child", tokens=10):
+                        pass
+
+                with open(file) as f:
+                    lines = [json.loads(line) for line in f]
+
+                if exportFormat == Tracer.JSONL:
+                    self.assertEqual([s["name"] for s in lines], ["child", "root"])
+                    self.assertEqual(lines[0]["parentId"], lines[1]["spanId"])
+                else:
+                    spans = lines[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+                    self.assertEqual(len(lines), 1)
+                    self.assertEqual(spans[0]["attributes"], [{"key": "tokens", "value": {"intValue": "10"}}])
+                    self.assertEqual(spans[0]["parentSpanId"], spans[1]["spanId"])
+
+    def test_orphans(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "traces.jsonl")
+            tracer = Tracer(file, maxPending=2)
+
+            async def straggler():
+                with tracer.span("straggler"):
+                    await asyncio.sleep(0.02)
+
+            async def run():
+                with tracer.span("root"):
+                    task = asyncio.create_task(straggler())
+                    await asyncio.sleep(0.01)
+                await task
+
+            # A child ending after its root was exported follows it on its own
+            asyncio.run(run())
+            with open(file) as f:
+                self.assertEqual([json.loads(line)["name"] for line in f], ["root", "straggler"])
+
+            # Spans whose root this tracer never sees end, e.g. opened by another tracer, are not kept forever
+            other = Tracer()
+            for i in range(3):
+                with other.span("foreign"):
+                    with tracer.span("child", index=i):
+                        pass
+            with open(file) as f:
+                self.assertEqual([json.loads(line)["attributes"] for line in f][2:], [{"index": 0}])
+
+    def test_callChain(self):
+        tracer = Tracer()
+        Tracer.setShared(tracer)
+
+        async def run():
+            async with OpenAIStub(completionTokens=5) as stub:
+                async with GptPortal("sk-traced", access="http", baseUrl=stub.url) as portal:
+                    condenser = Condenser(GptTeller(portal))
+                    return await condenser.condense("Once upon a time there was a dragon.")
+
+        try:
+            asyncio.run(run())
+        finally:
+            Tracer.setShared(None)
+
+        spans = tracer.trace(tracer.finished[-1].traceId)
+        self.assertEqual(
+            [s.name for s in spans],
+            ["Condenser.condense", "GptTeller.generate", "GptPortal.request", "GptPortal.send"]
+        )
+        self.assertEqual(spans[-1].attributes["completion_tokens"], 5)
+        self.assertEqual(spans[1].attributes["teller"], "gpt")
+
+
+if __name__ == '__main__':
+    unittest.main()
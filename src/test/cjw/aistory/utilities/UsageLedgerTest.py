@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from cjw.aistory.utilities.GptPortal import GptPortal
+from cjw.aistory.utilities.OpenAIStub import OpenAIStub
+from cjw.aistory.utilities.UsageLedger import UsageLedger
+
+
+class UsageLedgerTest(unittest.TestCase):
+    def test_costOf(self):
+        self.assertAlmostEqual(UsageLedger.costOf("gpt-4-0613", 1000, 500), 0.06)
+        self.assertAlmostEqual(UsageLedger.costOf("gpt-4-32k", 1000, 0), 0.06)
+        self.assertEqual(UsageLedger.costOf("my-own-model", 1000, 1000), 0)
+
+    def test_totals(self):
+        ledger = UsageLedger()
+        usage = {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+        ledger.record("gpt-4", usage, {"story": "dragon", "purpose": "generate"})
+        ledger.record("gpt-4", usage, {"story": "dragon", "purpose": "condense"})
+        ledger.record("gpt-4", usage, {"story": "dragon", "purpose": "condense", "actor": None})
+        ledger.record("gpt-3.5-turbo", usage, {"story": "castle", "purpose": "generate"})
+
+        byPurpose = ledger.totals(by=["purpose"])
+        self.assertEqual(byPurpose["purpose=condense"]["calls"], 2)
+        self.assertEqual(byPurpose["purpose=generate"]["totalTokens"], 240)
+
+        byStory = ledger.totals(by=["story", "model"])
+        self.assertAlmostEqual(byStory["story=dragon,model=gpt-4"]["cost"], 3 * 0.0042)
+        self.assertEqual(len(ledger.totals()), 3)
+        self.assertEqual(ledger.calls, 4)
+
+        ledger.reset()
+        self.assertEqual((ledger.totals(), ledger.calls), ({}, 0))
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "usage", "ledger.jsonl")
+            ledger = UsageLedger(file, exportInterval=0)
+            ledger.record("gpt-4", {"prompt_tokens": 10, "completion_tokens": 5}, {"purpose": "generate"})
+            ledger.record("gpt-4", {"prompt_tokens": 10, "completion_tokens": 5}, {"purpose": "generate"})
+
+            with open(file) as f:
+                snapshots = [json.loads(line) for line in f]
+            self.assertEqual(len(snapshots), 2)
+            self.assertEqual(snapshots[-1]["totals"]["model=gpt-4,purpose=generate"]["totalTokens"], 30)
+
+    def test_portal(self):
+        ledger = UsageLedger()
+        messages = [{"role": "user", "content": "Tell me a story"}]
+
+        async def run():
+            async with OpenAIStub(completionTokens=5) as stub:
+                portal = GptPortal("sk-ledger", access="http", baseUrl=stub.url, ledger=ledger)
+                tags = {"story": "dragon", "purpose": "generate"}
+                # Identical requests in flight share one call and its cost
+                await asyncio.gather(*[
+                    portal.chatCompletion(messages, temperature=0, tags=tags) for _ in range(3)
+                ])
+                await portal.completion("Once upon a time", model="text-davinci-003", tags={"purpose": "test"})
+                await portal.aclose()
+
+        asyncio.run(run())
+        totals = ledger.totals(by=["purpose"])
+        self.assertEqual(totals["purpose=generate"]["calls"], 1)
+        self.assertEqual(totals["purpose=generate"]["promptTokens"], 4 + 4)
+        self.assertEqual(totals["purpose=generate"]["completionTokens"], 5)
+        self.assertEqual(totals["purpose=test"]["calls"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()